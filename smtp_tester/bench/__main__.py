@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+from ..cli import MarkerArgumentParser
+from .harness import BASELINE_FILE, REFERENCE, compare, default_scenarios, format_table, load_baseline, run_scenario, save_baseline
+
+
+def parse_args() -> argparse.Namespace:
+    parser = MarkerArgumentParser(description="Benchmark the runner against local fake SMTP servers")
+    parser.add_argument("--scenarios", nargs="*", help="Scenario names to run (default: all)")
+    parser.add_argument("--list", action="store_true", help="List scenarios and exit")
+    parser.add_argument("--baseline", default=str(BASELINE_FILE), help="Baseline JSON file")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per scenario; the fastest one is reported")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.3, help=f"Allowed drop of throughput relative to {REFERENCE} (fraction)"
+    )
+    parser.add_argument("--update-baseline", action="store_true", help="Store these results as the new baseline")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.repeat < 1:
+        print("[!] --repeat must be at least 1")
+        sys.exit(2)
+    scenarios = default_scenarios()
+    if args.list:
+        for scenario in scenarios:
+            print(scenario.name)
+        return
+    if args.scenarios:
+        known = {scenario.name for scenario in scenarios}
+        missing = set(args.scenarios) - known
+        if missing:
+            print(f"[!] unknown scenario(s): {', '.join(sorted(missing))}")
+            sys.exit(2)
+        # The reference always runs, since every other scenario is measured against it.
+        wanted = set(args.scenarios) | {REFERENCE}
+        scenarios = [scenario for scenario in scenarios if scenario.name in wanted]
+    results = []
+    for scenario in scenarios:
+        print(f"[*] running {scenario.name}")
+        try:
+            runs = [run_scenario(scenario) for _ in range(args.repeat)]
+            results.append(max(runs, key=lambda result: result.sessions_per_sec))
+        except (OSError, RuntimeError) as exc:
+            print(f"[!] {exc}")
+            sys.exit(1)
+    for line in format_table(results):
+        print(line)
+    baseline_path = Path(args.baseline)
+    if args.update_baseline:
+        save_baseline(results, baseline_path)
+        print(f"[+] baseline written to {baseline_path}")
+        return
+    failures = compare(results, load_baseline(baseline_path), args.tolerance)
+    for failure in failures:
+        print(f"[!] regression {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
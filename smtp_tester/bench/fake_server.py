@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import asyncio
+import socket
+import threading
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+
+@dataclass
+class ServerBehavior:
+    banner_delay: float = 0.0
+    reply_delay: float = 0.0
+    # Extra 250- lines in the EHLO reply.
+    multiline: int = 2
+    # Close the connection without replying to the Nth command (0 = never).
+    drop_after: int = 0
+    # Accept connections but never send a byte.
+    silent: bool = False
+
+
+class FakeSMTPServer:
+    """Minimal SMTP responder on one port of several loopback addresses, served from a background event loop."""
+
+    def __init__(self, behavior: ServerBehavior, addresses: Sequence[str] = ("127.0.0.1",), port: int = 0):
+        self.behavior = behavior
+        self.addresses = list(addresses)
+        self.port = port
+        self.connections = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._servers: List[asyncio.AbstractServer] = []
+        self._ready = threading.Event()
+        self._error: Optional[BaseException] = None
+
+    def __enter__(self) -> "FakeSMTPServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._serve, name="fake-smtp", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+
+    def stop(self) -> None:
+        if self._loop is None or self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+
+    def _serve(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._bind())
+        except BaseException as exc:  # noqa: BLE001
+            self._error = exc
+            self._ready.set()
+            self._loop.close()
+            return
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            for server in self._servers:
+                server.close()
+            for task in asyncio.all_tasks(self._loop):
+                task.cancel()
+            self._loop.run_until_complete(asyncio.sleep(0))
+            self._loop.close()
+
+    async def _bind(self) -> None:
+        # The runner uses one port for every MX IP, so all addresses must share it.
+        for _ in range(20):
+            port = self.port or _free_port(self.addresses[0])
+            try:
+                for address in self.addresses:
+                    self._servers.append(await asyncio.start_server(self._handle, address, port, backlog=1024))
+            except OSError:
+                for server in self._servers:
+                    server.close()
+                self._servers = []
+                if self.port:
+                    raise
+                continue
+            self.port = port
+            return
+        raise OSError(f"no common free port on {len(self.addresses)} loopback address(es)")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        behavior = self.behavior
+        self.connections += 1
+        try:
+            if behavior.silent:
+                await reader.read()
+                return
+            if behavior.banner_delay:
+                await asyncio.sleep(behavior.banner_delay)
+            writer.write(b"220 bench.invalid ESMTP\r\n")
+            commands = 0
+            in_data = False
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                if in_data:
+                    if line.rstrip(b"\r\n") != b".":
+                        continue
+                    in_data = False
+                    reply = b"250 2.0.0 queued\r\n"
+                    verb = b""
+                else:
+                    commands += 1
+                    if behavior.drop_after and commands >= behavior.drop_after:
+                        return
+                    verb = line.split(b" ", 1)[0].strip().upper()
+                    reply = self._reply(verb)
+                    in_data = verb == b"DATA"
+                if behavior.reply_delay:
+                    await asyncio.sleep(behavior.reply_delay)
+                writer.write(reply)
+                await writer.drain()
+                if verb == b"QUIT":
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _reply(self, verb: bytes) -> bytes:
+        if verb in {b"EHLO", b"HELO"}:
+            lines = [b"bench.invalid"] + [f"X-BENCH-{index}".encode("ascii") for index in range(self.behavior.multiline)]
+            lines.append(b"8BITMIME")
+            return b"".join(b"250-" + line + b"\r\n" for line in lines[:-1]) + b"250 " + lines[-1] + b"\r\n"
+        if verb == b"DATA":
+            return b"354 end with .\r\n"
+        if verb == b"QUIT":
+            return b"221 2.0.0 bye\r\n"
+        return b"250 2.0.0 ok\r\n"
+
+
+def _free_port(address: str) -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind((address, 0))
+        return probe.getsockname()[1]
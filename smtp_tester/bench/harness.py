@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from ..core.timing import TIMINGS_FILE, RunTimings
+from .fake_server import FakeSMTPServer, ServerBehavior
+
+
+BASELINE_FILE = Path(__file__).with_name("baseline.json")
+# Throughput is compared as a multiple of this scenario's from the same run, so the baseline holds on any machine.
+REFERENCE = "baseline-sync"
+_SUMMARY = re.compile(r"\[\*\] summary: (\d+) session\(s\)")
+_RUN_TIME = re.compile(r"\[\*\] run time: ([\d.]+)s")
+
+_TASK_PY = '''TEMPLATES = {
+    "mail": [
+        b"EHLO {ehlo}\\r\\n",
+        b"MAIL FROM:<{mail_from}>\\r\\n",
+        b"RCPT TO:<{rcpt_to}>\\r\\n",
+        b"DATA\\r\\n",
+        b"Subject: bench\\r\\n\\r\\n{body}\\r\\n.\\r\\n",
+        b"QUIT\\r\\n",
+    ],
+}
+
+TASKS = [
+    {
+        "name": "bench_mail",
+        "template": "mail",
+        "values": {
+            "ehlo": b"bench.invalid",
+            "mail_from": b"bench@bench.invalid",
+            "rcpt_to": b"user@bench.invalid",
+            "body": b"%s",
+        },
+    },
+]
+'''
+
+
+@dataclass
+class Scenario:
+    name: str
+    behavior: ServerBehavior = field(default_factory=ServerBehavior)
+    engine: str = "sync"
+    domains: int = 500
+    ips_per_domain: int = 2
+    addresses: int = 8
+    body_bytes: int = 512
+    config: Dict[str, object] = field(default_factory=dict)
+
+
+@dataclass
+class BenchResult:
+    scenario: str
+    sessions: int
+    seconds: float
+    sessions_per_sec: float
+    p50_ms: float
+    p99_ms: float
+    bytes_logged: int
+    peak_rss_kb: int
+
+
+def default_scenarios() -> List[Scenario]:
+    scenarios = []
+    for engine in ("sync", "async"):
+        scenarios += [
+            Scenario(f"baseline-{engine}", engine=engine),
+            Scenario(f"banner_delay-{engine}", ServerBehavior(banner_delay=0.02), engine=engine, domains=100),
+            Scenario(f"reply_latency-{engine}", ServerBehavior(reply_delay=0.005), engine=engine, domains=100),
+            Scenario(f"multiline-{engine}", ServerBehavior(multiline=50), engine=engine),
+            Scenario(f"drop-{engine}", ServerBehavior(drop_after=2), engine=engine),
+            Scenario(
+                f"silent-{engine}",
+                ServerBehavior(silent=True),
+                engine=engine,
+                domains=10,
+                config={"banner_timeout": 0.2},
+            ),
+        ]
+    scenarios.append(Scenario("segments-async", engine="async", config={"log_format": "segments"}))
+    scenarios.append(
+        Scenario("capture-async", engine="async", config={"capture_max_bytes": 256, "capture_success_sample": 0.1})
+    )
+    return scenarios
+
+
+def write_batch(root: Path, scenario: Scenario, port: int, addresses: List[str]) -> Path:
+    batch = root / f"bench_{scenario.name.replace('-', '_')}"
+    batch.mkdir(parents=True)
+    config = {
+        "connect_timeout": 2.0,
+        "command_timeout": 2.0,
+        "banner_timeout": 2.0,
+        "delay_between_hosts": 0,
+        "port": port,
+        "log_dir": str(root / "log"),
+        "engine": scenario.engine,
+    }
+    config.update(scenario.config)
+    (batch / "config.py").write_text(f"CONFIG = {config!r}\n", encoding="utf-8")
+    (batch / "task.py").write_text(_TASK_PY % ("x" * scenario.body_bytes), encoding="utf-8")
+    lines = []
+    for index in range(scenario.domains):
+        lines.append(f"d{index}.bench.invalid:")
+        lines.append(f"- hostname: mx.d{index}.bench.invalid")
+        lines.append("  preference: 10")
+        lines.append("  ips:")
+        for offset in range(scenario.ips_per_domain):
+            lines.append(f"  - {addresses[(index + offset) % len(addresses)]}")
+    (batch / "mx_target.yaml").write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return batch
+
+
+def run_scenario(scenario: Scenario, workdir: Optional[Path] = None) -> BenchResult:
+    addresses = [f"127.0.{index // 250}.{index % 250 + 1}" for index in range(scenario.addresses)]
+    with tempfile.TemporaryDirectory(prefix="smtp-bench-", dir=workdir) as tmp, FakeSMTPServer(
+        scenario.behavior, addresses
+    ) as server:
+        root = Path(tmp)
+        batch = write_batch(root, scenario, server.port, addresses)
+        process = subprocess.Popen(
+            [sys.executable, "-m", "smtp_tester.cli", "--batch", str(batch)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            cwd=Path(__file__).resolve().parents[2],
+        )
+        assert process.stdout is not None
+        output = process.stdout.read()
+        process.stdout.close()
+        # wait4 reports the rusage of this one child, so every scenario gets its own peak RSS.
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode != 0:
+            raise RuntimeError(f"{scenario.name}: runner exited with {process.returncode}:\n{output.decode(errors='replace')[-2000:]}")
+        text = output.decode("utf-8", errors="replace")
+        match = _SUMMARY.search(text)
+        sessions = int(match.group(1)) if match else 0
+        # The runner's own run time, so interpreter startup and imports do not count against throughput.
+        match = _RUN_TIME.search(text)
+        if match is None:
+            raise RuntimeError(f"{scenario.name}: runner did not print its run time")
+        seconds = float(match.group(1))
+        run_dirs = list((root / "log").glob(f"{batch.name}_*"))
+        p50 = p99 = 0.0
+        bytes_logged = 0
+        if run_dirs:
+            run_dir = run_dirs[0]
+            bytes_logged = sum(path.stat().st_size for path in run_dir.rglob("*") if path.is_file())
+            timings_path = run_dir / TIMINGS_FILE
+            if timings_path.exists():
+                total = RunTimings.load(timings_path).histograms["all"].get("", {}).get("total")
+                if total is not None:
+                    p50, p99 = total.quantile(0.5), total.quantile(0.99)
+    return BenchResult(
+        scenario=scenario.name,
+        sessions=sessions,
+        seconds=round(seconds, 3),
+        sessions_per_sec=round(sessions / seconds, 1) if seconds else 0.0,
+        p50_ms=round(p50 * 1000, 2),
+        p99_ms=round(p99 * 1000, 2),
+        bytes_logged=bytes_logged,
+        peak_rss_kb=usage.ru_maxrss,
+    )
+
+
+def relative_throughput(results: List[BenchResult]) -> Dict[str, float]:
+    """Each scenario's sessions per second as a multiple of the REFERENCE scenario's in the same run."""
+    reference = next((result for result in results if result.scenario == REFERENCE), None)
+    if reference is None or not reference.sessions_per_sec:
+        return {}
+    return {result.scenario: round(result.sessions_per_sec / reference.sessions_per_sec, 3) for result in results}
+
+
+def compare(results: List[BenchResult], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """Scenarios whose relative throughput dropped more than `tolerance` below the stored ratio."""
+    failures = []
+    stored = baseline.get("relative", {}) if baseline.get("reference") == REFERENCE else {}
+    for scenario, ratio in relative_throughput(results).items():
+        expected = stored.get(scenario)
+        if expected and ratio < expected * (1 - tolerance):
+            failures.append(f"{scenario}: {ratio:.2f}x {REFERENCE} < baseline {expected:.2f}x (-{tolerance:.0%})")
+    return failures
+
+
+def load_baseline(path: Path = BASELINE_FILE) -> Dict[str, dict]:
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def save_baseline(results: List[BenchResult], path: Path = BASELINE_FILE) -> None:
+    data = load_baseline(path)
+    relative = dict(data.get("relative", {})) if data.get("reference") == REFERENCE else {}
+    relative.update(relative_throughput(results))
+    data = {"reference": REFERENCE, "relative": relative}
+    path.write_text(json.dumps(data, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+
+
+def format_table(results: List[BenchResult]) -> List[str]:
+    ratios = relative_throughput(results)
+    header: Tuple[str, ...] = ("scenario", "sessions", "sess/s", "x ref", "p50 ms", "p99 ms", "logged", "rss KB")
+    rows = [header] + [
+        (
+            result.scenario,
+            str(result.sessions),
+            f"{result.sessions_per_sec:.1f}",
+            f"{ratios[result.scenario]:.2f}" if result.scenario in ratios else "-",
+            f"{result.p50_ms:.2f}",
+            f"{result.p99_ms:.2f}",
+            str(result.bytes_logged),
+            str(result.peak_rss_kb),
+        )
+        for result in results
+    ]
+    widths = [max(len(row[column]) for row in rows) for column in range(len(header))]
+    return ["  ".join(cell.ljust(width) for cell, width in zip(row, widths)) for row in rows]
+
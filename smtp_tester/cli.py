@@ -1,13 +1,37 @@
 from __future__ import annotations
 
 import argparse
+import itertools
+import sqlite3
 import sys
+import time
+from datetime import datetime
 from pathlib import Path
+from typing import Iterable, List, Optional
 
+from .core.async_runner import AsyncBatchRunner
 from .core.config_loader import load_config
-from .core.mx_loader import load_mx_targets
-from .core.runner import BatchRunner
+from .core.distributed import Coordinator, parse_address, run_worker
+from .core.models import MXRecord, TaskDefinition
+from .core.mx_cache import cache_path_for, cached_record_count, ensure_mx_cache, iter_cached_mx_targets
+from .core.mx_loader import iter_mx_targets
+from .core.plan import (
+    PlannedDomain,
+    PlanSummary,
+    compile_plan,
+    latest_timings,
+    plan_meta,
+    read_plan,
+    read_plan_meta,
+    task_estimates,
+    write_plan,
+)
+from .core.results_index import INDEX_FILE, ResultsIndex, run_name
+from .core.runner import BatchRunner, format_summary
+from .core.segment_log import convert_segments
+from .core.sharding import run_sharded
 from .core.task_loader import TaskLoader
+from .core.timing import TIMINGS_FILE, RunTimings
 
 
 class MarkerArgumentParser(argparse.ArgumentParser):
@@ -22,13 +46,178 @@ class MarkerArgumentParser(argparse.ArgumentParser):
 
 def parse_args() -> argparse.Namespace:
     parser = MarkerArgumentParser(description="Direct SMTP sender against MX servers")
-    parser.add_argument("--batch", required=True, help="Path to batch directory containing task.py/config.py/mx_target.yaml")
+    parser.add_argument("--batch", help="Path to batch directory containing task.py/config.py/mx_target.yaml")
     parser.add_argument("--tasks", nargs="*", help="Optional task names to run")
-    return parser.parse_args()
+    parser.add_argument("--engine", choices=["sync", "async"], help="Execution engine (default from config, sync)")
+    parser.add_argument("--concurrency", type=int, help="Concurrent sessions for the async engine")
+    parser.add_argument("--workers", type=int, help="Worker processes; MX records are sharded by domain")
+    parser.add_argument("--rebuild-mx-cache", action="store_true", help="Re-parse mx_target.yaml and rewrite its compiled cache (with mx_cache on)")
+    parser.add_argument("--resume", metavar="RUN_DIR", help="Continue an interrupted run, skipping sessions in its journal")
+    parser.add_argument("--plan", "--dry-run", action="store_true", help="Compile the run into a plan, print session counts and an ETA, and exit")
+    parser.add_argument("--save-plan", metavar="PATH", help="Write the compiled plan to PATH (implies --plan)")
+    parser.add_argument("--from-plan", metavar="PATH", help="Run exactly the sessions of a saved plan instead of mx_target.yaml")
+    parser.add_argument("--coordinator", metavar="ADDRESS", help="Serve the run's units to workers on host:port or unix:/path instead of running them")
+    parser.add_argument("--worker", metavar="ADDRESS", help="Run units pulled from the coordinator at ADDRESS (--concurrency connections)")
+    parser.add_argument("--convert-segments", metavar="RUN_DIR", help="Rebuild YAML logs from a segment-format run directory and exit")
+    parser.add_argument("--index", nargs="+", metavar="RUN_DIR", help="(Re)build the SQLite results index for run directories and exit")
+    parser.add_argument("--report", nargs="+", metavar="RUN_DIR", help="Report status and reply code counts for runs from the results index and exit")
+    parser.add_argument("--verb", help="With --report: list replies to this command (e.g. RCPT, BANNER, BODY)")
+    parser.add_argument("--code", help="With --report: list replies with this code (550, 55x, 5xx)")
+    parser.add_argument("--limit", type=int, default=1000, help="With --report --verb/--code: most replies listed per run (default 1000)")
+    parser.add_argument("--index-db", metavar="PATH", help=f"Results index file (default: {INDEX_FILE} next to the run directories)")
+    args = parser.parse_args()
+    if args.coordinator and args.worker:
+        parser.error("--coordinator and --worker are mutually exclusive")
+    if args.worker and (args.resume or args.from_plan or args.plan or args.save_plan or args.tasks):
+        parser.error("--worker takes its units from the coordinator; pass run options to the coordinator")
+    if not args.batch and not (args.convert_segments or args.index or args.report):
+        parser.error("the following arguments are required: --batch")
+    return args
+
+
+def convert(run_dir: str) -> None:
+    path = Path(run_dir).expanduser().resolve()
+    truncated: List[str] = []
+    try:
+        counts = convert_segments(path, truncated)
+    except (OSError, ValueError) as exc:
+        print(f"[!] conversion failed: {exc}")
+        sys.exit(1)
+    for name in truncated:
+        print(f"[!] {name} is truncated; converted the records before the cut")
+    print(f"[+] converted {sum(counts.values())} session(s) into {len(counts)} domain file(s) under {path}")
+
+
+def open_index(run_dirs: List[Path], db_path: Optional[str]) -> ResultsIndex:
+    return ResultsIndex(Path(db_path).expanduser() if db_path else run_dirs[0].parent / INDEX_FILE)
+
+
+def build_index(run_dirs: List[str], db_path: Optional[str]) -> None:
+    paths = [Path(run_dir).expanduser().resolve() for run_dir in run_dirs]
+    try:
+        index = open_index(paths, db_path)
+        try:
+            for path in paths:
+                if not path.is_dir():
+                    raise ValueError(f"run directory {path} not found")
+                print(f"[+] indexed {index.rebuild(path)} session(s) from {path} into {index.path}")
+        finally:
+            index.close()
+    except (OSError, ValueError, sqlite3.Error) as exc:
+        print(f"[!] indexing failed: {exc}")
+        sys.exit(1)
+
+
+def report(
+    run_dirs: List[str], db_path: Optional[str], verb: Optional[str], code: Optional[str], limit: int = 1000
+) -> None:
+    paths = [Path(run_dir).expanduser().resolve() for run_dir in run_dirs]
+    try:
+        index = open_index(paths, db_path)
+        try:
+            runs = []
+            for path in paths:
+                run_id = index.run_id(*run_name(path), create=False)
+                # Runs logged without results_index are indexed from their log files on first report.
+                if run_id is None or not index.session_count(run_id):
+                    if not path.is_dir():
+                        raise ValueError(f"run directory {path} not found")
+                    print(f"[*] indexed {index.rebuild(path)} session(s) from {path}")
+                    run_id = index.run_id(*run_name(path), create=False)
+                runs.append((path.name, run_id))
+            if verb or code:
+                for name, run_id in runs:
+                    # One row past the limit tells a full listing from a truncated one.
+                    rows = index.find(run_id, verb, code, limit=limit + 1)
+                    for domain, ip, task, reply_verb, reply_code, text in rows[:limit]:
+                        first_line = text.split("\n", 1)[0]
+                        print(f"{name}  {domain}  {ip}  {task}  {reply_verb}  {reply_code}  {first_line}")
+                    if len(rows) > limit:
+                        print(f"[!] {name}: listing truncated at {limit} replies, raise --limit to see more")
+                return
+            summaries = [index.summary(run_id) for _, run_id in runs]
+        finally:
+            index.close()
+    except (OSError, ValueError, sqlite3.Error) as exc:
+        print(f"[!] report failed: {exc}")
+        sys.exit(1)
+    keys = sorted({key for summary in summaries for key in summary}, key=lambda key: (not key.startswith("status "), key))
+    rows = [("",) + tuple(name for name, _ in runs)]
+    rows += [(key,) + tuple(str(summary.get(key, 0)) for summary in summaries) for key in keys]
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+
+
+def check_plan(plan_path: Path, batch_path: Path, tasks: List[TaskDefinition], selected: Optional[List[str]]) -> None:
+    meta = read_plan_meta(plan_path)
+    if meta.get("batch") != batch_path.name:
+        raise ValueError(f"{plan_path} was compiled for batch {meta.get('batch')}, not {batch_path.name}")
+    missing = set(meta.get("tasks", [])) - {task.name for task in tasks}
+    if missing:
+        raise ValueError(f"{plan_path} uses task(s) no longer in task.py: {', '.join(sorted(missing))}")
+    if selected:
+        raise ValueError("--tasks cannot be combined with --from-plan; the plan already fixes the tasks")
+
+
+def show_plan(
+    batch_path: Path,
+    config: dict,
+    tasks: List[TaskDefinition],
+    mx_records: Iterable[MXRecord],
+    plan_path: Optional[Path],
+    selected: Optional[List[str]],
+    parallel: int,
+    save_path: Optional[str],
+) -> None:
+    names = set(selected) if selected else None
+    history = latest_timings(Path(config.get("log_dir", "logs")), batch_path.name)
+    expected, worst = task_estimates(tasks, config, history[1] if history else None)
+    variants = {task.name: task.variant_count() for task in tasks if task.axes}
+    summary = PlanSummary(expected=expected, worst=worst, variants=variants)
+    domains: Iterable[PlannedDomain]
+    if plan_path:
+        domains = read_plan(plan_path)
+    else:
+        domains = compile_plan(mx_records, tasks, names, reuse=bool(config.get("session_reuse", False)))
+    if save_path:
+        target = Path(save_path).expanduser()
+        with target.open("w", encoding="utf-8") as handle:
+            for planned in write_plan(handle, plan_meta(batch_path.name, names, tasks), domains):
+                summary.add(planned)
+        print(f"[+] plan written to {target}")
+    else:
+        for planned in domains:
+            summary.add(planned)
+    for line in summary.format_lines(config, parallel):
+        print(f"[*] plan {line}")
+    if history:
+        print(f"[*] plan expected times are the median session time per task in {history[0]}")
+    else:
+        print("[*] plan expected times count only configured delays and idle waits (no earlier run with timings)")
+
+
+def resume_target(run_dir: str, batch_path: Path, config: dict) -> str:
+    """Point the config at an earlier run directory and return its run timestamp."""
+    path = Path(run_dir).expanduser().resolve()
+    prefix = f"{batch_path.name}_"
+    if not path.is_dir() or not path.name.startswith(prefix):
+        raise ValueError(f"{path} is not a run directory of batch {batch_path.name}")
+    config["log_dir"] = str(path.parent)
+    return path.name[len(prefix):]
 
 
 def main() -> None:
     args = parse_args()
+    if args.convert_segments:
+        convert(args.convert_segments)
+        return
+    if args.index:
+        build_index(args.index, args.index_db)
+        return
+    if args.report:
+        report(args.report, args.index_db, args.verb, args.code, args.limit)
+        return
     batch_path = Path(args.batch).expanduser().resolve()
     if not batch_path.exists():
         print(f"[!] batch path {batch_path} not found")
@@ -36,13 +225,50 @@ def main() -> None:
     try:
         print(f"[*] loading config from {batch_path}/config.py")
         config = load_config(batch_path)
+        run_ts = None
+        if args.resume:
+            run_ts = resume_target(args.resume, batch_path, config)
+            print(f"[*] resuming run {run_ts} in {config['log_dir']}")
         print(f"[*] loading tasks from {batch_path}/task.py")
-        tasks = TaskLoader(batch_path).load()
-        print(f"[*] loading MX targets from {batch_path}/mx_target.yaml")
-        mx_records = load_mx_targets(batch_path / "mx_target.yaml")
-        if not mx_records:
-            print("[!] No MX targets loaded")
-            sys.exit(1)
+        tasks = TaskLoader(batch_path, render_cache_size=int(config.get("render_cache_size", 1024))).load()
+        if args.worker:
+            stats = run_worker(batch_path, config, tasks, parse_address(args.worker), connections=args.concurrency or 1)
+            details = ", ".join(f"{key}={value}" for key, value in sorted(stats.items()) if key not in {"units", "sessions"})
+            print(f"[*] worker summary: {stats.get('units', 0)} unit(s), {stats.get('sessions', 0)} session(s) ({details or 'none'})")
+            return
+        mx_path = batch_path / "mx_target.yaml"
+        workers = args.workers or int(config.get("workers", 1))
+        plan_path: Optional[Path] = None
+        mx_records: Iterable[MXRecord] = ()
+        if args.from_plan:
+            plan_path = Path(args.from_plan).expanduser().resolve()
+            check_plan(plan_path, batch_path, tasks, args.tasks)
+            print(f"[*] running plan {plan_path}")
+        else:
+            print(f"[*] loading MX targets from {batch_path}/mx_target.yaml")
+            if workers > 1 and not (args.coordinator or args.plan or args.save_plan):
+                # Every shard streams the targets itself: the parent only compiles the cache they share
+                # and checks that there is a record at all.
+                if config.get("mx_cache", False):
+                    if ensure_mx_cache(mx_path, rebuild=args.rebuild_mx_cache):
+                        print(f"[*] compiled MX cache {cache_path_for(mx_path).name}")
+                    empty = not cached_record_count(mx_path)
+                else:
+                    empty = next(iter_mx_targets(mx_path), None) is None
+                if empty:
+                    print("[!] No MX targets loaded")
+                    sys.exit(1)
+            else:
+                if config.get("mx_cache", False):
+                    mx_stream = iter_cached_mx_targets(mx_path, rebuild=args.rebuild_mx_cache)
+                else:
+                    mx_stream = iter_mx_targets(mx_path)
+                # Records are streamed; only the first one is read up front to reject empty target files.
+                first_record = next(mx_stream, None)
+                if first_record is None:
+                    print("[!] No MX targets loaded")
+                    sys.exit(1)
+                mx_records = itertools.chain([first_record], mx_stream)
         if args.tasks:
             task_names = {task.name for task in tasks}
             missing = set(args.tasks) - task_names
@@ -50,8 +276,49 @@ def main() -> None:
                 print(f"[!] unknown task(s): {', '.join(sorted(missing))}")
                 print(f"[*] available tasks: {', '.join(sorted(task_names))}")
                 sys.exit(1)
-        runner = BatchRunner(batch_path, config, tasks, mx_records)
-        runner.run(args.tasks)
+        engine = args.engine or config.get("engine", "sync")
+        if args.plan or args.save_plan:
+            parallel = workers * (args.concurrency or int(config.get("concurrency", 1)) if engine == "async" else 1)
+            show_plan(batch_path, config, tasks, mx_records, plan_path, args.tasks, parallel, args.save_plan)
+            return
+        plan = read_plan(plan_path) if plan_path else None
+        started = time.monotonic()
+        if args.coordinator:
+            runner = Coordinator(
+                batch_path, config, tasks, mx_records, parse_address(args.coordinator), run_ts=run_ts, plan=plan
+            )
+            stats = runner.run(args.tasks)
+            run_dir = runner.logger.run_dir
+        elif workers > 1:
+            run_ts = run_ts or datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+            stats = run_sharded(
+                batch_path,
+                config,
+                mx_path,
+                workers,
+                selected_tasks=args.tasks,
+                engine=engine,
+                concurrency=args.concurrency,
+                run_ts=run_ts,
+                plan_path=plan_path,
+            )
+            run_dir = Path(config.get("log_dir", "logs")) / f"{batch_path.name}_{run_ts}"
+        else:
+            if engine == "async":
+                runner = AsyncBatchRunner(
+                    batch_path, config, tasks, mx_records, concurrency=args.concurrency, run_ts=run_ts, plan=plan
+                )
+                print(f"[*] async engine with concurrency={runner.concurrency}")
+            else:
+                runner = BatchRunner(batch_path, config, tasks, mx_records, run_ts=run_ts, plan=plan)
+            stats = runner.run(args.tasks)
+            run_dir = runner.logger.run_dir
+        print(f"[*] summary: {format_summary(stats)}")
+        print(f"[*] run time: {time.monotonic() - started:.3f}s")
+        timings_path = run_dir / TIMINGS_FILE
+        if timings_path.exists():
+            for line in RunTimings.load(timings_path).format_lines():
+                print(f"[*] timing {line}")
     except Exception as exc:  # noqa: BLE001
         print(f"[!] fatal error: {exc}")
         sys.exit(1)
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+from .models import MXRecord
+from .utils import read_json_store, update_json_store
+
+
+# Client option fed by each learned latency, and the session timing that samples it.
+PHASE_OPTIONS = {"connect": "connect_timeout", "banner": "banner_timeout", "reply": "command_timeout"}
+_PHASE_TIMINGS = {"connect": "connect", "banner": "banner", "reply": "first_reply"}
+STORE_FILE = "adaptive_timeouts.json"
+
+# RFC 6298 style smoothing: timeout = srtt + K * rttvar.
+_ALPHA = 0.125
+_BETA = 0.25
+
+
+class AdaptiveTimeouts:
+    """Per-IP latency estimates (hostname and domain as fallbacks) that turn into per-session timeouts."""
+
+    def __init__(
+        self,
+        path: Path,
+        defaults: Dict[str, float],
+        floor: float = 0.5,
+        ceiling: Optional[float] = None,
+        k: float = 4.0,
+        min_samples: int = 3,
+        max_entries: int = 100000,
+    ):
+        self.path = path
+        self.defaults = defaults
+        self.floor = floor
+        self.ceiling = ceiling
+        self.k = k
+        self.min_samples = max(1, min_samples)
+        self.max_entries = max_entries
+        # key ("ip:..", "host:..", "domain:..") -> {"updated": ts, phase: [srtt, rttvar, samples]}
+        self.table: Dict[str, dict] = read_json_store(path)
+        self._touched: Set[str] = set()
+
+    @classmethod
+    def from_config(cls, config: dict) -> "AdaptiveTimeouts":
+        store = config.get("adaptive_timeout_store") or Path(config.get("log_dir", "logs")) / STORE_FILE
+        ceiling = config.get("adaptive_timeout_ceiling")
+        return cls(
+            Path(store),
+            {option: float(config.get(option, 8.0)) for option in PHASE_OPTIONS.values()},
+            floor=float(config.get("adaptive_timeout_floor", 0.5)),
+            ceiling=float(ceiling) if ceiling else None,
+            k=float(config.get("adaptive_timeout_k", 4.0)),
+            min_samples=int(config.get("adaptive_timeout_min_samples", 3)),
+            max_entries=int(config.get("adaptive_timeout_max_entries", 100000)),
+        )
+
+    def timeouts_for(self, record: MXRecord) -> Dict[str, float]:
+        timeouts = dict(self.defaults)
+        for phase, option in PHASE_OPTIONS.items():
+            estimate = self._lookup(record, phase)
+            if estimate is None:
+                continue
+            srtt, rttvar, _ = estimate
+            # The static timeout stays the ceiling unless one is configured explicitly.
+            ceiling = self.ceiling if self.ceiling is not None else self.defaults[option]
+            timeouts[option] = round(min(ceiling, max(self.floor, srtt + self.k * rttvar)), 3)
+        return timeouts
+
+    def observe(self, record: MXRecord, timings: Dict[str, float], error: Optional[str]) -> None:
+        samples: Dict[str, float] = {}
+        for phase, timing in _PHASE_TIMINGS.items():
+            if timing in timings:
+                samples[phase] = timings[timing]
+        # A timeout is a censored sample: the host took at least as long as we waited.
+        if error == "timed out" and "connect" not in timings:
+            samples["connect"] = self.timeouts_for(record)["connect_timeout"]
+        elif error and error.startswith("waiting for SMTP banner") and "(timeout " in error:
+            samples["banner"] = self.timeouts_for(record)["banner_timeout"]
+        if not samples:
+            return
+        now = round(time.time())
+        for key in (f"ip:{record.ip}", f"host:{record.hostname}", f"domain:{record.domain}"):
+            entry = self.table.setdefault(key, {})
+            for phase, sample in samples.items():
+                estimate = entry.get(phase)
+                if estimate is None:
+                    entry[phase] = [sample, sample / 2, 1]
+                    continue
+                srtt, rttvar, count = estimate
+                rttvar = (1 - _BETA) * rttvar + _BETA * abs(srtt - sample)
+                srtt = (1 - _ALPHA) * srtt + _ALPHA * sample
+                entry[phase] = [round(srtt, 6), round(rttvar, 6), count + 1]
+            entry["updated"] = now
+            self._touched.add(key)
+
+    def save(self) -> None:
+        if not self._touched:
+            return
+
+        def merge(table: Dict[str, Any]) -> None:
+            # Each runner overwrites only the keys it updated, so sharded workers keep each other's entries.
+            for key in self._touched:
+                table[key] = self.table[key]
+            if len(table) > self.max_entries:
+                stale = sorted(table, key=lambda key: table[key].get("updated", 0))
+                for key in stale[: len(table) - self.max_entries]:
+                    del table[key]
+
+        update_json_store(self.path, merge)
+        self._touched.clear()
+
+    def _lookup(self, record: MXRecord, phase: str) -> Optional[List[float]]:
+        for key in (f"ip:{record.ip}", f"host:{record.hostname}", f"domain:{record.domain}"):
+            estimate = self.table.get(key, {}).get(phase)
+            if estimate is not None and estimate[2] >= self.min_samples:
+                return estimate
+        return None
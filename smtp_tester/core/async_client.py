@@ -0,0 +1,400 @@
+from __future__ import annotations
+
+import asyncio
+import socket
+import time
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from .body_stream import BODY_CHUNK, SENDFILE_CHUNK, BodyEncoder
+from .models import CommandSpec, SessionEvent
+from .reply_parser import ReplyTracker
+from .smtp_client import SMTPClient
+from .stop_rules import QUIT, StopHit, StopRule, StopWatch
+from .timing import PhaseTimer
+
+
+class AsyncSMTPClient:
+    """Event-loop counterpart of SMTPClient; timeouts and error messages mirror the blocking client."""
+
+    def __init__(
+        self,
+        host_ip: str,
+        port: int = 25,
+        connect_timeout: float = 8.0,
+        command_timeout: float = 8.0,
+        banner_timeout: float = 8.0,
+        read_chunk: int = 4096,
+        delay_before_first_command: float = 0.0,
+        delay_between_commands: float = 0.0,
+        reply_aware: bool = True,
+        body_inline_max: int = 65536,
+        body_log_head: int = 256,
+        source_address: Optional[str] = None,
+        lockstep: bool = False,
+    ):
+        self.host_ip = host_ip
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.command_timeout = command_timeout
+        self.banner_timeout = banner_timeout
+        self.read_chunk = read_chunk
+        self.delay_before_first_command = delay_before_first_command
+        self.delay_between_commands = delay_between_commands
+        self.reply_aware = reply_aware
+        self.body_inline_max = body_inline_max
+        self.body_log_head = body_log_head
+        # Local address to bind before connecting; None lets the kernel choose.
+        self.source_address = source_address
+        self.lockstep = lockstep
+        self.tracker: Optional[ReplyTracker] = None
+        self.stop: Optional[StopHit] = None
+        self._watch: Optional[StopWatch] = None
+        self.banner = b""
+        self.timer = PhaseTimer()
+        # Every recv lands in this one buffer; recorded events copy out of it.
+        self._buffer = bytearray(max(1, read_chunk))
+        self._view = memoryview(self._buffer)
+        self._banner_ready = False
+        self.sock: Optional[socket.socket] = None
+
+    async def connect(self) -> None:
+        loop = asyncio.get_running_loop()
+        self.sock = self._new_socket()
+        self.sock.setblocking(False)
+        self.timer.start()
+        try:
+            await asyncio.wait_for(loop.sock_connect(self.sock, (self.host_ip, self.port)), self.connect_timeout)
+        except asyncio.TimeoutError as exc:
+            raise socket.timeout("timed out") from exc
+        self.timer.connected()
+
+    async def race_connect(self, ips: List[str], stagger: float) -> int:
+        """Coroutine counterpart of SMTPClient.race_connect."""
+        self.timer.start()
+        pending: Dict[asyncio.Future, int] = {}
+        errors: List[str] = []
+        queue = list(enumerate(ips))
+        winner: Optional[Tuple[int, socket.socket, bytes, float]] = None
+        try:
+            while (queue or pending) and winner is None:
+                if queue:
+                    index, ip = queue.pop(0)
+                    pending[asyncio.ensure_future(self._attempt(ip))] = index
+                done, _ = await asyncio.wait(
+                    pending, timeout=stagger if queue else None, return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in done:
+                    index = pending.pop(future)
+                    if future.exception() is not None:
+                        errors.append(f"{ips[index]}: {future.exception()}")
+                    elif winner is None:
+                        winner = (index, *future.result())
+                    else:
+                        future.result()[0].close()
+        finally:
+            for future in pending:
+                future.cancel()
+            try:
+                await asyncio.gather(*pending, return_exceptions=True)
+            except BaseException:
+                # Cancelled while the losers wound down: the winner's socket goes with them.
+                if winner is not None:
+                    winner[1].close()
+                raise
+            finally:
+                # An attempt that connected before its cancel took hold still holds a socket.
+                for future in pending:
+                    if future.done() and not future.cancelled() and future.exception() is None:
+                        future.result()[0].close()
+        if winner is None:
+            raise ConnectionError(f"no MX answered ({'; '.join(errors)})")
+        index, self.sock, self.banner, connected_at = winner
+        self.timer.connected(connected_at)
+        self.timer.banner()
+        self.host_ip = ips[index]
+        self._banner_ready = True
+        return index
+
+    async def _attempt(self, ip: str) -> Tuple[socket.socket, bytes, float]:
+        loop = asyncio.get_running_loop()
+        sock = self._new_socket()
+        sock.setblocking(False)
+        try:
+            try:
+                await asyncio.wait_for(loop.sock_connect(sock, (ip, self.port)), self.connect_timeout)
+            except asyncio.TimeoutError as exc:
+                raise socket.timeout("timed out") from exc
+            connected_at = time.monotonic()
+            try:
+                banner = await asyncio.wait_for(loop.sock_recv(sock, self.read_chunk), self.banner_timeout)
+            except asyncio.TimeoutError as exc:
+                raise socket.timeout(f"no banner (timeout {self.banner_timeout}s)") from exc
+            if not banner:
+                raise ConnectionError("connection closed before banner")
+        except BaseException:
+            # Losing or cancelled attempts must not leak their sockets.
+            sock.close()
+            raise
+        return sock, banner, connected_at
+
+    def _new_socket(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.source_address:
+            try:
+                sock.bind((self.source_address, 0))
+            except OSError:
+                sock.close()
+                raise
+        return sock
+
+    def close(self) -> None:
+        if self.sock:
+            try:
+                self.sock.close()
+            finally:
+                self.sock = None
+
+    async def run_sequence(
+        self,
+        commands: List[CommandSpec],
+        events: Optional[List[SessionEvent]] = None,
+        read_banner: bool = True,
+        stop_on: Sequence[StopRule] = (),
+        lockstep: Optional[bool] = None,
+    ) -> List[SessionEvent]:
+        events = events if events is not None else []
+        if not self.sock:
+            raise RuntimeError("Socket is not connected")
+        loop = asyncio.get_running_loop()
+        lockstep = self.lockstep if lockstep is None else lockstep
+        self.stop = None
+        self._watch = StopWatch(stop_on) if stop_on else None
+        tracked = self.reply_aware or bool(stop_on) or lockstep
+        self.tracker = ReplyTracker(expect_banner=read_banner) if tracked else None
+        if read_banner:
+            if self._banner_ready:
+                self._banner_ready = False
+            else:
+                self.banner = await self._recv_data(self.banner_timeout, f"waiting for SMTP banner from {self.host_ip}:{self.port}")
+                self.timer.banner()
+            if self.banner:
+                self._record_recv(events, self.banner)
+            if self.delay_before_first_command > 0:
+                await asyncio.sleep(self.delay_before_first_command)
+        else:
+            # Later tasks of a shared session are timed from their first command.
+            self.timer.start()
+        for index, cmd in enumerate(commands):
+            if self.stop is not None:
+                break
+            self.timer.sent()
+            if cmd.body is not None:
+                await self._send_body(cmd, events)
+                preview = cmd.body.label
+            else:
+                await self._sendall(cmd.data)
+                events.append(SessionEvent(direction="send", payload=cmd.data))
+                if self.tracker:
+                    self.tracker.sent(cmd.data)
+                preview = SMTPClient._preview_command(cmd.data)
+            if self.tracker:
+                self.tracker.done_sending = index == len(commands) - 1
+            if lockstep:
+                await self._await_replies(events, f"waiting for the reply to {preview} from {self.host_ip}:{self.port}")
+            self._drain_available(
+                events,
+                f"streaming response after {preview} from {self.host_ip}:{self.port}",
+            )
+            pause = self.delay_between_commands + cmd.pause_after
+            if pause > 0:
+                deadline = loop.time() + pause
+                await self._drain_until_deadline(
+                    events,
+                    f"streaming response during pause after {preview} from {self.host_ip}:{self.port}",
+                    deadline,
+                )
+        if self.stop is not None:
+            await self._finish_stopped(events)
+            return events
+        if self.tracker:
+            self.tracker.done_sending = True
+        await self._recv_until_idle(
+            events,
+            f"waiting for remaining responses from {self.host_ip}:{self.port}",
+            self.command_timeout,
+        )
+        return events
+
+    async def _sendall(self, data: bytes) -> None:
+        assert self.sock is not None
+        try:
+            await asyncio.wait_for(asyncio.get_running_loop().sock_sendall(self.sock, data), self.command_timeout)
+        except asyncio.TimeoutError as exc:
+            raise socket.timeout("timed out") from exc
+
+    async def _send_body(self, cmd: CommandSpec, events: List[SessionEvent]) -> None:
+        """Coroutine counterpart of SMTPClient._send_body."""
+        assert self.sock is not None and cmd.body is not None
+        loop = asyncio.get_running_loop()
+        body = cmd.body
+        encoder = BodyEncoder(body.dot_stuff, self.body_inline_max, self.body_log_head)
+        early = bytearray()
+        scan = body.scan(encoder.keep) if body.path is not None else None
+        if scan is not None and scan.clean and scan.size > BODY_CHUNK:
+            with body.path.open("rb") as handle:  # type: ignore[union-attr]
+                offset = 0
+                while offset < scan.size:
+                    try:
+                        sent = await asyncio.wait_for(
+                            loop.sock_sendfile(self.sock, handle, offset, min(SENDFILE_CHUNK, scan.size - offset)),
+                            self.command_timeout,
+                        )
+                    except asyncio.TimeoutError as exc:
+                        raise socket.timeout("timed out") from exc
+                    if not sent:
+                        raise ConnectionError(f"{body.label} shrank while streaming it to {self.host_ip}:{self.port}")
+                    offset += sent
+                    self._stash_available(early, body.label)
+            encoder.adopt(scan)
+            await self._sendall(encoder.terminator())
+        else:
+            # The last chunk goes out with the terminator so small bodies are a single write.
+            pending = b""
+            for chunk in body.chunks(cmd.values):
+                if pending:
+                    await self._sendall(pending)
+                    self._stash_available(early, body.label)
+                pending = encoder.encode(chunk)
+            await self._sendall(pending + encoder.terminator())
+        events.append(encoder.event())
+        if self.tracker:
+            self.tracker.sent_body(encoder.lines)
+        if early:
+            self._record_recv(events, early)
+
+    def _stash_available(self, stash: bytearray, label: str) -> None:
+        assert self.sock is not None
+        while True:
+            try:
+                size = self.sock.recv_into(self._buffer)
+            except (BlockingIOError, InterruptedError):
+                return
+            if not size:
+                raise ConnectionError(f"Connection closed while streaming {label} to {self.host_ip}:{self.port}")
+            stash += self._view[:size]
+
+    def _record_recv(self, events: List[SessionEvent], data: Union[bytes, memoryview]) -> None:
+        last = events[-1] if events else None
+        if last is not None and last.direction == "recv" and isinstance(last.payload, bytearray):
+            # Chunks arriving back to back grow one event instead of adding one per recv.
+            last.payload += data
+        else:
+            events.append(SessionEvent(direction="recv", payload=bytearray(data)))
+        self.timer.received()
+        if self.tracker:
+            self.tracker.received(data)
+            if self._watch is not None:
+                self.stop = self._watch.check(self.tracker)
+
+    def _replies_complete(self) -> bool:
+        return self.stop is not None or (self.tracker is not None and self.tracker.satisfied)
+
+    async def _await_replies(self, events: List[SessionEvent], stage: str) -> None:
+        """Coroutine counterpart of SMTPClient._await_replies."""
+        assert self.sock is not None and self.tracker is not None
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.command_timeout
+        while self.tracker.outstanding and self.stop is None:
+            try:
+                size = await asyncio.wait_for(loop.sock_recv_into(self.sock, self._buffer), deadline - loop.time())
+            except asyncio.TimeoutError as exc:
+                raise socket.timeout(f"{stage} (timeout {self.command_timeout}s)") from exc
+            if not size:
+                raise ConnectionError(f"Connection closed while {stage}")
+            self._record_recv(events, self._view[:size])
+
+    async def _finish_stopped(self, events: List[SessionEvent]) -> None:
+        """Coroutine counterpart of SMTPClient._finish_stopped."""
+        assert self.sock is not None and self.tracker is not None and self.stop is not None
+        if self.stop.rule.action != "quit":
+            return
+        try:
+            await self._sendall(QUIT)
+        except OSError:
+            return
+        events.append(SessionEvent(direction="send", payload=QUIT))
+        self.tracker.sent(QUIT)
+        self.stop.quit_sent = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.command_timeout
+        while self.tracker.outstanding:
+            try:
+                size = await asyncio.wait_for(loop.sock_recv_into(self.sock, self._buffer), deadline - loop.time())
+            except (asyncio.TimeoutError, OSError):
+                return
+            if not size:
+                return
+            self._record_recv(events, self._view[:size])
+
+    async def _recv_data(self, timeout: float, stage: str) -> bytes:
+        if not self.sock:
+            raise RuntimeError("Socket is not connected")
+        loop = asyncio.get_running_loop()
+        try:
+            size = await asyncio.wait_for(loop.sock_recv_into(self.sock, self._buffer), timeout)
+        except asyncio.TimeoutError as exc:
+            raise socket.timeout(f"{stage} (timeout {timeout}s)") from exc
+        if not size:
+            raise ConnectionError(f"Connection closed while {stage}")
+        return bytes(self._view[:size])
+
+    def _drain_available(self, events: List[SessionEvent], stage: str) -> None:
+        if not self.sock:
+            raise RuntimeError("Socket is not connected")
+        while True:
+            try:
+                data = self._view[:self.sock.recv_into(self._buffer)]
+            except (BlockingIOError, InterruptedError):
+                return
+            if not data:
+                if self._replies_complete():
+                    return
+                raise ConnectionError(f"Connection closed while {stage}")
+            self._record_recv(events, data)
+
+    async def _drain_until_deadline(self, events: List[SessionEvent], stage: str, deadline: float) -> None:
+        if not self.sock:
+            raise RuntimeError("Socket is not connected")
+        loop = asyncio.get_running_loop()
+        while self.stop is None:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            try:
+                data = self._view[:await asyncio.wait_for(loop.sock_recv_into(self.sock, self._buffer), remaining)]
+            except asyncio.TimeoutError:
+                return
+            if not data:
+                if self._replies_complete():
+                    return
+                raise ConnectionError(f"Connection closed while {stage}")
+            self._record_recv(events, data)
+
+    async def _recv_until_idle(self, events: List[SessionEvent], stage: str, idle_timeout: float) -> None:
+        if idle_timeout <= 0:
+            return
+        if not self.sock:
+            raise RuntimeError("Socket is not connected")
+        loop = asyncio.get_running_loop()
+        while True:
+            if self._replies_complete():
+                return
+            try:
+                data = self._view[:await asyncio.wait_for(loop.sock_recv_into(self.sock, self._buffer), idle_timeout)]
+            except asyncio.TimeoutError:
+                return
+            if not data:
+                if self._replies_complete():
+                    return
+                raise ConnectionError(f"Connection closed while {stage}")
+            self._record_recv(events, data)
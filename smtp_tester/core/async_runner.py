@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import asyncio
+import math
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .async_client import AsyncSMTPClient
+from .models import MXRecord, SessionEvent, TaskDefinition
+from .plan import PlannedDomain
+from .runner import BatchRunner, _reuse_commands
+from .scheduler import HostScheduler, Session
+
+
+class AsyncBatchRunner(BatchRunner):
+    """Runs many SMTP sessions concurrently on a single event loop."""
+
+    def __init__(
+        self,
+        batch_path: Path,
+        config: dict,
+        tasks: List[TaskDefinition],
+        mx_records: Iterable[MXRecord],
+        concurrency: int | None = None,
+        run_ts: str | None = None,
+        shard: str | None = None,
+        plan: Optional[Iterable[PlannedDomain]] = None,
+    ):
+        super().__init__(batch_path, config, tasks, mx_records, run_ts=run_ts, shard=shard, plan=plan)
+        self.concurrency = max(1, int(concurrency or config.get("concurrency", 1)))
+
+    def run(self, selected_tasks: Optional[Iterable[str]] = None) -> Dict[str, int]:
+        names = set(selected_tasks) if selected_tasks else None
+        try:
+            asyncio.run(self._run_async(names))
+        finally:
+            self._close()
+        return dict(self.stats)
+
+    async def _run_async(self, names: Optional[set]) -> None:
+        scheduler = HostScheduler.from_config(self._iter_jobs(names), self.config, sources=self.sources)
+        slots = asyncio.Semaphore(self.concurrency)
+        wake = asyncio.Event()
+        delay_hosts = float(self.config.get("delay_between_hosts", 0) or 0)
+        running: Set[asyncio.Task] = set()
+        failures: List[BaseException] = []
+
+        def finished(job: asyncio.Task) -> None:
+            running.discard(job)
+            error = None if job.cancelled() else job.exception()
+            if error is not None:
+                failures.append(error)
+                wake.set()
+
+        async def run_session(session: Session) -> None:
+            ends_record = scheduler.ends_record(session)
+            try:
+                try:
+                    await self._run_unit_async(*session)
+                finally:
+                    scheduler.release(session)
+                    wake.set()
+                if ends_record and delay_hosts > 0:
+                    # Like the sequential engine, a worker pauses after each record; the IP is free meanwhile.
+                    await asyncio.sleep(delay_hosts)
+            finally:
+                slots.release()
+                wake.set()
+
+        # Like the sequential engine, the first failure stops the run: nothing new is started.
+        while not failures:
+            await slots.acquire()
+            if failures:
+                slots.release()
+                break
+            session, wait = scheduler.acquire()
+            if session is None:
+                slots.release()
+                if wait is None:
+                    break
+                # Sleep until the next bucket refills or a running session frees its lane.
+                wake.clear()
+                try:
+                    await asyncio.wait_for(wake.wait(), None if wait == math.inf else wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            job = asyncio.create_task(run_session(session))
+            running.add(job)
+            job.add_done_callback(finished)
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+        if failures:
+            raise failures[0]
+
+    async def _run_unit_async(
+        self, record: MXRecord, tasks: Tuple[TaskDefinition, ...], source: Optional[str] = None
+    ) -> None:
+        if tasks[0].mx_strategy == "first_reachable":
+            await self._run_raced_async(record, tasks[0], source)
+        elif len(tasks) == 1:
+            await self._run_single_async(record, tasks[0], source)
+        else:
+            await self._run_reused_async(record, tasks, source)
+
+    async def _run_single_async(self, record: MXRecord, task: TaskDefinition, source: Optional[str] = None) -> None:
+        if self._skip_unreachable(record, (task,)):
+            return
+        start = datetime.utcnow()
+        events: List[SessionEvent] = []
+        failure: Optional[Exception] = None
+        client = AsyncSMTPClient(**self._client_options(record, source))
+        print(f"[*] {record.domain} -> {record.ip} task={task.key}")
+        try:
+            await client.connect()
+            commands = task.render_commands(record.domain)
+            await client.run_sequence(commands, events=events, stop_on=task.stop_on, lockstep=task.lockstep)
+        except Exception as exc:  # noqa: BLE001
+            failure = exc
+        finally:
+            client.close()
+        self._finish_session(record, task, start, events, client, failure, source)
+
+    async def _run_raced_async(self, record: MXRecord, task: TaskDefinition, source: Optional[str] = None) -> None:
+        candidates = self._race_candidates_for(record, task)
+        if not candidates:
+            return
+        start = datetime.utcnow()
+        events: List[SessionEvent] = []
+        failure: Optional[Exception] = None
+        winner: Optional[MXRecord] = None
+        client = AsyncSMTPClient(**self._client_options(record, source))
+        print(f"[*] {record.domain} -> racing {len(candidates)} MX IP(s) task={task.key}")
+        try:
+            winner = candidates[await client.race_connect([item.ip for item in candidates], self._race_stagger())]
+            record = self._race_won(record, winner)
+            await client.run_sequence(
+                task.render_commands(record.domain), events=events, stop_on=task.stop_on, lockstep=task.lockstep
+            )
+        except Exception as exc:  # noqa: BLE001
+            failure = exc
+        finally:
+            client.close()
+        _, error = self._finish_session(record, task, start, events, client, failure, source, note=False)
+        self._race_reachability(candidates, winner, error)
+
+    async def _run_reused_async(
+        self, record: MXRecord, tasks: Tuple[TaskDefinition, ...], source: Optional[str] = None
+    ) -> None:
+        if self._skip_unreachable(record, tasks):
+            return
+        client = AsyncSMTPClient(**self._client_options(record, source))
+        done = 0
+        try:
+            for index, task in enumerate(tasks):
+                start = datetime.utcnow()
+                events: List[SessionEvent] = []
+                failure: Optional[Exception] = None
+                print(f"[*] {record.domain} -> {record.ip} task={task.key} (shared session {index + 1}/{len(tasks)})")
+                try:
+                    if index == 0:
+                        await client.connect()
+                    else:
+                        events.append(SessionEvent(direction="recv", payload=client.banner))
+                    commands = _reuse_commands(task.render_commands(record.domain), last=index == len(tasks) - 1)
+                    await client.run_sequence(
+                        commands, events=events, read_banner=index == 0, stop_on=task.stop_on, lockstep=task.lockstep
+                    )
+                except Exception as exc:  # noqa: BLE001
+                    failure = exc
+                status, _ = self._finish_session(record, task, start, events, client, failure, source, note=index == 0)
+                done = index + 1
+                if status != "success":
+                    break
+        finally:
+            client.close()
+        for task in tasks[done:]:
+            await self._run_single_async(record, task, source)
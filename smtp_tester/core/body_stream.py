@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import hashlib
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple
+
+from .models import BodyRef, SessionEvent
+
+
+BODY_CHUNK = 64 * 1024
+# sendfile is issued in slices so replies can be drained and timeouts apply per slice.
+SENDFILE_CHUNK = 1024 * 1024
+
+
+@dataclass
+class BodyScan:
+    """What a pass over a body file learned: enough to send it with sendfile and log it without reading it again."""
+
+    size: int
+    lines: int
+    digest: Any
+    head: bytes
+    # No line starts with "." (or dot-stuffing is off), so the file goes out byte for byte.
+    clean: bool
+    ends_with_newline: bool
+
+
+@dataclass
+class BodySource:
+    """A DATA body streamed from a file or a callable instead of being rendered into memory."""
+
+    path: Optional[Path] = None
+    factory: Optional[Callable[[dict], Iterable[bytes]]] = None
+    dot_stuff: bool = True
+    _scan: Optional[Tuple[Tuple[int, int, int], BodyScan]] = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def label(self) -> str:
+        if self.path is not None:
+            return f"<body {self.path.name}>"
+        return f"<body {getattr(self.factory, '__name__', 'generator')}>"
+
+    def chunks(self, values: Optional[dict]) -> Iterator[bytes]:
+        if self.path is not None:
+            with self.path.open("rb") as handle:
+                while True:
+                    chunk = handle.read(BODY_CHUNK)
+                    if not chunk:
+                        return
+                    yield chunk
+        else:
+            assert self.factory is not None
+            # Generators tend to yield a line at a time; coalesce so each send carries a full chunk.
+            pending = bytearray()
+            for chunk in self.factory(dict(values or {})):
+                pending += chunk.encode("latin1") if isinstance(chunk, str) else chunk
+                if len(pending) >= BODY_CHUNK:
+                    yield bytes(pending)
+                    pending.clear()
+            if pending:
+                yield bytes(pending)
+
+    def scan(self, keep: int) -> BodyScan:
+        """Size, digest, line count and first ``keep`` bytes of the body file, cached until the file changes."""
+        assert self.path is not None
+        stat = self.path.stat()
+        key = (stat.st_size, stat.st_mtime_ns, keep)
+        if self._scan is not None and self._scan[0] == key:
+            return self._scan[1]
+        encoder = BodyEncoder(dot_stuff=False, inline_max=keep, head=keep)
+        clean = True
+        for chunk in self.chunks(None):
+            if self.dot_stuff and clean and (encoder.line_start and chunk[:1] == b"." or b"\n." in chunk):
+                clean = False
+            encoder.encode(chunk)
+        result = BodyScan(
+            size=encoder.size,
+            lines=encoder.lines,
+            digest=encoder.digest,
+            head=bytes(encoder.kept),
+            clean=clean,
+            ends_with_newline=encoder.line_start,
+        )
+        self._scan = (key, result)
+        return result
+
+
+class BodyEncoder:
+    """Turns body chunks into wire bytes (dot-stuffing, closing ``.\\r\\n``) and keeps what the log needs."""
+
+    def __init__(self, dot_stuff: bool = True, inline_max: int = 65536, head: int = 256):
+        self.dot_stuff = dot_stuff
+        self.inline_max = max(0, inline_max)
+        self.head = max(0, head)
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.lines = 0
+        self.kept = bytearray()
+        self.line_start = True
+
+    @property
+    def keep(self) -> int:
+        # One byte past inline_max is enough to know the body must be logged by reference.
+        return max(self.inline_max, self.head) + 1
+
+    def encode(self, chunk: bytes) -> bytes:
+        if self.dot_stuff and chunk:
+            if self.line_start and chunk[:1] == b".":
+                chunk = b"." + chunk.replace(b"\n.", b"\n..")
+            elif b"\n." in chunk:
+                chunk = chunk.replace(b"\n.", b"\n..")
+        self._account(chunk)
+        return chunk
+
+    def adopt(self, scan: BodyScan) -> None:
+        """Account for a clean file that went out through sendfile without passing through encode."""
+        self.digest = scan.digest.copy()
+        self.size = scan.size
+        self.lines = scan.lines
+        self.kept = bytearray(scan.head[: self.keep])
+        self.line_start = scan.ends_with_newline
+
+    def terminator(self) -> bytes:
+        tail = b".\r\n" if self.line_start else b"\r\n.\r\n"
+        self._account(tail)
+        return tail
+
+    def event(self) -> SessionEvent:
+        if self.size <= self.inline_max:
+            return SessionEvent(direction="send", payload=bytes(self.kept))
+        return SessionEvent(
+            direction="send",
+            payload=bytes(self.kept[: self.head]),
+            ref=BodyRef(size=self.size, sha256=self.digest.hexdigest(), lines=self.lines),
+        )
+
+    def _account(self, chunk: bytes) -> None:
+        if not chunk:
+            return
+        self.digest.update(chunk)
+        self.size += len(chunk)
+        self.lines += chunk.count(b"\n")
+        self.line_start = chunk[-1:] == b"\n"
+        room = self.keep - len(self.kept)
+        if room > 0:
+            self.kept += chunk[:room]
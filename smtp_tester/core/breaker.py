@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+
+from .utils import read_json_store, update_json_store
+
+
+SKIPPED_UNREACHABLE = "skipped_unreachable"
+STORE_FILE = "unreachable.json"
+
+
+class CircuitBreaker:
+    """Per-IP connect/banner failure counter backed by a persistent negative cache with a TTL."""
+
+    def __init__(self, threshold: int = 2, ttl: float = 3600.0, path: Optional[Path] = None):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.path = path
+        self.failures: Dict[str, int] = {}
+        self.reasons: Dict[str, str] = {}
+        # ip -> {"until": epoch seconds, "reason": last error}
+        self.cache: Dict[str, dict] = read_json_store(path) if path and ttl > 0 else {}
+        self._opened: Set[str] = set()
+        self._cleared: Set[str] = set()
+
+    @classmethod
+    def from_config(cls, config: dict) -> "CircuitBreaker":
+        store = config.get("negative_cache_store") or Path(config.get("log_dir", "logs")) / STORE_FILE
+        return cls(
+            threshold=int(config.get("breaker_threshold", 2)),
+            ttl=float(config.get("negative_cache_ttl", 3600)),
+            path=Path(store),
+        )
+
+    def blocked(self, ip: str) -> Optional[str]:
+        """Why sessions to ``ip`` should be skipped, or None when it may be tried."""
+        if self.threshold > 0 and self.failures.get(ip, 0) >= self.threshold:
+            return f"{self.failures[ip]} connect/banner failure(s) this run, last: {self.reasons.get(ip, '')}"
+        entry = self.cache.get(ip)
+        if entry is not None:
+            if entry.get("until", 0) > time.time():
+                until = datetime.utcfromtimestamp(entry["until"]).isoformat(timespec="seconds")
+                return f"in negative cache until {until}Z, last: {entry.get('reason', '')}"
+            del self.cache[ip]
+        return None
+
+    def record(self, ip: str, reachable: bool, reason: Optional[str] = None) -> None:
+        if reachable:
+            self.failures.pop(ip, None)
+            self.reasons.pop(ip, None)
+            if self.cache.pop(ip, None) is not None or ip in self._opened:
+                self._opened.discard(ip)
+                self._cleared.add(ip)
+            return
+        count = self.failures.get(ip, 0) + 1
+        self.failures[ip] = count
+        self.reasons[ip] = reason or ""
+        if self.threshold > 0 and count >= self.threshold and self.ttl > 0:
+            self.cache[ip] = {"until": round(time.time() + self.ttl), "reason": reason or ""}
+            self._opened.add(ip)
+            self._cleared.discard(ip)
+
+    def save(self) -> None:
+        if not self.path or not (self._opened or self._cleared):
+            return
+
+        def merge(table: Dict[str, Any]) -> None:
+            now = time.time()
+            for ip in [ip for ip, entry in table.items() if entry.get("until", 0) <= now]:
+                del table[ip]
+            for ip in self._cleared:
+                table.pop(ip, None)
+            for ip in self._opened:
+                table[ip] = self.cache[ip]
+
+        update_json_store(self.path, merge)
+        self._opened.clear()
+        self._cleared.clear()
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import hashlib
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from .models import BodyRef, SessionEvent, SessionLog, task_key
+from .reply_parser import session_replies
+from .sources import reply_codes
+
+
+class CapturePolicy:
+    """Trims what successful sessions keep of their events before they are logged.
+
+    Failed sessions, and successful ones that saw a 4xx/5xx or non-SMTP reply, are always kept in full.
+    Whatever was trimmed is recorded in ``SessionLog.capture``.
+    """
+
+    def __init__(self, max_bytes: int = 0, tail_bytes: int = 1024, hash_over: int = 0, success_sample: float = 1.0):
+        if not 0.0 <= success_sample <= 1.0:
+            raise ValueError("capture_success_sample must be between 0 and 1")
+        self.max_bytes = max(0, max_bytes)
+        self.tail_bytes = min(max(0, tail_bytes), self.max_bytes)
+        self.hash_over = max(0, hash_over)
+        self.success_sample = success_sample
+
+    @classmethod
+    def from_config(cls, config: dict) -> Optional["CapturePolicy"]:
+        policy = cls(
+            max_bytes=int(config.get("capture_max_bytes", 0) or 0),
+            tail_bytes=int(config.get("capture_tail_bytes", 1024)),
+            hash_over=int(config.get("capture_hash_over", 0) or 0),
+            success_sample=float(config.get("capture_success_sample", 1.0)),
+        )
+        return policy if policy.active else None
+
+    @property
+    def active(self) -> bool:
+        return bool(self.max_bytes or self.hash_over or self.success_sample < 1.0)
+
+    def apply(self, session: SessionLog, keep_replies: bool = False) -> Dict[str, Any]:
+        """Trim ``session`` in place and return what was done (empty when it is kept in full).
+
+        With ``keep_replies`` the reply rows of the full session are kept in ``session.replies`` first,
+        so the results index counts the same replies whatever the policy trims.
+        """
+        if session.status != "success" or not session.events or self._unusual(session):
+            return {}
+        if keep_replies:
+            session.replies = session_replies(session.events)
+        capture: Dict[str, Any] = {}
+        if self.success_sample < 1.0 and not self._sampled(session):
+            capture["sampled_out"] = True
+            capture["omitted_bytes"] = sum(len(event.payload) for event in session.events)
+            capture["omitted_events"] = len(session.events)
+            session.events = []
+        else:
+            events = session.events
+            if self.hash_over:
+                events, hashed = self._hash_sends(events)
+                if hashed:
+                    capture["hashed"] = hashed
+            if self.max_bytes:
+                events, cut = self._cap(events)
+                capture.update(cut)
+            session.events = events
+        session.capture = capture
+        return capture
+
+    def _sampled(self, session: SessionLog) -> bool:
+        # Keyed on what the session ran, so reruns, resumes and workers keep the same sample.
+        key = f"{session.target_domain}|{session.mx_ip}|{task_key(session.task, session.variant.get('index'))}"
+        return zlib.crc32(key.encode("utf-8")) < self.success_sample * 2**32
+
+    @staticmethod
+    def _unusual(session: SessionLog) -> bool:
+        return any(code == 0 or code >= 400 for code in reply_codes(session.events))
+
+    def _hash_sends(self, events: List[SessionEvent]) -> Tuple[List[SessionEvent], int]:
+        kept: List[SessionEvent] = []
+        hashed = 0
+        for event in events:
+            if event.direction == "send" and event.ref is None and len(event.payload) > self.hash_over:
+                payload = bytes(event.payload)
+                ref = BodyRef(size=len(payload), sha256=hashlib.sha256(payload).hexdigest(), lines=payload.count(b"\n"))
+                event = SessionEvent(direction="send", payload=b"", ref=ref)
+                hashed += 1
+            kept.append(event)
+        return kept, hashed
+
+    def _cap(self, events: List[SessionEvent]) -> Tuple[List[SessionEvent], Dict[str, int]]:
+        total = sum(len(event.payload) for event in events)
+        if total <= self.max_bytes:
+            return events, {}
+        head = _take(events, self.max_bytes - self.tail_bytes, from_end=False)
+        tail = _take(events[::-1], self.tail_bytes, from_end=True)[::-1]
+        return head + tail, {
+            "omitted_bytes": total - self.max_bytes,
+            # An event cut on both sides shows up in the head and again in the tail.
+            "omitted_events": max(0, len(events) - len(head) - len(tail)),
+            "gap_at": len(head),
+        }
+
+
+def _take(events: List[SessionEvent], budget: int, from_end: bool) -> List[SessionEvent]:
+    """Events (walked in the given order) until ``budget`` payload bytes are used, cutting the last one."""
+    kept: List[SessionEvent] = []
+    for event in events:
+        if budget <= 0:
+            break
+        size = len(event.payload)
+        if size > budget:
+            payload = bytes(event.payload[-budget:] if from_end else event.payload[:budget])
+            # A body reference describes the whole body, so it stays with its leading bytes only.
+            event = SessionEvent(direction=event.direction, payload=payload, ref=None if from_end else event.ref)
+            size = budget
+        kept.append(event)
+        budget -= size
+    return kept
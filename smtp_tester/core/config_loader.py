@@ -13,9 +13,58 @@ DEFAULTS: dict[str, Any] = {
     "delay_before_first_command": 0.0,
     "delay_between_commands": 0,
     "delay_between_hosts": 1.0,
+    "ip_rate": 0,
+    "ip_burst": 1,
+    "domain_rate": 0,
+    "domain_burst": 1,
+    "global_rate": 0,
+    "global_burst": 1,
+    "scheduler_window": 1000,
     "log_dir": "log",
     "read_chunk": 4096,
     "port": 25,
+    "reply_aware": True,
+    "body_inline_max": 65536,
+    "body_log_head": 256,
+    "session_reuse": False,
+    "render_cache_size": 1024,
+    "engine": "sync",
+    "concurrency": 50,
+    "workers": 1,
+    "mx_cache": False,
+    "log_max_open_files": 256,
+    "log_queue_size": 1024,
+    "log_format": "yaml",
+    "segment_size": 256 * 1024 * 1024,
+    "segment_compression": None,
+    "journal": True,
+    "timing_max_domains": 10000,
+    "mx_race_stagger": 0.25,
+    "adaptive_timeouts": False,
+    "adaptive_timeout_floor": 0.5,
+    "adaptive_timeout_ceiling": None,
+    "adaptive_timeout_k": 4.0,
+    "adaptive_timeout_min_samples": 3,
+    "adaptive_timeout_max_entries": 100000,
+    "adaptive_timeout_store": None,
+    "breaker_threshold": 0,
+    "negative_cache_ttl": 3600,
+    "negative_cache_store": None,
+    "results_index": False,
+    "results_index_path": None,
+    "lease_timeout": 60.0,
+    "lease_attempts": 3,
+    "source_addresses": [],
+    "source_strategy": "round_robin",
+    "source_rate": 0,
+    "source_burst": 1,
+    "source_cooldown": 60.0,
+    "source_cooldown_codes": ["4xx"],
+    "lockstep": False,
+    "capture_max_bytes": 0,
+    "capture_tail_bytes": 1024,
+    "capture_hash_over": 0,
+    "capture_success_sample": 1.0,
 }
 
 
@@ -0,0 +1,597 @@
+from __future__ import annotations
+
+import asyncio
+import base64
+import json
+import os
+import socket
+import struct
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from pathlib import Path
+from typing import IO, Any, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from .models import MXRecord, SessionLog, TaskDefinition
+from .plan import PlannedDomain
+from .runner import BatchRunner
+from .scheduler import HostScheduler, Session
+from .segment_log import decode_session, encode_session
+from .sources import SourcePool
+
+
+# Upper bound for one JSON line; a result carries every session of a unit, inline bodies included.
+MAX_MESSAGE = 64 * 1024 * 1024
+PROTOCOL_VERSION = 1
+
+Address = Tuple[str, Any]
+
+
+def parse_address(text: str) -> Address:
+    """``unix:/path`` (or any path with a ``/``) for a Unix socket, ``host:port`` for TCP."""
+    if text.startswith("unix:"):
+        return "unix", text[len("unix:"):]
+    if "/" in text:
+        return "unix", text
+    host, _, port = text.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"invalid address {text!r} (expected host:port or unix:/path)")
+    return "tcp", (host.strip("[]"), int(port))
+
+
+def format_address(address: Address) -> str:
+    kind, target = address
+    return f"unix:{target}" if kind == "unix" else f"{target[0]}:{target[1]}"
+
+
+def _record_fields(record: MXRecord) -> list:
+    return [record.hostname, record.preference, record.ip, record.domain]
+
+
+def _encode(message: dict) -> bytes:
+    return json.dumps(message, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def _parse_result(message: dict) -> Tuple[Dict[str, int], List[Tuple[str, bool, Optional[str]]], List[SessionLog]]:
+    """Check and decode a worker's result up front, so a malformed one changes nothing; raises ValueError."""
+    try:
+        stats = message.get("stats") or {}
+        if not isinstance(stats, dict) or not all(
+            isinstance(name, str) and isinstance(count, int) for name, count in stats.items()
+        ):
+            raise ValueError("stats must map names to counts")
+        reachability = []
+        for ip, reachable, error in message.get("reachability") or []:
+            if not isinstance(ip, str) or not (error is None or isinstance(error, str)):
+                raise ValueError(f"bad reachability entry for {ip!r}")
+            reachability.append((ip, bool(reachable), error))
+        sessions = [decode_session(base64.b64decode(blob, validate=True)) for blob in message.get("sessions") or []]
+    except (AttributeError, IndexError, KeyError, TypeError, struct.error) as exc:
+        raise ValueError(f"{type(exc).__name__}: {exc}") from exc
+    return stats, reachability, sessions
+
+
+@dataclass
+class _Lease:
+    session: Session
+    # Candidate records of a raced unit, resolved once by the coordinator.
+    candidates: List[MXRecord]
+    # delay_between_hosts when the unit is its record's last, taken by the worker after the unit.
+    pause: float = 0.0
+    id: int = 0
+    owner: Optional[int] = None
+    worker: str = ""
+    expires: float = 0.0
+    attempts: int = 0
+
+
+@dataclass
+class _Connection:
+    id: int
+    worker: str = "?"
+    leases: Set[int] = field(default_factory=set)
+
+
+class Coordinator(BatchRunner):
+    """Hands (record, task) units to workers over a socket and logs the sessions they send back.
+
+    Pacing, the journal, the circuit breaker, adaptive timeouts and logging all stay here, so a
+    distributed run produces the same run directory as a local one. A unit is leased to one worker
+    at a time; leases of workers that disconnect or stop renewing are handed out again.
+    """
+
+    def __init__(
+        self,
+        batch_path: Path,
+        config: dict,
+        tasks: List[TaskDefinition],
+        mx_records: Iterable[MXRecord],
+        address: Address,
+        run_ts: str | None = None,
+        plan: Optional[Iterable[PlannedDomain]] = None,
+    ):
+        super().__init__(batch_path, config, tasks, mx_records, run_ts=run_ts, plan=plan)
+        self.address = address
+        self.lease_timeout = float(config.get("lease_timeout", 60.0))
+        self.lease_attempts = max(1, int(config.get("lease_attempts", 3)))
+        self.leases: Dict[int, _Lease] = {}
+        self.retry: Deque[_Lease] = deque()
+        self._lease_ids = 0
+        self._connection_ids = 0
+        self._names: Optional[set] = None
+
+    def _create_sources(self) -> Optional[SourcePool]:
+        # Source addresses belong to the node that opens the connection, so each worker binds its own.
+        return None
+
+    def run(self, selected_tasks: Optional[Iterable[str]] = None) -> Dict[str, int]:
+        self._names = set(selected_tasks) if selected_tasks else None
+        self.scheduler: HostScheduler = HostScheduler.from_config(self._iter_jobs(self._names), self.config)
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self._close()
+        return dict(self.stats)
+
+    async def _serve(self) -> None:
+        self._changed = asyncio.Condition()
+        self._finished = asyncio.Event()
+        self._outbox: asyncio.Queue = asyncio.Queue()
+        self._write_error: Optional[Exception] = None
+        writing = asyncio.create_task(self._write_outbox())
+        handlers: Set[asyncio.Task] = set()
+
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            handlers.add(asyncio.current_task())
+            try:
+                await self._handle(reader, writer)
+            finally:
+                handlers.discard(asyncio.current_task())
+
+        kind, target = self.address
+        if kind == "unix":
+            if os.path.exists(target):
+                os.unlink(target)
+            server = await asyncio.start_unix_server(handle, path=target, limit=MAX_MESSAGE)
+        else:
+            server = await asyncio.start_server(handle, host=target[0], port=target[1], limit=MAX_MESSAGE)
+        print(f"[*] coordinator listening on {format_address(self.address)} for run {self.run_ts}")
+        try:
+            async with server:
+                while not self._finished.is_set():
+                    if self.scheduler.finished():
+                        self._finished.set()
+                        break
+                    try:
+                        await asyncio.wait_for(self._finished.wait(), timeout=1.0)
+                    except asyncio.TimeoutError:
+                        await self._expire_leases()
+                # Let connected workers collect their "done" before the loop goes away.
+                if handlers:
+                    await asyncio.wait(set(handlers), timeout=5.0)
+                await self._outbox.join()
+        finally:
+            writing.cancel()
+            if kind == "unix" and os.path.exists(target):
+                os.unlink(target)
+        if self._write_error is not None:
+            raise self._write_error
+
+    async def _write_outbox(self) -> None:
+        """Feed stored sessions to the logger from a thread, so its blocking queue never stalls the loop."""
+        while True:
+            batch = [await self._outbox.get()]
+            while not self._outbox.empty():
+                batch.append(self._outbox.get_nowait())
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except Exception as exc:  # noqa: BLE001
+                # Surfaced when the run ends; the run stops handing out units meanwhile.
+                self._write_error = self._write_error or exc
+                self._finished.set()
+            finally:
+                for _ in batch:
+                    self._outbox.task_done()
+
+    def _write_batch(self, batch: List[Tuple[SessionLog, bool]]) -> None:
+        for session, logged in batch:
+            super()._write_session(session, logged)
+
+    def _write_session(self, session: SessionLog, logged: bool) -> None:
+        # Called on the event loop (results, skipped and given-up units); _write_outbox does the writing.
+        self._outbox.put_nowait((session, logged))
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._connection_ids += 1
+        connection = _Connection(id=self._connection_ids)
+        try:
+            hello = await self._read(reader)
+            refusal = self._check_hello(hello)
+            if refusal:
+                print(f"[!] refused worker {hello.get('worker', '?') if hello else '?'}: {refusal}")
+                await self._send(writer, {"op": "error", "message": refusal})
+                return
+            assert hello is not None
+            connection.worker = str(hello.get("worker", f"#{connection.id}"))
+            print(f"[+] worker {connection.worker} connected")
+            await self._send(writer, {"op": "welcome", "run": self.run_ts, "lease_timeout": self.lease_timeout})
+            while True:
+                message = await self._read(reader)
+                if message is None:
+                    break
+                op = message.get("op")
+                if op == "next":
+                    reply = await self._next_unit(connection)
+                    await self._send(writer, reply)
+                    if reply["op"] == "done":
+                        break
+                elif op == "renew":
+                    lease = self.leases.get(int(message["lease"]))
+                    if lease is not None and lease.owner == connection.id:
+                        lease.expires = time.monotonic() + self.lease_timeout
+                elif op == "result":
+                    await self._complete(connection, message)
+                else:
+                    raise ValueError(f"unknown message {op!r}")
+        except (ConnectionError, ValueError, KeyError, TypeError) as exc:
+            print(f"[!] worker {connection.worker}: {exc}")
+        finally:
+            held = [self.leases[lease_id] for lease_id in connection.leases if lease_id in self.leases]
+            held = [lease for lease in held if lease.owner == connection.id]
+            for lease in held:
+                self._lost(lease, f"worker {connection.worker} disconnected")
+            if held:
+                async with self._changed:
+                    self._changed.notify_all()
+            writer.close()
+
+    def _check_hello(self, hello: Optional[dict]) -> Optional[str]:
+        if not hello or hello.get("op") != "hello":
+            return "expected hello"
+        if hello.get("version") != PROTOCOL_VERSION:
+            return f"protocol version {hello.get('version')}, expected {PROTOCOL_VERSION}"
+        if hello.get("batch") != self.batch_path.name:
+            return f"worker runs batch {hello.get('batch')}, coordinator runs {self.batch_path.name}"
+        missing = {task.name for task in self.tasks} - set(hello.get("tasks") or [])
+        if self._names is not None:
+            missing &= self._names
+        if missing:
+            return f"worker task.py lacks task(s) {', '.join(sorted(missing))}"
+        return None
+
+    async def _next_unit(self, connection: _Connection) -> dict:
+        """Lease the next unit to a worker, holding its request while every remaining unit waits on pacing."""
+        while True:
+            lease, wait = self._lease()
+            if lease is not None:
+                return self._assign(lease, connection)
+            if wait is None:
+                self._finished.set()
+                return {"op": "done"}
+            async with self._changed:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=min(wait, 1.0))
+                except asyncio.TimeoutError:
+                    pass
+
+    def _lease(self) -> Tuple[Optional[_Lease], Optional[float]]:
+        if self.retry:
+            return self.retry.popleft(), 0.0
+        while True:
+            session, wait = self.scheduler.acquire()
+            if session is None:
+                return None, wait
+            record, tasks, _ = session
+            candidates: List[MXRecord] = []
+            # Unreachable hosts are settled here, so workers never see their units.
+            if tasks[0].mx_strategy == "first_reachable":
+                candidates = self._race_candidates_for(record, tasks[0])
+                if not candidates:
+                    self.scheduler.release(session)
+                    continue
+            elif self._skip_unreachable(record, tasks):
+                self.scheduler.release(session)
+                continue
+            pause = float(self.config.get("delay_between_hosts", 0) or 0) if self.scheduler.ends_record(session) else 0.0
+            return _Lease(session=session, candidates=candidates, pause=pause), 0.0
+
+    def _assign(self, lease: _Lease, connection: _Connection) -> dict:
+        self.leases.pop(lease.id, None)
+        self._lease_ids += 1
+        lease.id = self._lease_ids
+        lease.owner = connection.id
+        lease.worker = connection.worker
+        lease.expires = time.monotonic() + self.lease_timeout
+        lease.attempts += 1
+        self.leases[lease.id] = lease
+        connection.leases.add(lease.id)
+        record, tasks, _ = lease.session
+        return {
+            "op": "unit",
+            "lease": lease.id,
+            "record": _record_fields(record),
+            "tasks": [[task.name, task.variant_index] for task in tasks],
+            "candidates": [_record_fields(item) for item in lease.candidates],
+            "options": self._client_options(record),
+            "pause": lease.pause,
+        }
+
+    async def _complete(self, connection: _Connection, message: dict) -> None:
+        lease_id = int(message["lease"])
+        lease = self.leases.get(lease_id)
+        # A lease that expired but has not been handed out again still takes its late result.
+        if lease is None or lease.owner not in (connection.id, None):
+            connection.leases.discard(lease_id)
+            print(f"[!] dropped result of lease {lease_id} from {connection.worker}: the unit was leased again or given up")
+            return
+        try:
+            stats, reachability, sessions = _parse_result(message)
+        except ValueError as exc:
+            connection.leases.discard(lease_id)
+            reason = f"worker {connection.worker} sent a malformed result for lease {lease_id} ({exc})"
+            if lease.owner is None:
+                # Expired already, so it waits in the retry queue.
+                print(f"[!] {reason}, dropped")
+                return
+            self._lost(lease, reason)
+            async with self._changed:
+                self._changed.notify_all()
+            return
+        connection.leases.discard(lease_id)
+        if lease.owner is None:
+            self.retry.remove(lease)
+        del self.leases[lease_id]
+        self.stats.update(stats)
+        if self.breaker:
+            for ip, reachable, error in reachability:
+                self.breaker.record(ip, reachable, error)
+        for session in sessions:
+            self._store_session(session)
+        self.scheduler.release(lease.session)
+        async with self._changed:
+            self._changed.notify_all()
+        # A slow disk holds up this worker's next request rather than the event loop.
+        await self._outbox.join()
+
+    async def _expire_leases(self) -> None:
+        now = time.monotonic()
+        expired = [lease for lease in self.leases.values() if lease.owner is not None and lease.expires <= now]
+        for lease in expired:
+            self._lost(lease, f"lease on worker {lease.worker} expired")
+        if expired:
+            async with self._changed:
+                self._changed.notify_all()
+
+    def _lost(self, lease: _Lease, reason: str) -> None:
+        record, tasks, _ = lease.session
+        if lease.attempts < self.lease_attempts:
+            print(f"[!] {reason}, re-queued {record.domain} -> {record.ip} ({lease.attempts} attempt(s))")
+            lease.owner = None
+            self.retry.append(lease)
+            return
+        # A unit that keeps taking its workers down is given up on rather than retried forever.
+        del self.leases[lease.id]
+        error = f"{reason} after {lease.attempts} lease(s)"
+        print(f"[!] {error}, giving up on {record.domain} -> {record.ip}")
+        for task in tasks:
+            self._record_session(record, task, datetime.utcnow(), "error", error, [])
+        self.scheduler.release(lease.session)
+
+    async def _read(self, reader: asyncio.StreamReader) -> Optional[dict]:
+        try:
+            line = await reader.readline()
+        except asyncio.LimitOverrunError as exc:
+            raise ValueError(f"message larger than {MAX_MESSAGE} bytes") from exc
+        if not line:
+            return None
+        return json.loads(line)
+
+    @staticmethod
+    async def _send(writer: asyncio.StreamWriter, message: dict) -> None:
+        writer.write(_encode(message))
+        await writer.drain()
+
+
+class LeaseRunner(BatchRunner):
+    """Runs leased units with the usual session code and collects what the coordinator needs back.
+
+    Nothing is logged locally: the sessions, reachability outcomes and race counters of each unit
+    are returned to the coordinator, which owns the run directory, journal and circuit breaker.
+    """
+
+    def __init__(
+        self, batch_path: Path, config: dict, tasks: List[TaskDefinition], sources: Optional[SourcePool] = None
+    ):
+        # Connections run in their own threads; their own task copies keep the render caches apart.
+        super().__init__(batch_path, config, [replace(task) for task in tasks], [])
+        self.by_name = {task.name: task for task in self.tasks}
+        # The coordinator owns the breaker, learned timeouts (sent in the options) and the capture policy.
+        self.breaker = None
+        self.adaptive = None
+        self.capture = None
+        self.sources = sources
+        self.options: dict = {}
+        self.candidates: List[MXRecord] = []
+        self.sessions: List[SessionLog] = []
+        self.reachability: List[list] = []
+
+    def _create_sources(self) -> Optional[SourcePool]:
+        # The worker's pool is shared by all its connections and passed in.
+        return None
+
+    def _open_run(self, log_dir: Path) -> None:
+        # Nothing is written locally, so no run directory, journal or results index.
+        self.logger = None  # type: ignore[assignment]
+        self.journal = None
+        self.index = None
+
+    def run_lease(self, message: dict) -> dict:
+        self.stats = Counter()
+        self.sessions = []
+        self.reachability = []
+        self.options = dict(message["options"])
+        self.candidates = [MXRecord(*fields) for fields in message["candidates"]]
+        record = MXRecord(*message["record"])
+        tasks = tuple(
+            self.by_name[name] if index is None else self.by_name[name].variant(index)
+            for name, index in message["tasks"]
+        )
+        source = self.sources.wait_take() if self.sources is not None else None
+        self._run_unit(record, tasks, source)
+        return {
+            "op": "result",
+            "lease": message["lease"],
+            "stats": dict(self.stats),
+            "reachability": self.reachability,
+            "sessions": [base64.b64encode(encode_session(session)).decode("ascii") for session in self.sessions],
+        }
+
+    def _client_options(self, record: MXRecord, source: Optional[str] = None) -> dict:
+        return {**self.options, "host_ip": record.ip, "source_address": source}
+
+    def _race_candidates_for(self, record: MXRecord, task: TaskDefinition) -> List[MXRecord]:
+        return self.candidates or [record]
+
+    def _note_reachability(self, ip: str, timings: Dict[str, float], error: Optional[str]) -> None:
+        self.reachability.append([ip, error is None or "banner" in timings, error])
+
+    def _race_reachability(self, candidates: List[MXRecord], winner: Optional[MXRecord], error: Optional[str]) -> None:
+        if winner is not None:
+            self.reachability.append([winner.ip, True, None])
+            return
+        self.reachability.extend([item.ip, False, error] for item in candidates)
+
+    def _store_session(self, session: SessionLog) -> None:
+        self.sessions.append(session)
+
+
+def _connect(address: Address) -> socket.socket:
+    kind, target = address
+    if kind == "unix":
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(target)
+        return sock
+    return socket.create_connection(target)
+
+
+class _WorkerConnection:
+    def __init__(self, address: Address, name: str, runner: LeaseRunner):
+        self.sock = _connect(address)
+        self.stream: IO[bytes] = self.sock.makefile("rwb")
+        self.name = name
+        self.runner = runner
+        # Heartbeats are written from a second thread while a unit runs.
+        self._lock = threading.Lock()
+
+    def send(self, message: dict) -> None:
+        with self._lock:
+            self.stream.write(_encode(message))
+            self.stream.flush()
+
+    def receive(self) -> dict:
+        line = self.stream.readline()
+        if not line:
+            raise ConnectionError("coordinator closed the connection")
+        return json.loads(line)
+
+    def close(self) -> None:
+        try:
+            self.stream.close()
+        except OSError:
+            # Closing flushes pending writes, which fails once the coordinator is gone.
+            pass
+        finally:
+            self.sock.close()
+
+    def run(self) -> Counter:
+        totals: Counter = Counter()
+        self.send(
+            {
+                "op": "hello",
+                "version": PROTOCOL_VERSION,
+                "worker": self.name,
+                "batch": self.runner.batch_path.name,
+                "tasks": sorted(self.runner.by_name),
+            }
+        )
+        welcome = self.receive()
+        if welcome.get("op") != "welcome":
+            raise RuntimeError(f"coordinator refused {self.name}: {welcome.get('message', welcome)}")
+        interval = max(0.5, float(welcome.get("lease_timeout", 60.0)) / 3)
+        print(f"[+] {self.name} joined run {welcome.get('run')}")
+        while True:
+            self.send({"op": "next"})
+            message = self.receive()
+            if message.get("op") == "done":
+                return totals
+            if message.get("op") != "unit":
+                raise RuntimeError(f"unexpected message from coordinator: {message.get('op')!r}")
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=self._renew, args=(message["lease"], interval, stop), daemon=True)
+            heartbeat.start()
+            try:
+                result = self.runner.run_lease(message)
+            finally:
+                stop.set()
+                heartbeat.join()
+            self.send(result)
+            totals["units"] += 1
+            totals.update(self.runner.stats)
+            for session in self.runner.sessions:
+                totals["sessions"] += 1
+                totals[session.status] += 1
+            pause = float(message.get("pause") or 0)
+            if pause > 0:
+                time.sleep(pause)
+
+    def _renew(self, lease: int, interval: float, stop: threading.Event) -> None:
+        while not stop.wait(interval):
+            try:
+                self.send({"op": "renew", "lease": lease})
+            except OSError:
+                return
+
+
+def run_worker(
+    batch_path: Path, config: dict, tasks: List[TaskDefinition], address: Address, connections: int = 1
+) -> Dict[str, int]:
+    """Pull units from a coordinator over ``connections`` connections until it reports the run done."""
+    connections = max(1, connections)
+    print(f"[*] worker pulling from {format_address(address)} over {connections} connection(s)")
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+    # One pool for all connections, so per-source limits hold across them.
+    sources = SourcePool.from_config(config)
+    totals: Counter = Counter()
+    failures: List[str] = []
+    lock = threading.Lock()
+
+    def work(index: int) -> None:
+        name = f"{prefix}/{index}" if connections > 1 else prefix
+        try:
+            # Each connection runs its own units, so each gets its own runner and clients.
+            connection = _WorkerConnection(address, name, LeaseRunner(batch_path, config, tasks, sources))
+        except OSError as exc:
+            with lock:
+                failures.append(f"{name}: {exc}")
+            return
+        try:
+            counts = connection.run()
+        except Exception as exc:  # noqa: BLE001
+            with lock:
+                failures.append(f"{name}: {exc}")
+            return
+        finally:
+            connection.close()
+        with lock:
+            totals.update(counts)
+
+    threads = [threading.Thread(target=work, args=(index,)) for index in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if failures:
+        raise RuntimeError(f"{len(failures)} connection(s) failed: {'; '.join(failures)}")
+    return dict(totals)
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import os
+import threading
+from pathlib import Path
+from typing import Iterable, Set
+
+
+JOURNAL_FILE = "completed.journal"
+# Closes off a line cut short by a crash, so it is never read back as a finished key.
+_CUT = "\t<cut>\n"
+
+
+class CompletionJournal:
+    """Append-only record of finished (domain, ip, task) sessions in a run directory."""
+
+    def __init__(self, run_dir: Path):
+        self.path = run_dir / JOURNAL_FILE
+        self.completed: Set[str] = set()
+        terminated = self._load() if self.path.exists() else True
+        # O_APPEND keeps single-line writes from several worker processes intact.
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._lock = threading.Lock()
+        if not terminated:
+            # Close off a line cut short by a crash so the next key starts on its own line.
+            os.write(self._fd, _CUT.encode("utf-8"))
+
+    @staticmethod
+    def key(domain: str, ip: str, task: str) -> str:
+        return f"{domain}\t{ip}\t{task}"
+
+    def is_done(self, domain: str, ip: str, task: str) -> bool:
+        return self.key(domain, ip, task) in self.completed
+
+    def mark(self, domain: str, ip: str, task: str) -> None:
+        self.mark_many([self.key(domain, ip, task)])
+
+    def mark_many(self, keys: Iterable[str]) -> None:
+        lines = "".join(f"{key}\n" for key in keys)
+        if not lines:
+            return
+        with self._lock:
+            if self._fd >= 0:
+                os.write(self._fd, lines.encode("utf-8"))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fd >= 0:
+                os.close(self._fd)
+                self._fd = -1
+
+    def _load(self) -> bool:
+        line = "\n"
+        with self.path.open("r", encoding="utf-8", errors="replace") as handle:
+            for line in handle:
+                # A line without its newline was cut short by a crash and does not count, now or after reopening.
+                if line.endswith("\n") and len(line) > 1 and not line.endswith(_CUT):
+                    self.completed.add(line[:-1])
+        return line.endswith("\n")
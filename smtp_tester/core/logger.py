@@ -1,38 +1,137 @@
 from __future__ import annotations
 
+import queue
+import threading
+from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List
+from typing import IO, Any, Callable, Iterator, List, Optional, Tuple
 
-from .models import SessionEvent, SessionLog
+from .models import BodyRef, SessionEvent, SessionLog
 from .utils import simple_yaml_dump
 
 
+_STOP = object()
+
+
 class SessionLogger:
-    def __init__(self, base_dir: Path, batch: str, run_ts: str | None = None):
+    """Appends each session as one YAML list item to its domain file from a background thread."""
+
+    def __init__(
+        self,
+        base_dir: Path,
+        batch: str,
+        run_ts: str | None = None,
+        max_open_files: int = 256,
+        queue_size: int = 1024,
+    ):
         self.base_dir = base_dir
         self.batch = batch
         self.run_ts = run_ts or datetime.utcnow().strftime("%Y%m%dT%H%M%S")
         self.base_dir.mkdir(parents=True, exist_ok=True)
         self.run_dir = self.base_dir / f"{self.batch}_{self.run_ts}"
         self.run_dir.mkdir(parents=True, exist_ok=True)
-        self.sessions_by_domain: Dict[str, List[SessionLog]] = {}
+        self.max_open_files = max(1, max_open_files)
+        # Bounded so a slow disk applies back-pressure instead of buffering sessions in memory.
+        self._queue: "queue.Queue[object]" = queue.Queue(maxsize=max(1, queue_size))
+        self._handles: "OrderedDict[str, IO[str]]" = OrderedDict()
+        self._error: Optional[BaseException] = None
+        self._closed = False
+        # Called from the writer thread with each batch once it has been flushed to disk.
+        self.persist_hooks: List[Callable[[List[SessionLog]], None]] = []
+        self._thread = threading.Thread(target=self._writer_loop, name="session-log-writer", daemon=True)
+        self._thread.start()
 
     def log_session(self, session: SessionLog) -> Path:
+        self._raise_writer_error()
+        if self._closed:
+            raise RuntimeError("SessionLogger is closed")
         safe_domain = session.target_domain.replace(" ", "_")
-        sessions = self.sessions_by_domain.setdefault(safe_domain, [])
-        sessions.append(session)
-        filename = self.run_dir / f"{safe_domain}.yaml"
-        payload = self._serialize_domain(sessions)
-        filename.write_text(payload, encoding="utf-8")
-        return filename
+        self._queue.put((safe_domain, session))
+        return self._target_path(safe_domain)
+
+    def note_session(self, session: SessionLog) -> None:
+        """Pass a session that has nothing to log through the writer, so persist hooks still see it in order."""
+        self._raise_writer_error()
+        if self._closed:
+            raise RuntimeError("SessionLogger is closed")
+        self._queue.put((None, session))
+
+    def _target_path(self, safe_domain: str) -> Path:
+        return self.run_dir / f"{safe_domain}.yaml"
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._raise_writer_error()
+
+    def _raise_writer_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError(f"session log writer failed: {error}") from error
+
+    def _writer_loop(self) -> None:
+        stopping = False
+        while not stopping:
+            batch: List[Tuple[Optional[str], SessionLog]] = []
+            item = self._queue.get()
+            while True:
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)  # type: ignore[arg-type]
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+                if batch:
+                    sessions = [session for _, session in batch]
+                    for hook in self.persist_hooks:
+                        hook(sessions)
+            except Exception as exc:  # noqa: BLE001
+                self._error = exc
+        try:
+            self._close_files()
+        except OSError as exc:
+            self._error = exc
+
+    def _close_files(self) -> None:
+        handles = list(self._handles.values())
+        self._handles.clear()
+        for handle in handles:
+            handle.close()
+
+    def _write_batch(self, batch: List[Tuple[Optional[str], SessionLog]]) -> None:
+        dirty: dict[str, IO[str]] = {}
+        for safe_domain, session in batch:
+            if safe_domain is None:
+                continue
+            handle = self._handle(safe_domain)
+            handle.write(simple_yaml_dump([self._serialize(session)]))
+            dirty[safe_domain] = handle
+        for handle in dirty.values():
+            if not handle.closed:
+                handle.flush()
 
-    def _serialize_domain(self, sessions: List[SessionLog]) -> str:
-        data = [self._serialize(session) for session in sessions]
-        return simple_yaml_dump(data)
+    def _handle(self, safe_domain: str) -> IO[str]:
+        handle = self._handles.get(safe_domain)
+        if handle is not None:
+            self._handles.move_to_end(safe_domain)
+            return handle
+        while len(self._handles) >= self.max_open_files:
+            _, oldest = self._handles.popitem(last=False)
+            oldest.close()
+        handle = self._target_path(safe_domain).open("a", encoding="utf-8")
+        self._handles[safe_domain] = handle
+        return handle
 
     def _serialize(self, session: SessionLog) -> dict:
-        return {
+        serialized = {
             "batch": session.batch,
             "task": session.task,
             "target_domain": session.target_domain,
@@ -43,8 +142,20 @@ class SessionLogger:
             "end_time": session.end_time.isoformat(),
             "status": session.status,
             "error": session.error or "",
-            "events": self._serialize_events(session.events),
         }
+        if session.source_address:
+            serialized["source_address"] = session.source_address
+        if session.variant:
+            serialized["variant"] = {
+                key: value.replace("\r", "\\r").replace("\n", "\\n") if isinstance(value, str) else value
+                for key, value in session.variant.items()
+            }
+        if session.capture:
+            serialized["capture"] = dict(session.capture)
+        # Fixed-point text so sub-millisecond values stay plain YAML floats instead of 1e-05.
+        serialized["timings"] = {phase: f"{value:.6f}" for phase, value in session.timings.items()}
+        serialized["events"] = self._serialize_events(session.events)
+        return serialized
 
     @staticmethod
     def _serialize_events(events: List[SessionEvent]) -> list[dict]:
@@ -56,10 +167,112 @@ class SessionLogger:
                 line.replace("\r", "\\r").replace("\n", "\\n")
                 for line in raw_text.splitlines(keepends=True)
             ]
-            serialized.append(
-                {
-                    "direction": event.direction,
-                    "bytes_raw": "\n".join(escaped_lines),
-                }
-            )
+            item = {"direction": event.direction, "bytes_raw": "\n".join(escaped_lines)}
+            if event.ref is not None:
+                # bytes_raw then holds only the first body_log_head bytes of a streamed body.
+                item.update(body_size=event.ref.size, body_sha256=event.ref.sha256, body_lines=event.ref.lines)
+            serialized.append(item)
         return serialized
+
+
+def read_session_file(path: Path) -> Iterator[SessionLog]:
+    """Parse a domain file written by SessionLogger back into sessions.
+
+    Only the layout SessionLogger writes is understood, not YAML in general.
+    """
+    fields: Optional[dict] = None
+    event: Optional[dict] = None
+    block: Optional[List[str]] = None
+    section = ""
+    with path.open("r", encoding="utf-8") as handle:
+        for line in handle:
+            line = line.rstrip("\n")
+            if block is not None:
+                if line.startswith(" " * 8):
+                    block.append(line[8:])
+                    continue
+                assert event is not None
+                event["bytes_raw"] = "".join(block)
+                block = None
+            if line == "-":
+                if fields is not None:
+                    yield _session_from_fields(fields)
+                fields = {"timings": {}, "variant": {}, "capture": {}, "events": []}
+                event = None
+                continue
+            if fields is None or not line.strip():
+                continue
+            indent = len(line) - len(line.lstrip(" "))
+            key, _, value = line.strip().partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if indent == 2:
+                section = key
+                if key not in ("timings", "variant", "capture", "events"):
+                    fields[key] = _unquote(value)
+            elif indent == 4 and section == "timings":
+                fields["timings"][key] = float(_unquote(value))
+            elif indent == 4 and section in ("variant", "capture"):
+                fields[section][key] = _variant_value(value)
+            elif indent == 4 and section == "events" and line.strip() == "-":
+                event = {}
+                fields["events"].append(event)
+            elif indent == 6 and event is not None:
+                if key == "bytes_raw" and value == "|":
+                    block = []
+                else:
+                    event[key] = _unquote(value)
+    if block is not None and event is not None:
+        event["bytes_raw"] = "".join(block)
+    if fields is not None:
+        yield _session_from_fields(fields)
+
+
+def _unquote(value: str) -> str:
+    if len(value) >= 2 and value.startswith('"') and value.endswith('"'):
+        return value[1:-1].replace("\\n", "\n").replace("\\r", "\r")
+    return value
+
+
+def _variant_value(value: str) -> Any:
+    if value.startswith('"'):
+        return _unquote(value)
+    if value == "null":
+        return None
+    if value in ("true", "false"):
+        return value == "true"
+    for kind in (int, float):
+        try:
+            return kind(value)
+        except ValueError:
+            pass
+    return value.replace("\\r", "\r").replace("\\n", "\n")
+
+
+def _session_from_fields(fields: dict) -> SessionLog:
+    events = [
+        SessionEvent(
+            direction=item.get("direction", ""),
+            payload=item.get("bytes_raw", "").replace("\\r", "\r").replace("\\n", "\n").encode("latin1", errors="replace"),
+            ref=BodyRef(int(item["body_size"]), item.get("body_sha256", ""), int(item.get("body_lines") or 0))
+            if "body_size" in item
+            else None,
+        )
+        for item in fields["events"]
+    ]
+    return SessionLog(
+        batch=fields.get("batch", ""),
+        task=fields.get("task", ""),
+        target_domain=fields.get("target_domain", ""),
+        mx_hostname=fields.get("mx_hostname", ""),
+        mx_preference=int(fields.get("mx_preference") or 0),
+        mx_ip=fields.get("mx_ip", ""),
+        start_time=datetime.fromisoformat(fields["start_time"]),
+        end_time=datetime.fromisoformat(fields["end_time"]),
+        status=fields.get("status", ""),
+        error=fields.get("error") or None,
+        source_address=fields.get("source_address") or None,
+        timings=fields["timings"],
+        variant=fields["variant"],
+        capture=fields["capture"],
+        events=events,
+    )
@@ -1,20 +1,115 @@
 from __future__ import annotations
 
+import dataclasses
+import itertools
+import string
+from collections import OrderedDict
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
+if TYPE_CHECKING:
+    from .body_stream import BodySource
+    from .stop_rules import StopRule
 
-@dataclass
+
+@dataclass(slots=True)
 class CommandSpec:
     data: bytes
     pause_after: float = 0.0
+    # Streamed DATA body; ``data`` is empty and ``values`` are what the body callable is given.
+    body: Optional["BodySource"] = None
+    values: Optional[dict] = None
+
+
+@dataclass
+class CompiledTemplate:
+    """Command bytes split into literal segments (bytes) and placeholder slots (str names)."""
+
+    raw: bytes
+    segments: Tuple[Union[bytes, str], ...]
+
+    @classmethod
+    def compile(cls, raw: Any) -> Optional["CompiledTemplate"]:
+        # Returns None for templates that need full str.format semantics (format specs, indexing, ...).
+        if isinstance(raw, bytes):
+            text = raw.decode("latin1")
+        elif isinstance(raw, str):
+            text = raw
+        else:
+            return None
+        segments: List[Union[bytes, str]] = []
+        try:
+            parsed = list(string.Formatter().parse(text))
+        except ValueError:
+            return None
+        for literal, field_name, format_spec, conversion in parsed:
+            if literal:
+                segments.append(literal.encode("latin1"))
+            if field_name is None:
+                continue
+            if format_spec or conversion or not field_name.isidentifier():
+                return None
+            segments.append(field_name)
+        return cls(raw=text.encode("latin1"), segments=tuple(segments))
+
+    def render(self, values: dict) -> bytes:
+        if not values:
+            return self.raw
+        return b"".join(
+            segment if isinstance(segment, bytes) else _value_bytes(values[segment])
+            for segment in self.segments
+        )
+
+
+def _value_bytes(value: Any) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, bytearray):
+        return bytes(value)
+    if isinstance(value, str):
+        return value.encode("latin1")
+    return format(value, "").encode("latin1")
 
 
 @dataclass
 class CommandTemplate:
     raw: Any
     pause_after: float = 0.0
+    compiled: Optional[CompiledTemplate] = None
+    body: Optional["BodySource"] = None
+
+
+# How a parametric task combines its axes: every combination, or the i-th value of each axis together.
+EXPAND_MODES = ("product", "zip")
+
+
+def task_key(name: str, variant_index: Optional[int] = None) -> str:
+    """A task's name, or ``name[i]`` for the i-th variant of a parametric task."""
+    return name if variant_index is None else f"{name}[{variant_index}]"
+
+
+def _axis_values(axis: Any) -> Iterable[Any]:
+    # Callables are called again on every pass, so generator axes can be re-iterated.
+    return axis() if callable(axis) else axis
+
+
+def _product(axes: List[Any]) -> Iterator[Tuple[Any, ...]]:
+    # itertools.product materializes every axis up front; this walks them one level at a time instead.
+    if not axes:
+        yield ()
+        return
+    for value in _axis_values(axes[0]):
+        for rest in _product(axes[1:]):
+            yield (value,) + rest
+
+
+def _log_value(value: Any) -> Any:
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value).decode("latin1")
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
 
 
 @dataclass
@@ -24,24 +119,120 @@ class TaskDefinition:
     description: str | None = None
     values: dict | None = None
     target_values: Dict[str, dict] | None = None
+    session_reuse: bool = False
+    mx_strategy: str = "all"
+    render_cache_size: int = 1024
+    # Value axes of a parametric task (name -> list, range or callable returning an iterable).
+    axes: Dict[str, Any] | None = None
+    expand: str = "product"
+    # Replies that cut the session short, and whether to wait for each reply before the next command
+    # (None: the batch's lockstep setting).
+    stop_on: List["StopRule"] = field(default_factory=list)
+    lockstep: Optional[bool] = None
+    # Set on the variants a parametric task expands into.
+    variant_index: Optional[int] = None
+    variant_values: Optional[dict] = None
+    _render_cache: "OrderedDict[Optional[str], List[CommandSpec]]" = field(
+        default_factory=OrderedDict, init=False, repr=False, compare=False
+    )
+
+    @property
+    def key(self) -> str:
+        return task_key(self.name, self.variant_index)
+
+    def variants(self) -> Iterator["TaskDefinition"]:
+        """The task once per combination of its axes, built as they are consumed."""
+        if not self.axes:
+            yield self
+            return
+        names = list(self.axes)
+        if self.expand == "zip":
+            combos: Iterable[Tuple[Any, ...]] = zip(*(_axis_values(self.axes[name]) for name in names))
+        else:
+            combos = _product([self.axes[name] for name in names])
+        for index, combo in enumerate(combos):
+            yield self._variant(index, names, combo)
+
+    def variant(self, index: int) -> "TaskDefinition":
+        """The ``index``-th variant, computed directly when every axis is a list, tuple or range."""
+        names = list(self.axes or {})
+        axes = [self.axes[name] for name in names] if self.axes else []
+        if not all(isinstance(axis, (list, tuple, range)) for axis in axes):
+            found = next(itertools.islice(self.variants(), index, None), None)
+            if found is None:
+                raise IndexError(f"Task {self.name} has no variant {index}")
+            return found
+        if index < 0 or index >= self.variant_count():
+            raise IndexError(f"Task {self.name} has no variant {index}")
+        if self.expand == "zip":
+            return self._variant(index, names, tuple(axis[index] for axis in axes))
+        combo = []
+        rest = index
+        # The last axis varies fastest, as in variants().
+        for axis in reversed(axes):
+            rest, position = divmod(rest, len(axis))
+            combo.append(axis[position])
+        return self._variant(index, names, tuple(reversed(combo)))
+
+    def _variant(self, index: int, names: List[str], combo: Tuple[Any, ...]) -> "TaskDefinition":
+        # Each variant renders once per domain at most, so it keeps no render cache of its own.
+        return dataclasses.replace(
+            self, axes=None, variant_index=index, variant_values=dict(zip(names, combo)), render_cache_size=0
+        )
+
+    def variant_count(self) -> int:
+        if not self.axes:
+            return 1
+        counts = []
+        for axis in self.axes.values():
+            values = _axis_values(axis)
+            counts.append(len(values) if hasattr(values, "__len__") else sum(1 for _ in values))
+        if self.expand == "zip":
+            return min(counts)
+        total = 1
+        for count in counts:
+            total *= count
+        return total
+
+    def variant_log(self) -> Dict[str, Any]:
+        """What a session log records about the variant it ran: its index and axis values."""
+        if self.variant_index is None:
+            return {}
+        values = {name: _log_value(value) for name, value in (self.variant_values or {}).items()}
+        return {"index": self.variant_index, **values}
 
     def render_commands(self, domain: str | None = None) -> List[CommandSpec]:
+        # Output only depends on the domain's overrides, so domains without one share an entry.
+        key = domain if domain and self.target_values and domain in self.target_values else None
+        cached = self._render_cache.get(key)
+        if cached is not None:
+            self._render_cache.move_to_end(key)
+            return list(cached)
         merged_values: Dict[str, Any] = {}
         if self.values:
             merged_values.update(self.values)
-        if domain and self.target_values and domain in self.target_values:
-            domain_values = self.target_values[domain]
+        if key is not None:
+            domain_values = self.target_values[key]
             if isinstance(domain_values, dict):
                 merged_values.update(domain_values)
             else:
                 raise ValueError(f"Task {self.name} target_values for {domain} must be a dict")
-        return [
-            CommandSpec(
-                data=self._render_bytes(cmd.raw, merged_values),
+        if self.variant_values:
+            merged_values.update(self.variant_values)
+        rendered = [
+            CommandSpec(data=b"", pause_after=cmd.pause_after, body=cmd.body, values=merged_values)
+            if cmd.body is not None
+            else CommandSpec(
+                data=cmd.compiled.render(merged_values) if cmd.compiled else self._render_bytes(cmd.raw, merged_values),
                 pause_after=cmd.pause_after,
             )
             for cmd in self.commands
         ]
+        if self.render_cache_size > 0:
+            self._render_cache[key] = rendered
+            while len(self._render_cache) > self.render_cache_size:
+                self._render_cache.popitem(last=False)
+        return list(rendered)
 
     @staticmethod
     def _render_bytes(raw: Any, values: dict) -> bytes:
@@ -59,7 +250,7 @@ class TaskDefinition:
         return formatted.encode("latin1")
 
 
-@dataclass
+@dataclass(slots=True)
 class MXRecord:
     hostname: str
     preference: int
@@ -67,13 +258,24 @@ class MXRecord:
     domain: str
 
 
-@dataclass
+@dataclass(slots=True)
+class BodyRef:
+    """Stands in for a streamed body too large to log: what was sent, without the bytes."""
+
+    size: int
+    sha256: str
+    lines: int
+
+
+@dataclass(slots=True)
 class SessionEvent:
     direction: str  # "send" or "recv"
-    payload: bytes
+    payload: bytes  # recv payloads are bytearrays that grow while chunks keep arriving
+    # Set for bodies logged by reference; ``payload`` then holds only their first bytes.
+    ref: Optional[BodyRef] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class SessionLog:
     batch: str
     task: str
@@ -85,4 +287,13 @@ class SessionLog:
     end_time: datetime
     status: str
     error: Optional[str] = None
+    # Local address the session was bound to, when source_addresses is configured.
+    source_address: Optional[str] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    # Index and axis values of the parametric task variant the session ran; empty otherwise.
+    variant: Dict[str, Any] = field(default_factory=dict)
+    # What the capture policy trimmed from ``events`` (sampled_out, hashed, omitted_bytes/_events, gap_at).
+    capture: Dict[str, Any] = field(default_factory=dict)
     events: List[SessionEvent] = field(default_factory=list)
+    # (verb, code, text) of every reply, taken before the capture policy trimmed ``events``; never logged.
+    replies: Optional[List[Tuple[str, int, str]]] = field(default=None, compare=False, repr=False)
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import hashlib
+import mmap
+import os
+import shutil
+import socket
+import struct
+import sys
+from pathlib import Path
+from typing import IO, Dict, Iterator, Optional
+
+from .models import MXRecord
+from .mx_loader import iter_mx_targets
+
+
+# File layout: magic, header, fixed-size record table, newline-separated UTF-8 string table.
+_MAGIC = b"SMTPMXC1"
+_HEADER = struct.Struct("<QQ32sQQ")  # source size, source mtime_ns, source sha256, records, strings
+_RECORD = struct.Struct("<IIi4s")  # domain string, hostname string, preference, packed IPv4
+
+
+def cache_path_for(path: Path) -> Path:
+    return path.with_name(f"{path.name}.mxcache")
+
+
+def iter_cached_mx_targets(path: Path, rebuild: bool = False) -> Iterator[MXRecord]:
+    """Yield records from the compiled sidecar cache, (re)building it from the YAML when stale."""
+    cache_path = cache_path_for(path)
+    if not rebuild and _cache_is_current(path, cache_path):
+        yield from _read_cache(cache_path)
+        return
+    builder = _CacheBuilder(cache_path)
+    try:
+        for record in iter_mx_targets(path):
+            builder.add(record)
+            yield record
+    except BaseException:
+        # Also reached when the consumer stops early and the generator is closed.
+        builder.discard()
+        raise
+    builder.finish(path)
+
+
+def ensure_mx_cache(path: Path, rebuild: bool = False) -> bool:
+    """Build the cache up front when missing or stale; returns True if it was (re)built."""
+    if not rebuild and _cache_is_current(path, cache_path_for(path)):
+        return False
+    for _ in iter_cached_mx_targets(path, rebuild=True):
+        pass
+    return True
+
+
+def cached_record_count(path: Path) -> Optional[int]:
+    """Number of records in the sidecar cache of ``path``, read from its header (None without a cache)."""
+    header = _read_header(cache_path_for(path))
+    return header[3] if header else None
+
+
+def _source_digest(path: Path) -> bytes:
+    digest = hashlib.sha256()
+    with path.open("rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _read_header(cache_path: Path) -> Optional[tuple]:
+    try:
+        with cache_path.open("rb") as handle:
+            head = handle.read(len(_MAGIC) + _HEADER.size)
+    except OSError:
+        return None
+    if len(head) < len(_MAGIC) + _HEADER.size or not head.startswith(_MAGIC):
+        return None
+    return _HEADER.unpack_from(head, len(_MAGIC))
+
+
+def _cache_is_current(path: Path, cache_path: Path) -> bool:
+    header = _read_header(cache_path)
+    if header is None:
+        return False
+    size, mtime_ns, digest, _, _ = header
+    stat = path.stat()
+    if stat.st_size != size:
+        return False
+    if stat.st_mtime_ns == mtime_ns:
+        return True
+    # Touched but possibly unchanged: the content hash decides.
+    return _source_digest(path) == digest
+
+
+def _read_cache(cache_path: Path) -> Iterator[MXRecord]:
+    with cache_path.open("rb") as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        _, _, _, record_count, string_count = _HEADER.unpack_from(mapped, len(_MAGIC))
+        records_start = len(_MAGIC) + _HEADER.size
+        strings_start = records_start + record_count * _RECORD.size
+        blob = mapped[strings_start:].decode("utf-8")
+        strings = [sys.intern(value) for value in blob.split("\n")] if string_count else []
+        if len(strings) != string_count:
+            raise ValueError(f"Corrupt MX cache {cache_path}")
+        view = memoryview(mapped)[records_start:strings_start]
+        unpacked = _RECORD.iter_unpack(view)
+        ntoa = socket.inet_ntoa
+        try:
+            for domain_index, host_index, preference, packed_ip in unpacked:
+                yield MXRecord(strings[host_index], preference, ntoa(packed_ip), strings[domain_index])
+        finally:
+            del unpacked
+            view.release()
+
+
+class _CacheBuilder:
+    """Writes the cache while the records stream past.
+
+    The record table goes straight into a temp file next to the cache and the string table into a
+    second one; at the end the strings are appended, the header filled in and the file renamed into place.
+    Only the string ids are kept in memory.
+    """
+
+    def __init__(self, cache_path: Path) -> None:
+        self.cache_path = cache_path
+        self.tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        self.strings_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.strings.tmp")
+        self.handle: Optional[IO[bytes]] = None
+        self.strings_handle: Optional[IO[bytes]] = None
+        self.count = 0
+        self.string_ids: Dict[str, int] = {}
+        try:
+            self.handle = self.tmp_path.open("wb")
+            self.strings_handle = self.strings_path.open("wb")
+            # The header is rewritten once the counts are known.
+            self.handle.write(_MAGIC + bytes(_HEADER.size))
+        except OSError as exc:
+            self._fail(exc)
+
+    def add(self, record: MXRecord) -> None:
+        if self.handle is None:
+            return
+        try:
+            self.handle.write(
+                _RECORD.pack(
+                    self._string_id(record.domain),
+                    self._string_id(record.hostname),
+                    record.preference,
+                    socket.inet_aton(record.ip),
+                )
+            )
+        except OSError as exc:
+            self._fail(exc)
+            return
+        self.count += 1
+
+    def _string_id(self, value: str) -> int:
+        index = self.string_ids.get(value)
+        if index is None:
+            assert self.strings_handle is not None
+            index = self.string_ids[value] = len(self.string_ids)
+            self.strings_handle.write((b"\n" if index else b"") + value.encode("utf-8"))
+        return index
+
+    def finish(self, source: Path) -> None:
+        if self.handle is None or self.strings_handle is None:
+            return
+        try:
+            stat = source.stat()
+            self.strings_handle.close()
+            with self.strings_path.open("rb") as strings:
+                shutil.copyfileobj(strings, self.handle)
+            self.handle.seek(len(_MAGIC))
+            self.handle.write(
+                _HEADER.pack(stat.st_size, stat.st_mtime_ns, _source_digest(source), self.count, len(self.string_ids))
+            )
+            self.handle.close()
+            os.replace(self.tmp_path, self.cache_path)
+        except OSError as exc:
+            self._fail(exc)
+        finally:
+            self.strings_path.unlink(missing_ok=True)
+
+    def discard(self) -> None:
+        """Drop the partial cache, e.g. when the stream was not read to the end."""
+        for handle in (self.handle, self.strings_handle):
+            if handle is not None:
+                handle.close()
+        self.handle = self.strings_handle = None
+        self.tmp_path.unlink(missing_ok=True)
+        self.strings_path.unlink(missing_ok=True)
+
+    def _fail(self, exc: OSError) -> None:
+        self.discard()
+        print(f"[!] could not write MX cache {self.cache_path}: {exc}")
@@ -1,141 +1,152 @@
 from __future__ import annotations
 
-import ipaddress
+import sys
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List, Optional
 
 from .models import MXRecord
 
 
 def load_mx_targets(path: Path) -> List[MXRecord]:
-    data = _read_yaml(path)
-    if not isinstance(data, dict):
-        raise ValueError("mx_target.yaml must be a mapping of domain to records")
-    records: List[MXRecord] = []
-    for domain, entries in data.items():
-        if not isinstance(entries, list):
-            continue
-        for item in entries:
-            if not isinstance(item, dict):
+    return list(iter_mx_targets(path))
+
+
+def iter_mx_targets(path: Path) -> Iterator[MXRecord]:
+    """Stream MX records domain by domain (each domain sorted by preference) without loading the file.
+
+    Understands the block-style layout of ``mx_target.yaml``: top-level domain keys holding lists of
+    ``hostname``/``preference``/``ips`` mappings, with ``ips`` as a block or ``[a, b]`` flow list.
+    """
+    with path.open("r", encoding="utf-8") as handle:
+        yield from _MXStreamParser(path).parse(handle)
+
+
+class _MXStreamParser:
+    def __init__(self, path: Path):
+        self.path = path
+        self.domain: Optional[str] = None
+        self.records: List[MXRecord] = []
+        self.item: Optional[Dict[str, Any]] = None
+        self.list_key: Optional[str] = None
+
+    def parse(self, lines: Any) -> Iterator[MXRecord]:
+        for lineno, raw_line in enumerate(lines, 1):
+            line = _strip_comment(raw_line.rstrip("\r\n"))
+            content = line.strip()
+            if not content or content in {"---", "..."}:
                 continue
-            hostname = str(item.get("hostname", "")).strip()
-            preference = int(item.get("preference", 0))
-            ips = item.get("ips", [])
-            if not hostname or not isinstance(ips, list):
+            indent = len(line) - len(line.lstrip(" "))
+            if indent == 0 and not content.startswith("-"):
+                yield from self._finish_domain()
+                pair = _try_split_key(content)
+                if pair is None:
+                    raise self._error(lineno, "expected 'domain:'")
+                key, rest = pair
+                self.domain = sys.intern(key)
+                if rest and rest not in {"[]", "null", "~"}:
+                    raise self._error(lineno, "domain entries must be a list of MX hosts")
                 continue
-            for ip in ips:
-                if not _is_ipv4(ip):
+            if self.domain is None:
+                raise self._error(lineno, "entry outside of a domain")
+            if content == "-" or content.startswith("- "):
+                entry = content[1:].strip()
+                pair = _try_split_key(entry)
+                if pair is None:
+                    if self.item is None or self.list_key is None:
+                        raise self._error(lineno, f"unexpected list value {entry!r}")
+                    self.item.setdefault(self.list_key, []).append(_unquote(entry))
                     continue
-                records.append(
-                    MXRecord(
-                        hostname=hostname,
-                        preference=preference,
-                        ip=str(ip),
-                        domain=str(domain),
-                    )
-                )
-    return records
-
-
-def _read_yaml(path: Path) -> Any:
-    text = path.read_text(encoding="utf-8")
-    try:
-        import yaml  # type: ignore
-
-        return yaml.safe_load(text)
-    except Exception:
-        return _minimal_yaml_parse(text)
-
-
-def _minimal_yaml_parse(text: str) -> Any:
-    lines = [line for line in text.splitlines() if line.strip() and not line.strip().startswith("#")]
-    index = 0
-
-    def current_indent(line: str) -> int:
-        return len(line) - len(line.lstrip(" "))
-
-    def parse_scalar(raw: str) -> Any:
-        if raw.startswith("\"") and raw.endswith("\""):
-            return raw[1:-1]
-        if raw.lower() == "null":
-            return None
-        if raw.lower() in {"true", "false"}:
-            return raw.lower() == "true"
-        try:
-            return int(raw)
-        except ValueError:
-            try:
-                return float(raw)
-            except ValueError:
-                return raw
-
-    def parse_block(expected_indent: int) -> Any:
-        nonlocal index
-        if index >= len(lines):
-            return None
-        line = lines[index]
-        indent = current_indent(line)
-        if indent != expected_indent:
-            return None
-        content = line.strip()
-        if content.startswith("- "):
-            items: list[Any] = []
-            while index < len(lines):
-                line = lines[index]
-                indent = current_indent(line)
-                if indent != expected_indent or not line.strip().startswith("- "):
-                    break
-                entry = line.strip()[2:]
-                index += 1
-                if ":" in entry:
-                    key, rest = entry.split(":", 1)
-                    key = key.strip()
-                    if rest.strip():
-                        item: Any = {key: parse_scalar(rest.strip())}
-                    else:
-                        item = {key: parse_block(expected_indent + 2)}
-                elif entry:
-                    item = parse_scalar(entry)
-                else:
-                    item = parse_block(expected_indent + 2)
-                while index < len(lines) and current_indent(lines[index]) > expected_indent:
-                    child = parse_block(expected_indent + 2)
-                    if isinstance(item, dict) and isinstance(child, dict):
-                        item.update(child)
-                    elif isinstance(item, dict):
-                        item["value"] = child
-                    else:
-                        item = child
-                items.append(item)
-            return items
-        mapping: Dict[str, Any] = {}
-        while index < len(lines):
-            line = lines[index]
-            indent = current_indent(line)
-            if indent != expected_indent:
-                break
-            content = line.strip()
-            if ":" not in content:
-                index += 1
+                self._finish_item()
+                self.item = {}
+                self.list_key = None
+                self._set(pair[0], pair[1], lineno)
+                continue
+            pair = _try_split_key(content)
+            if self.item is None or pair is None:
+                raise self._error(lineno, f"unexpected line {content!r}")
+            self._set(pair[0], pair[1], lineno)
+        yield from self._finish_domain()
+
+    def _set(self, key: str, rest: str, lineno: int) -> None:
+        assert self.item is not None
+        if not rest:
+            self.item[key] = []
+            self.list_key = key
+        elif rest.startswith("["):
+            if not rest.endswith("]"):
+                raise self._error(lineno, "multi-line flow lists are not supported")
+            self.item[key] = [_unquote(part.strip()) for part in rest[1:-1].split(",") if part.strip()]
+            self.list_key = None
+        elif rest.startswith(("{", "&", "*", "|", ">")):
+            raise self._error(lineno, f"unsupported YAML syntax {rest!r}")
+        else:
+            self.item[key] = None if rest in {"null", "~"} else _unquote(rest)
+            self.list_key = None
+
+    def _finish_item(self) -> None:
+        item, self.item = self.item, None
+        if not item or self.domain is None:
+            return
+        hostname = str(item.get("hostname", "") or "").strip()
+        preference = int(item.get("preference", 0) or 0)
+        ips = item.get("ips", [])
+        if not hostname or not isinstance(ips, list):
+            return
+        hostname = sys.intern(hostname)
+        for ip in ips:
+            if not _is_ipv4(ip):
                 continue
-            key, rest = content.split(":", 1)
-            if rest.strip():
-                mapping[key.strip()] = parse_scalar(rest.strip())
-                index += 1
-            else:
-                index += 1
-                if index < len(lines) and current_indent(lines[index]) > expected_indent:
-                    mapping[key.strip()] = parse_block(expected_indent + 2)
-                else:
-                    mapping[key.strip()] = None
-        return mapping
-
-    result = parse_block(0)
-    return result
-
-
-def _is_ipv4(value: str) -> bool:
-    try:
-        return ipaddress.ip_address(value).version == 4
-    except ValueError:
+            self.records.append(MXRecord(hostname=hostname, preference=preference, ip=str(ip), domain=self.domain))
+
+    def _finish_domain(self) -> Iterator[MXRecord]:
+        self._finish_item()
+        records, self.records = self.records, []
+        self.list_key = None
+        records.sort(key=lambda r: (r.preference, r.hostname, r.ip))
+        yield from records
+
+    def _error(self, lineno: int, message: str) -> ValueError:
+        return ValueError(f"{self.path}:{lineno}: {message}")
+
+
+def _strip_comment(line: str) -> str:
+    if "#" not in line:
+        return line
+    if line.lstrip().startswith("#"):
+        return ""
+    if "\"" in line or "'" in line:
+        return line
+    position = line.find(" #")
+    return line[:position] if position >= 0 else line
+
+
+def _try_split_key(content: str) -> Optional[tuple]:
+    if ":" not in content:
+        return None
+    key, rest = content.split(":", 1)
+    if rest and not rest.startswith(" "):
+        return None
+    return _unquote(key.strip()), rest.strip()
+
+
+def _unquote(raw: str) -> str:
+    if len(raw) >= 2 and raw[0] == raw[-1] and raw[0] in {"\"", "'"}:
+        return raw[1:-1]
+    return raw
+
+
+def _is_ipv4(value: Any) -> bool:
+    # Same acceptance as ipaddress (four decimal octets, no leading zeros) without building an object.
+    if not isinstance(value, str):
+        return False
+    parts = value.split(".")
+    if len(parts) != 4:
         return False
+    for part in parts:
+        if not part or len(part) > 3 or not part.isascii() or not part.isdigit():
+            return False
+        if len(part) > 1 and part[0] == "0":
+            return False
+        if int(part) > 255:
+            return False
+    return True
@@ -0,0 +1,270 @@
+from __future__ import annotations
+
+import itertools
+import json
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from operator import attrgetter
+from pathlib import Path
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .models import MXRecord, TaskDefinition
+from .timing import TIMINGS_FILE, RunTimings
+
+
+PLAN_VERSION = 1
+_HEADER = "# smtp_tester plan "
+
+
+@dataclass
+class PlannedDomain:
+    """One domain's share of a run: its MX records, the tasks raced once per domain and the units run per record."""
+
+    domain: str
+    records: List[MXRecord]
+    raced: List[str]
+    # Task names per connection; every record of the domain runs the same units.
+    units: List[Tuple[str, ...]]
+
+
+def selected_tasks(tasks: List[TaskDefinition], names: Optional[set]) -> List[TaskDefinition]:
+    return [task for task in tasks if not (names and task.name not in names)]
+
+
+def compile_plan(
+    mx_records: Iterable[MXRecord], tasks: List[TaskDefinition], names: Optional[set] = None, reuse: bool = False
+) -> Iterator[PlannedDomain]:
+    """The (record x task) matrix of a run, one domain at a time, before any journal is applied."""
+    tasks = selected_tasks(tasks, names)
+    for domain, group in itertools.groupby(mx_records, key=attrgetter("domain")):
+        domain_tasks = [task for task in tasks if not (task.target_values and domain not in task.target_values)]
+        units: List[Tuple[str, ...]] = []
+        shared: List[str] = []
+        shared_at = 0
+        for task in domain_tasks:
+            if task.mx_strategy == "first_reachable":
+                continue
+            # Variants of a parametric task each get their own connection.
+            if reuse and task.session_reuse and not task.axes and _reusable(task):
+                if not shared:
+                    # The shared connection runs where its first task would have run.
+                    shared_at = len(units)
+                    units.append(())
+                shared.append(task.name)
+            else:
+                units.append((task.name,))
+        if shared:
+            units[shared_at] = tuple(shared)
+        yield PlannedDomain(
+            domain=domain,
+            records=list(group),
+            raced=[task.name for task in domain_tasks if task.mx_strategy == "first_reachable"],
+            units=units,
+        )
+
+
+def _reusable(task: TaskDefinition) -> bool:
+    # A trailing RSET must start on a fresh line, so unterminated probes cannot share a session.
+    if not task.commands:
+        return False
+    raw = task.commands[-1].raw
+    return isinstance(raw, (bytes, str)) and raw[-1:] in (b"\n", "\n")
+
+
+def write_plan(handle: IO[str], meta: dict, domains: Iterable[PlannedDomain]) -> Iterator[PlannedDomain]:
+    """Write a plan file while passing the domains through, so it can be summarized in the same pass.
+
+    Layout: a JSON header line, then per domain a ``D`` line (domain, raced tasks, units with ``+``
+    joining the tasks of a shared connection) followed by one ``R`` line per MX record.
+    """
+    handle.write(_HEADER + json.dumps({**meta, "version": PLAN_VERSION}, sort_keys=True) + "\n")
+    for planned in domains:
+        units = ",".join("+".join(unit) for unit in planned.units)
+        handle.write(f"D\t{planned.domain}\t{','.join(planned.raced)}\t{units}\n")
+        for record in planned.records:
+            handle.write(f"R\t{record.hostname}\t{record.preference}\t{record.ip}\n")
+        yield planned
+
+
+def read_plan_meta(path: Path) -> dict:
+    with path.open("r", encoding="utf-8") as handle:
+        header = handle.readline()
+    if not header.startswith(_HEADER):
+        raise ValueError(f"{path} is not a plan file")
+    meta = json.loads(header[len(_HEADER):])
+    if meta.get("version") != PLAN_VERSION:
+        raise ValueError(f"{path} has plan version {meta.get('version')}, expected {PLAN_VERSION}")
+    return meta
+
+
+def read_plan(path: Path) -> Iterator[PlannedDomain]:
+    read_plan_meta(path)
+    planned: Optional[PlannedDomain] = None
+    domain_line = 0
+    with path.open("r", encoding="utf-8") as handle:
+        next(handle)
+        for number, line in enumerate(handle, start=2):
+            fields = line.rstrip("\n").split("\t")
+            if fields[0] == "D" and len(fields) == 4:
+                if planned is not None:
+                    yield _checked(planned, path, domain_line)
+                _, domain, raced, units = fields
+                planned = PlannedDomain(
+                    domain=domain,
+                    records=[],
+                    raced=raced.split(",") if raced else [],
+                    units=[tuple(unit.split("+")) for unit in units.split(",")] if units else [],
+                )
+                domain_line = number
+            elif fields[0] == "R" and len(fields) == 4 and planned is not None:
+                _, hostname, preference, ip = fields
+                planned.records.append(MXRecord(hostname=hostname, preference=int(preference), ip=ip, domain=planned.domain))
+            else:
+                raise ValueError(f"{path}:{number}: malformed plan line")
+    if planned is not None:
+        yield _checked(planned, path, domain_line)
+
+
+def _checked(planned: PlannedDomain, path: Path, number: int) -> PlannedDomain:
+    # compile_plan never writes a domain without records, so one means the file was cut or edited.
+    if not planned.records:
+        raise ValueError(f"{path}:{number}: malformed plan: domain {planned.domain} has no R lines")
+    return planned
+
+
+@dataclass
+class PlanSummary:
+    """Session counts and a duration estimate for a plan, accumulated one domain at a time."""
+
+    expected: Dict[str, float]
+    worst: Dict[str, float]
+    # Variants per parametric task; a unit naming one runs that many sessions.
+    variants: Dict[str, int] = field(default_factory=dict)
+    sessions: int = 0
+    connections: int = 0
+    records: int = 0
+    domains: int = 0
+    per_task: Counter = field(default_factory=Counter)
+    per_domain: Counter = field(default_factory=Counter)
+    # Connections and summed expected / worst session time per IP lane and per domain, for the pacing bounds.
+    ip_connections: Counter = field(default_factory=Counter)
+    domain_connections: Counter = field(default_factory=Counter)
+    ip_expected: Counter = field(default_factory=Counter)
+    ip_worst: Counter = field(default_factory=Counter)
+
+    def add(self, planned: PlannedDomain) -> None:
+        self.domains += 1
+        self.records += len(planned.records)
+        lanes = [(planned.records[0].ip, (name,)) for name in planned.raced] if planned.records else []
+        lanes += [(record.ip, unit) for record in planned.records for unit in planned.units]
+        for ip, unit in lanes:
+            # Parametric tasks never share a connection, so a unit has either variants or several tasks.
+            repeat = self.variants.get(unit[0], 1) if len(unit) == 1 else 1
+            self.connections += repeat
+            self.ip_connections[ip] += repeat
+            self.domain_connections[planned.domain] += repeat
+            for name in unit:
+                self.sessions += repeat
+                self.per_task[name] += repeat
+                self.per_domain[planned.domain] += repeat
+                self.ip_expected[ip] += self.expected[name] * repeat
+                self.ip_worst[ip] += self.worst[name] * repeat
+
+    def eta(self, config: dict, parallel: int, worst: bool = False) -> float:
+        per_ip = self.ip_worst if worst else self.ip_expected
+        ip_rate = float(config.get("ip_rate", 0) or 0)
+        spacing = 1 / ip_rate if ip_rate > 0 else 0.0
+        # Whoever runs a record's last unit pauses delay_between_hosts before taking more work.
+        pauses = self.records * float(config.get("delay_between_hosts", 1.0) or 0)
+        bounds = [(sum(per_ip.values()) + pauses) / max(1, parallel)]
+        # One IP's sessions never overlap and are spaced out, so the slowest lane bounds the run.
+        bounds += [per_ip[ip] + (count - 1) * spacing for ip, count in self.ip_connections.items()]
+        domain_rate = float(config.get("domain_rate", 0) or 0)
+        if domain_rate > 0 and self.domain_connections:
+            bounds.append((self.domain_connections.most_common(1)[0][1] - 1) / domain_rate)
+        global_rate = float(config.get("global_rate", 0) or 0)
+        if global_rate > 0:
+            bounds.append(max(0, self.connections - 1) / global_rate)
+        sources = len(config.get("source_addresses") or [])
+        source_rate = float(config.get("source_rate", 0) or 0)
+        if sources and source_rate > 0:
+            bounds.append(max(0, self.connections - sources) / (source_rate * sources))
+        return max(bounds)
+
+    def format_lines(self, config: dict, parallel: int, top: int = 10) -> List[str]:
+        lines = [
+            f"{self.sessions} session(s) over {self.connections} connection(s) to "
+            f"{len(self.ip_connections)} IP(s) in {self.domains} domain(s)"
+        ]
+        for name, count in sorted(self.per_task.items()):
+            variants = f" ({self.variants[name]} variant(s))" if self.variants.get(name, 1) > 1 else ""
+            lines.append(f"task {name}: {count} session(s){variants}")
+        for domain, count in self.per_domain.most_common(top):
+            lines.append(f"domain {domain}: {count} session(s)")
+        if len(self.per_domain) > top:
+            lines.append(f"... {len(self.per_domain) - top} more domain(s)")
+        lines.append(
+            f"eta expected {format_duration(self.eta(config, parallel))}, "
+            f"worst case {format_duration(self.eta(config, parallel, worst=True))} with {parallel} session(s) in parallel"
+        )
+        return lines
+
+
+def task_estimates(
+    tasks: List[TaskDefinition], config: dict, history: Optional[RunTimings] = None
+) -> Tuple[Dict[str, float], Dict[str, float]]:
+    """Expected and worst-case seconds per session of each task.
+
+    Worst case: the connect, banner and final idle timeouts all run out, plus every configured delay.
+    Expected: the median session time of the task in ``history`` when it has one, otherwise the delays
+    alone plus the idle timeout for sessions that always wait it out.
+    """
+    connect = float(config.get("connect_timeout", 8.0))
+    banner = float(config.get("banner_timeout", 8.0))
+    idle = float(config.get("command_timeout", 8.0))
+    before = float(config.get("delay_before_first_command", 0.0))
+    between = float(config.get("delay_between_commands", 0.0))
+    reply_aware = bool(config.get("reply_aware", True))
+    expected: Dict[str, float] = {}
+    worst: Dict[str, float] = {}
+    for task in tasks:
+        delays = before + sum(command.pause_after + between for command in task.commands)
+        worst[task.name] = connect + banner + idle + delays
+        total = history.histograms["task"].get(task.name, {}).get("total") if history else None
+        if total is not None and total.count:
+            expected[task.name] = total.quantile(0.5)
+        else:
+            last = task.commands[-1].raw if task.commands else None
+            # Without reply tracking, or after an unterminated probe, every session waits out command_timeout.
+            waits_idle = not reply_aware or (isinstance(last, (bytes, str)) and last[-1:] not in (b"\n", "\n"))
+            expected[task.name] = delays + (idle if waits_idle else 0.0)
+    return expected, worst
+
+
+def latest_timings(log_dir: Path, batch: str) -> Optional[Tuple[str, RunTimings]]:
+    """Timings of the most recent run of ``batch`` under ``log_dir`` that has any."""
+    for path in sorted(log_dir.glob(f"{batch}_*/{TIMINGS_FILE}"), reverse=True):
+        try:
+            return path.parent.name, RunTimings.load(path)
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+def format_duration(seconds: float) -> str:
+    if seconds < 1:
+        return f"{seconds * 1000:.0f}ms"
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def plan_meta(batch: str, names: Optional[set], tasks: List[TaskDefinition]) -> dict:
+    return {
+        "batch": batch,
+        "created": datetime.utcnow().isoformat(timespec="seconds"),
+        "tasks": sorted(task.name for task in selected_tasks(tasks, names)),
+    }
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, List, Optional, Sequence, Tuple
+
+from .models import SessionEvent
+
+
+BANNER = b"<banner>"
+BODY = b"<body>"
+# What users write for the replies that answer no command verb: the greeting and the reply to a DATA body.
+PSEUDO_VERBS = {"BANNER": BANNER, "BODY": BODY}
+
+
+def verb_key(name: str) -> bytes:
+    """A verb as users write it (``RCPT``, ``BANNER``, ``<body>``, any case) in the form replies are matched under."""
+    text = name.strip().upper()
+    if text.startswith("<") and text.endswith(">"):
+        text = text[1:-1]
+    return PSEUDO_VERBS.get(text, text.encode("latin1"))
+
+
+def parse_code(pattern: str) -> Tuple[int, int]:
+    """Turn ``550``, ``55x`` or ``5xx`` into an inclusive code range."""
+    text = pattern.strip().lower()
+    if len(text) != 3 or not text[0].isdigit() or not all(ch.isdigit() or ch == "x" for ch in text):
+        raise ValueError(f"invalid reply code {pattern!r} (expected e.g. 550, 55x or 5xx)")
+    return int(text.replace("x", "0")), int(text.replace("x", "9"))
+
+
+@dataclass
+class SMTPReply:
+    code: int
+    lines: List[bytes] = field(default_factory=list)
+
+    @property
+    def text(self) -> bytes:
+        return b"\r\n".join(self.lines)
+
+
+class ReplyParser:
+    """Incremental SMTP reply parser that understands ``250-`` continuation lines."""
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+        self._lines: List[bytes] = []
+
+    def feed(self, data: bytes) -> List[SMTPReply]:
+        self._buffer.extend(data)
+        replies: List[SMTPReply] = []
+        start = 0
+        while True:
+            end = self._buffer.find(b"\n", start)
+            if end < 0:
+                break
+            line = bytes(self._buffer[start:end]).rstrip(b"\r")
+            start = end + 1
+            self._lines.append(line)
+            code = line[:3]
+            if len(code) == 3 and code.isdigit():
+                if line[3:4] == b"-":
+                    continue
+                replies.append(SMTPReply(code=int(code), lines=self._lines))
+            else:
+                # Not SMTP; count the line as a reply so callers never wait on it forever.
+                replies.append(SMTPReply(code=0, lines=self._lines))
+            self._lines = []
+        if start:
+            del self._buffer[:start]
+        return replies
+
+
+class ReplyTracker:
+    """Counts replies still owed for streamed commands, following DATA bodies and their terminator."""
+
+    def __init__(self, expect_banner: bool = True) -> None:
+        self.parser = ReplyParser()
+        self.exchanges: List[Tuple[bytes, SMTPReply]] = []
+        # Entries are [verb, replies owed, body lines]; a DATA body owes one reply, or one per line if DATA was refused.
+        self._pending: Deque[List] = deque()
+        self._partial = bytearray()
+        self._in_body = False
+        self._body_lines = 0
+        self._refuse_next_body = False
+        self.done_sending = False
+        if expect_banner:
+            self._pending.append([BANNER, 1, 1])
+
+    @property
+    def outstanding(self) -> int:
+        return sum(entry[1] for entry in self._pending)
+
+    @property
+    def terminated(self) -> bool:
+        """True when every command sent so far ends with a line break and no DATA body is open."""
+        return not self._partial and not self._in_body
+
+    @property
+    def satisfied(self) -> bool:
+        return self.done_sending and self.terminated and not self._pending
+
+    def sent(self, data: bytes) -> None:
+        start = 0
+        while True:
+            end = data.find(b"\n", start)
+            if end < 0:
+                break
+            if self._partial:
+                self._partial.extend(data[start:end + 1])
+                line = bytes(self._partial)
+                self._partial.clear()
+            else:
+                line = data[start:end + 1]
+            start = end + 1
+            self._sent_line(line)
+        if start < len(data):
+            self._partial.extend(data[start:])
+
+    def sent_body(self, lines: int) -> None:
+        """Account for a streamed DATA body of ``lines`` lines (terminator included) without seeing its bytes."""
+        if not self._in_body:
+            # No DATA before it, so the server reads every body line as a command.
+            self._pending.append([BODY, lines, lines])
+            return
+        self._body_lines += lines
+        self._in_body = False
+        owed = self._body_lines if self._refuse_next_body else 1
+        self._refuse_next_body = False
+        self._pending.append([BODY, owed, self._body_lines])
+
+    def received(self, data: bytes) -> List[SMTPReply]:
+        replies = self.parser.feed(data)
+        for reply in replies:
+            self._match(reply)
+        return replies
+
+    def last_reply(self) -> Optional[SMTPReply]:
+        return self.exchanges[-1][1] if self.exchanges else None
+
+    def _sent_line(self, line: bytes) -> None:
+        if self._in_body:
+            self._body_lines += 1
+            if line.rstrip(b"\r\n") == b".":
+                self._in_body = False
+                owed = self._body_lines if self._refuse_next_body else 1
+                self._refuse_next_body = False
+                self._pending.append([BODY, owed, self._body_lines])
+            return
+        verb = line.strip().split(b" ", 1)[0].upper()
+        self._pending.append([verb, 1, 1])
+        if verb == b"DATA":
+            self._in_body = True
+            self._body_lines = 0
+
+    def _match(self, reply: SMTPReply) -> None:
+        if not self._pending:
+            self.exchanges.append((b"", reply))
+            return
+        entry = self._pending[0]
+        entry[1] -= 1
+        if entry[1] <= 0:
+            self._pending.popleft()
+        self.exchanges.append((entry[0], reply))
+        if entry[0] == b"DATA" and reply.code != 354:
+            # The server reads the body as commands, so every body line earns its own reply.
+            body = next((item for item in self._pending if item[0] == BODY), None)
+            if body is not None:
+                body[1] = body[2]
+            else:
+                self._refuse_next_body = True
+
+
+def session_replies(events: Sequence[SessionEvent]) -> List[Tuple[str, int, str]]:
+    """(verb, code, text) for every reply in a session, matched to the command that earned it."""
+    tracker = ReplyTracker(expect_banner=bool(events) and events[0].direction == "recv")
+    for event in events:
+        if event.ref is not None:
+            tracker.sent_body(event.ref.lines)
+        elif event.direction == "send":
+            tracker.sent(bytes(event.payload))
+        else:
+            tracker.received(bytes(event.payload))
+    return [
+        (verb.decode("latin1"), reply.code, b"\n".join(reply.lines).decode("latin1"))
+        for verb, reply in tracker.exchanges
+    ]
@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .logger import read_session_file
+from .models import SessionLog, task_key
+from .reply_parser import parse_code, session_replies, verb_key
+from .segment_log import SEGMENT_DIR, SegmentReader
+from .timing import PHASES
+
+
+INDEX_FILE = "results.sqlite"
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    batch TEXT NOT NULL,
+    run_ts TEXT NOT NULL,
+    UNIQUE (batch, run_ts)
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    task TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    hostname TEXT NOT NULL,
+    preference INTEGER,
+    ip TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    start_time TEXT,
+    end_time TEXT,
+    variant TEXT,
+    source_address TEXT,
+    capture TEXT,
+    {", ".join(f"{phase} REAL" for phase in PHASES)}
+);
+CREATE TABLE IF NOT EXISTS replies (
+    session_id INTEGER NOT NULL REFERENCES sessions (id),
+    seq INTEGER NOT NULL,
+    verb TEXT NOT NULL,
+    code INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_domain ON sessions (run_id, domain);
+CREATE INDEX IF NOT EXISTS sessions_ip ON sessions (run_id, ip);
+CREATE INDEX IF NOT EXISTS sessions_task ON sessions (run_id, task);
+CREATE INDEX IF NOT EXISTS sessions_status ON sessions (run_id, status);
+CREATE INDEX IF NOT EXISTS replies_session ON replies (session_id);
+CREATE INDEX IF NOT EXISTS replies_code ON replies (code, verb);
+"""
+
+_SESSION_COLUMNS = (
+    "run_id", "task", "domain", "hostname", "preference", "ip", "status", "error", "start_time", "end_time", "variant",
+    "source_address", "capture",
+) + PHASES
+
+
+def _replies(session: SessionLog) -> List[Tuple[str, int, str]]:
+    # Trimmed sessions carry the replies of their full event list; the log file alone is trimmed.
+    return session.replies if session.replies is not None else session_replies(session.events)
+
+
+def run_name(run_dir: Path) -> Tuple[str, str]:
+    batch, _, run_ts = run_dir.name.rpartition("_")
+    if not batch or not run_ts:
+        raise ValueError(f"{run_dir} is not a run directory (expected <batch>_<timestamp>)")
+    return batch, run_ts
+
+
+def iter_run_sessions(run_dir: Path) -> Iterator[SessionLog]:
+    """Every session logged in a run directory, from its segments or its per-domain YAML files."""
+    if (run_dir / SEGMENT_DIR).is_dir():
+        yield from SegmentReader(run_dir).iter_sessions()
+        return
+    for path in sorted(run_dir.glob("*.yaml")):
+        yield from read_session_file(path)
+
+
+class ResultsIndex:
+    """SQLite index of session outcomes, phase timings and per-command reply codes, shared by all runs of a log_dir."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Sharded workers write to the same file; WAL plus a busy timeout lets them take turns.
+        self.db = sqlite3.connect(str(path), timeout=30.0, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(_SCHEMA)
+
+    @classmethod
+    def from_config(cls, config: dict) -> "ResultsIndex":
+        return cls(Path(config.get("results_index_path") or Path(config.get("log_dir", "logs")) / INDEX_FILE))
+
+    def close(self) -> None:
+        self.db.close()
+
+    def run_id(self, batch: str, run_ts: str, create: bool = True) -> Optional[int]:
+        if create:
+            with self.db:
+                self.db.execute("INSERT OR IGNORE INTO runs (batch, run_ts) VALUES (?, ?)", (batch, run_ts))
+        row = self.db.execute("SELECT id FROM runs WHERE batch = ? AND run_ts = ?", (batch, run_ts)).fetchone()
+        return row[0] if row else None
+
+    def add(self, run_id: int, sessions: Iterable[SessionLog]) -> int:
+        placeholders = ", ".join("?" for _ in _SESSION_COLUMNS)
+        insert_session = f"INSERT INTO sessions ({', '.join(_SESSION_COLUMNS)}) VALUES ({placeholders})"
+        count = 0
+        with self.db:
+            for session in sessions:
+                cursor = self.db.execute(
+                    insert_session,
+                    (
+                        run_id,
+                        session.task,
+                        session.target_domain,
+                        session.mx_hostname,
+                        session.mx_preference,
+                        session.mx_ip,
+                        session.status,
+                        session.error,
+                        session.start_time.isoformat(),
+                        session.end_time.isoformat(),
+                        json.dumps(session.variant, sort_keys=True) if session.variant else None,
+                        session.source_address,
+                        json.dumps(session.capture, sort_keys=True) if session.capture else None,
+                        *(session.timings.get(phase) for phase in PHASES),
+                    ),
+                )
+                self.db.executemany(
+                    "INSERT INTO replies (session_id, seq, verb, code, text) VALUES (?, ?, ?, ?, ?)",
+                    [(cursor.lastrowid, seq, *reply) for seq, reply in enumerate(_replies(session))],
+                )
+                count += 1
+        return count
+
+    def rebuild(self, run_dir: Path) -> int:
+        """Replace a run's rows with what its log files hold now."""
+        run_id = self.run_id(*run_name(run_dir))
+        assert run_id is not None
+        with self.db:
+            self.db.execute(
+                "DELETE FROM replies WHERE session_id IN (SELECT id FROM sessions WHERE run_id = ?)", (run_id,)
+            )
+            self.db.execute("DELETE FROM sessions WHERE run_id = ?", (run_id,))
+        return self.add(run_id, iter_run_sessions(run_dir))
+
+    def session_count(self, run_id: int) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM sessions WHERE run_id = ?", (run_id,)).fetchone()[0]
+
+    def summary(self, run_id: int) -> Dict[str, int]:
+        """Session counts per ``status <name>`` and reply counts per ``<verb> <code>``."""
+        counts: Dict[str, int] = {}
+        for status, count in self.db.execute(
+            "SELECT status, COUNT(*) FROM sessions WHERE run_id = ? GROUP BY status", (run_id,)
+        ):
+            counts[f"status {status}"] = count
+        for verb, code, count in self.db.execute(
+            "SELECT verb, code, COUNT(*) FROM replies JOIN sessions ON sessions.id = replies.session_id "
+            "WHERE run_id = ? GROUP BY verb, code",
+            (run_id,),
+        ):
+            counts[f"{verb or '?'} {code}"] = count
+        return counts
+
+    def find(
+        self, run_id: int, verb: Optional[str] = None, code: Optional[str] = None, limit: int = 1000
+    ) -> List[Tuple[str, str, str, str, int, str]]:
+        """(domain, ip, task, verb, code, text) of replies matching a verb and/or code pattern.
+
+        ``verb`` is matched like stop rules match it: any case, with ``BANNER`` / ``BODY`` (or ``<banner>`` /
+        ``<body>``) for the greeting and the reply to a DATA body. Sessions of a parametric task report their
+        task as ``name[i]``.
+        """
+        clauses = ["run_id = ?"]
+        params: list = [run_id]
+        if verb:
+            clauses.append("verb = ?")
+            params.append(verb_key(verb).decode("latin1"))
+        if code:
+            low, high = parse_code(code)
+            clauses.append("code BETWEEN ? AND ?")
+            params += [low, high]
+        params.append(limit)
+        rows = self.db.execute(
+            "SELECT domain, ip, task, variant, verb, code, text FROM replies JOIN sessions ON sessions.id = replies.session_id "
+            f"WHERE {' AND '.join(clauses)} ORDER BY domain, ip, task, sessions.id, seq LIMIT ?",
+            params,
+        )
+        return [
+            (domain, ip, task_key(task, json.loads(variant).get("index") if variant else None), *reply)
+            for domain, ip, task, variant, *reply in rows
+        ]
@@ -4,11 +4,24 @@ import socket
 import time
 from datetime import datetime
 from pathlib import Path
-from typing import Iterable, List, Optional
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
+from .adaptive import AdaptiveTimeouts
+from .async_client import AsyncSMTPClient
+from .breaker import SKIPPED_UNREACHABLE, CircuitBreaker
+from .capture import CapturePolicy
+from .journal import CompletionJournal
 from .logger import SessionLogger
-from .models import MXRecord, SessionEvent, SessionLog, TaskDefinition
+from .models import CommandSpec, MXRecord, SessionEvent, SessionLog, TaskDefinition, task_key
+from .plan import PlannedDomain, compile_plan
+from .results_index import ResultsIndex
+from .scheduler import HostScheduler
+from .segment_log import INDEX_FILE, SegmentLogger
 from .smtp_client import SMTPClient
+from .sources import SourcePool, reply_codes
+from .stop_rules import ABORTED
+from .timing import RunTimings, timings_name, write_run_timings
 
 
 class BatchRunner:
@@ -17,76 +30,428 @@ class BatchRunner:
         batch_path: Path,
         config: dict,
         tasks: List[TaskDefinition],
-        mx_records: List[MXRecord],
+        mx_records: Iterable[MXRecord],
+        run_ts: str | None = None,
+        shard: str | None = None,
+        plan: Optional[Iterable[PlannedDomain]] = None,
     ):
         self.batch_path = batch_path
         self.config = config
         self.tasks = tasks
-        self.mx_records = sorted(mx_records, key=lambda r: (r.domain, r.preference, r.hostname, r.ip))
+        # Streamed records already arrive grouped by domain and sorted, and are consumed lazily.
+        self.mx_records: Iterable[MXRecord] = (
+            sorted(mx_records, key=lambda r: (r.domain, r.preference, r.hostname, r.ip))
+            if isinstance(mx_records, list)
+            else mx_records
+        )
+        # A precompiled plan replaces mx_records and the --tasks filter.
+        self.plan = plan
         log_dir = Path(config.get("log_dir", "logs"))
-        self.run_ts = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
-        self.logger = SessionLogger(log_dir, batch_path.name, run_ts=self.run_ts)
+        self.run_ts = run_ts or datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        # Shards share one run directory, so shard-specific files get the shard name.
+        self.shard = shard
+        self.stats: Counter = Counter()
+        # Candidate records of queued first_reachable tasks, keyed by (domain, task key).
+        self._race_candidates: Dict[Tuple[str, str], List[MXRecord]] = {}
+        self.timings = RunTimings(max_domains=int(config.get("timing_max_domains", 10000)))
+        self.adaptive = AdaptiveTimeouts.from_config(config) if config.get("adaptive_timeouts", False) else None
+        self.breaker = CircuitBreaker.from_config(config) if int(config.get("breaker_threshold", 0) or 0) > 0 else None
+        self.sources = self._create_sources()
+        self.capture = CapturePolicy.from_config(config)
+        self._open_run(log_dir)
+
+    def _create_sources(self) -> Optional[SourcePool]:
+        return SourcePool.from_config(self.config)
+
+    def _open_run(self, log_dir: Path) -> None:
+        """Create the run directory's session logger, completion journal and results index."""
+        config = self.config
+        shard = self.shard
+        self.logger = self._create_logger(log_dir)
+        self.journal: Optional[CompletionJournal] = None
+        if config.get("journal", True):
+            self.journal = CompletionJournal(self.logger.run_dir)
+            if self.journal.completed and not shard:
+                print(f"[*] resuming: {len(self.journal.completed)} session(s) already completed in {self.logger.run_dir}")
+            journal = self.journal
+            self.logger.persist_hooks.append(
+                lambda sessions: journal.mark_many(
+                    journal.key(item.target_domain, item.mx_ip, task_key(item.task, item.variant.get("index")))
+                    for item in sessions
+                )
+            )
+        self.index: Optional[ResultsIndex] = None
+        if config.get("results_index", False):
+            index = self.index = ResultsIndex.from_config(config)
+            run_id = index.run_id(self.batch_path.name, self.run_ts)
+            self.logger.persist_hooks.append(lambda sessions: index.add(run_id, sessions))
 
-    def run(self, selected_tasks: Optional[Iterable[str]] = None) -> None:
+    def _create_logger(self, log_dir: Path) -> SessionLogger:
+        log_format = self.config.get("log_format", "yaml")
+        if log_format == "segments":
+            return SegmentLogger(
+                log_dir,
+                self.batch_path.name,
+                run_ts=self.run_ts,
+                segment_size=int(self.config.get("segment_size", 256 * 1024 * 1024)),
+                compression=self.config.get("segment_compression"),
+                queue_size=int(self.config.get("log_queue_size", 1024)),
+                segment_prefix=f"segment-{self.shard}" if self.shard else "segment",
+                index_name=f"index-{self.shard}.tsv" if self.shard else INDEX_FILE,
+            )
+        if log_format != "yaml":
+            raise ValueError(f"Unknown log_format {log_format!r} (expected yaml or segments)")
+        return SessionLogger(
+            log_dir,
+            self.batch_path.name,
+            run_ts=self.run_ts,
+            max_open_files=int(self.config.get("log_max_open_files", 256)),
+            queue_size=int(self.config.get("log_queue_size", 1024)),
+        )
+
+    def run(self, selected_tasks: Optional[Iterable[str]] = None) -> Dict[str, int]:
         names = set(selected_tasks) if selected_tasks else None
-        for record in self.mx_records:
-            for task in self.tasks:
-                if names and task.name not in names:
-                    continue
-                if task.target_values and record.domain not in task.target_values:
+        scheduler = HostScheduler.from_config(self._iter_jobs(names), self.config, sources=self.sources)
+        delay_hosts = float(self.config.get("delay_between_hosts", 0) or 0)
+        try:
+            while True:
+                session, wait = scheduler.acquire()
+                if session is None:
+                    if wait is None:
+                        break
+                    time.sleep(wait)
                     continue
-                self._run_single(record, task)
-            delay_hosts = float(self.config.get("delay_between_hosts", 0))
-            if delay_hosts > 0:
-                time.sleep(delay_hosts)
+                ends_record = scheduler.ends_record(session)
+                try:
+                    self._run_unit(*session)
+                finally:
+                    scheduler.release(session)
+                if ends_record and delay_hosts > 0:
+                    time.sleep(delay_hosts)
+        finally:
+            self._close()
+        return dict(self.stats)
+
+    def _close(self) -> None:
+        try:
+            self.logger.close()
+        finally:
+            if self.journal:
+                self.journal.close()
+            if self.index:
+                self.index.close()
+            self.timings.save(self.logger.run_dir / timings_name(self.shard))
+            if self.adaptive:
+                self.adaptive.save()
+            if self.breaker:
+                self.breaker.save()
+            # Sharded runs are merged once by the parent after every worker has finished.
+            if not self.shard:
+                write_run_timings(self.logger.run_dir, self.batch_path.name)
+
+    def _iter_jobs(self, names: Optional[set]) -> Iterator[Tuple[MXRecord, Iterable[Tuple[TaskDefinition, ...]]]]:
+        by_name = {task.name: task for task in self.tasks}
+        plan = self.plan
+        if plan is None:
+            plan = compile_plan(self.mx_records, self.tasks, names, reuse=bool(self.config.get("session_reuse", False)))
+        for planned in plan:
+            domain, records = planned.domain, planned.records
+            for name in planned.raced:
+                # A raced task runs once per domain, queued on the lane of its most preferred IP.
+                yield records[0], self._raced_units(domain, records, by_name[name])
+            for record in records:
+                yield record, self._record_units(record, planned.units, by_name)
 
-    def _run_single(self, record: MXRecord, task: TaskDefinition) -> None:
+    def _raced_units(self, domain: str, records: List[MXRecord], task: TaskDefinition) -> Iterator[Tuple[TaskDefinition, ...]]:
+        for variant in task.variants():
+            if self.journal and any(self.journal.is_done(domain, record.ip, variant.key) for record in records):
+                self.stats["resumed"] += 1
+                continue
+            self._race_candidates[(domain, variant.key)] = records
+            yield (variant,)
+
+    def _record_units(
+        self, record: MXRecord, units: List[Tuple[str, ...]], by_name: Dict[str, TaskDefinition]
+    ) -> Iterator[Tuple[TaskDefinition, ...]]:
+        # Drawn by the scheduler one unit at a time, so parametric tasks expand as their lane gets to them.
+        for unit in units:
+            if len(unit) == 1 and by_name[unit[0]].axes:
+                for variant in by_name[unit[0]].variants():
+                    if self.journal and self.journal.is_done(record.domain, record.ip, variant.key):
+                        self.stats["resumed"] += 1
+                    else:
+                        yield (variant,)
+                continue
+            tasks = tuple(
+                by_name[name]
+                for name in unit
+                if not (self.journal and self.journal.is_done(record.domain, record.ip, name))
+            )
+            if len(tasks) < len(unit):
+                self.stats["resumed"] += len(unit) - len(tasks)
+            if tasks:
+                yield tasks
+
+    def _client_options(self, record: MXRecord, source: Optional[str] = None) -> dict:
+        options = {
+            "host_ip": record.ip,
+            "port": int(self.config.get("port", 25)),
+            "connect_timeout": float(self.config.get("connect_timeout", 8.0)),
+            "command_timeout": float(self.config.get("command_timeout", 8.0)),
+            "banner_timeout": float(self.config.get("banner_timeout", 8.0)),
+            "read_chunk": int(self.config.get("read_chunk", 4096)),
+            "delay_before_first_command": float(self.config.get("delay_before_first_command", 0.0)),
+            "delay_between_commands": float(self.config.get("delay_between_commands", 0.0)),
+            "reply_aware": bool(self.config.get("reply_aware", True)),
+            "body_inline_max": int(self.config.get("body_inline_max", 65536)),
+            "body_log_head": int(self.config.get("body_log_head", 256)),
+            "source_address": source,
+            "lockstep": bool(self.config.get("lockstep", False)),
+        }
+        if self.adaptive:
+            options.update(self.adaptive.timeouts_for(record))
+        return options
+
+    def _run_unit(self, record: MXRecord, tasks: Tuple[TaskDefinition, ...], source: Optional[str] = None) -> None:
+        if tasks[0].mx_strategy == "first_reachable":
+            self._run_raced(record, tasks[0], source)
+        elif len(tasks) == 1:
+            self._run_single(record, tasks[0], source)
+        else:
+            self._run_reused(record, tasks, source)
+
+    def _run_single(self, record: MXRecord, task: TaskDefinition, source: Optional[str] = None) -> None:
+        if self._skip_unreachable(record, (task,)):
+            return
         start = datetime.utcnow()
         events: List[SessionEvent] = []
-        status = "success"
-        error: Optional[str] = None
-        client = SMTPClient(
-            host_ip=record.ip,
-            port=int(self.config.get("port", 25)),
-            connect_timeout=float(self.config.get("connect_timeout", 8.0)),
-            command_timeout=float(self.config.get("command_timeout", 8.0)),
-            banner_timeout=float(self.config.get("banner_timeout", 8.0)),
-            read_chunk=int(self.config.get("read_chunk", 4096)),
-            delay_before_first_command=float(self.config.get("delay_before_first_command", 0.0)),
-            delay_between_commands=float(self.config.get("delay_between_commands", 0.0)),
-        )
-        print(f"[*] {record.domain} -> {record.ip} task={task.name}")
+        failure: Optional[Exception] = None
+        client = SMTPClient(**self._client_options(record, source))
+        print(f"[*] {record.domain} -> {record.ip} task={task.key}")
         try:
             client.connect()
             commands = task.render_commands(record.domain)
-            client.run_sequence(commands, events=events)
-        except (socket.timeout, ConnectionError, OSError) as exc:
-            status = "error"
-            error = str(exc)
+            client.run_sequence(commands, events=events, stop_on=task.stop_on, lockstep=task.lockstep)
+        except Exception as exc:  # noqa: BLE001
+            failure = exc
+        finally:
+            client.close()
+        self._finish_session(record, task, start, events, client, failure, source)
+
+    def _run_raced(self, record: MXRecord, task: TaskDefinition, source: Optional[str] = None) -> None:
+        candidates = self._race_candidates_for(record, task)
+        if not candidates:
+            return
+        start = datetime.utcnow()
+        events: List[SessionEvent] = []
+        failure: Optional[Exception] = None
+        winner: Optional[MXRecord] = None
+        client = SMTPClient(**self._client_options(record, source))
+        print(f"[*] {record.domain} -> racing {len(candidates)} MX IP(s) task={task.key}")
+        try:
+            winner = candidates[client.race_connect([item.ip for item in candidates], self._race_stagger())]
+            record = self._race_won(record, winner)
+            client.run_sequence(
+                task.render_commands(record.domain), events=events, stop_on=task.stop_on, lockstep=task.lockstep
+            )
         except Exception as exc:  # noqa: BLE001
-            status = "error"
-            error = f"Unexpected: {exc}"
+            failure = exc
+        finally:
+            client.close()
+        _, error = self._finish_session(record, task, start, events, client, failure, source, note=False)
+        self._race_reachability(candidates, winner, error)
+
+    def _race_candidates_for(self, record: MXRecord, task: TaskDefinition) -> List[MXRecord]:
+        candidates = self._race_candidates.pop((record.domain, task.key), [record])
+        if self.breaker:
+            reachable = [item for item in candidates if self.breaker.blocked(item.ip) is None]
+            if not reachable:
+                self._skip_unreachable(record, (task,))
+            candidates = reachable
+        return candidates
+
+    def _race_reachability(self, candidates: List[MXRecord], winner: Optional[MXRecord], error: Optional[str]) -> None:
+        if not self.breaker:
+            return
+        if winner is not None:
+            self.breaker.record(winner.ip, True)
+            return
+        # Nobody delivered a banner, so the race failed on every candidate.
+        for item in candidates:
+            self.breaker.record(item.ip, False, error)
+
+    def _race_stagger(self) -> float:
+        return float(self.config.get("mx_race_stagger", 0.25))
+
+    def _race_won(self, record: MXRecord, winner: MXRecord) -> MXRecord:
+        self.stats["race_won"] += 1
+        if winner.ip != record.ip:
+            self.stats["race_fallback"] += 1
+        print(f"[*] {winner.domain}: {winner.ip} ({winner.hostname}, preference {winner.preference}) won the MX race")
+        return winner
+
+    def _run_reused(self, record: MXRecord, tasks: Tuple[TaskDefinition, ...], source: Optional[str] = None) -> None:
+        if self._skip_unreachable(record, tasks):
+            return
+        client = SMTPClient(**self._client_options(record, source))
+        done = 0
+        try:
+            for index, task in enumerate(tasks):
+                start = datetime.utcnow()
+                events: List[SessionEvent] = []
+                failure: Optional[Exception] = None
+                print(f"[*] {record.domain} -> {record.ip} task={task.key} (shared session {index + 1}/{len(tasks)})")
+                try:
+                    if index == 0:
+                        client.connect()
+                    else:
+                        events.append(SessionEvent(direction="recv", payload=client.banner))
+                    commands = _reuse_commands(task.render_commands(record.domain), last=index == len(tasks) - 1)
+                    client.run_sequence(
+                        commands, events=events, read_banner=index == 0, stop_on=task.stop_on, lockstep=task.lockstep
+                    )
+                except Exception as exc:  # noqa: BLE001
+                    failure = exc
+                # Only the first task connects, so only it says whether the host is reachable.
+                status, _ = self._finish_session(record, task, start, events, client, failure, source, note=index == 0)
+                done = index + 1
+                if status != "success":
+                    break
         finally:
             client.close()
-        end = datetime.utcnow()
-        session = SessionLog(
-            batch=self.batch_path.name,
-            task=task.name,
-            target_domain=record.domain,
-            mx_hostname=record.hostname,
-            mx_preference=record.preference,
-            mx_ip=record.ip,
-            start_time=start,
-            end_time=end,
-            status=status,
-            error=error,
-            events=events,
+        # A broken shared session leaves the remaining tasks to their own connections.
+        for task in tasks[done:]:
+            self._run_single(record, task, source)
+
+    @staticmethod
+    def _outcome(client: Union[SMTPClient, AsyncSMTPClient], failure: Optional[Exception]) -> Tuple[str, Optional[str]]:
+        if isinstance(failure, (socket.timeout, ConnectionError, OSError)):
+            return "error", str(failure)
+        if failure is not None:
+            return "error", f"Unexpected: {failure}"
+        if client.stop is not None:
+            return ABORTED, client.stop.describe()
+        return "success", None
+
+    def _finish_session(
+        self,
+        record: MXRecord,
+        task: TaskDefinition,
+        start: datetime,
+        events: List[SessionEvent],
+        client: Union[SMTPClient, AsyncSMTPClient],
+        failure: Optional[Exception],
+        source: Optional[str],
+        note: bool = True,
+    ) -> Tuple[str, Optional[str]]:
+        """Settle a session once its I/O is over; the sync and async engines differ only before this."""
+        status, error = self._outcome(client, failure)
+        timings = client.timer.finish()
+        if note:
+            self._note_reachability(record.ip, timings, error)
+        self._record_session(record, task, start, status, error, events, timings, source)
+        return status, error
+
+    def _skip_unreachable(self, record: MXRecord, tasks: Tuple[TaskDefinition, ...]) -> bool:
+        reason = self.breaker.blocked(record.ip) if self.breaker else None
+        if reason is None:
+            return False
+        for task in tasks:
+            self._record_session(record, task, datetime.utcnow(), SKIPPED_UNREACHABLE, reason, [])
+        return True
+
+    def _note_reachability(self, ip: str, timings: Dict[str, float], error: Optional[str]) -> None:
+        if self.breaker:
+            # Errors after the banner arrived say nothing about whether the host is up.
+            self.breaker.record(ip, error is None or "banner" in timings, error)
+
+    def _record_session(
+        self,
+        record: MXRecord,
+        task: TaskDefinition,
+        start: datetime,
+        status: str,
+        error: Optional[str],
+        events: List[SessionEvent],
+        timings: Optional[Dict[str, float]] = None,
+        source: Optional[str] = None,
+    ) -> None:
+        if source and self.sources:
+            code = self.sources.report(source, reply_codes(events))
+            if code is not None:
+                self.stats["source_cooldown"] += 1
+                print(f"[!] source {source} cooling down for {self.sources.cooldown:g}s after a {code} reply")
+        self._store_session(
+            SessionLog(
+                batch=self.batch_path.name,
+                task=task.name,
+                target_domain=record.domain,
+                mx_hostname=record.hostname,
+                mx_preference=record.preference,
+                mx_ip=record.ip,
+                start_time=start,
+                end_time=datetime.utcnow(),
+                status=status,
+                error=error,
+                source_address=source,
+                timings=timings or {},
+                variant=task.variant_log(),
+                events=events,
+            )
         )
-        if events:
+
+    def _store_session(self, session: SessionLog) -> None:
+        self.stats["sessions"] += 1
+        self.stats[session.status] += 1
+        if session.timings:
+            self.timings.add(session.task, session.target_domain, session.timings)
+            if self.adaptive:
+                record = MXRecord(session.mx_hostname, session.mx_preference, session.mx_ip, session.target_domain)
+                self.adaptive.observe(record, session.timings, session.error)
+        if self.capture is not None:
+            capture = self.capture.apply(session, keep_replies=self.index is not None)
+            if capture:
+                self.stats["capture_sampled_out" if capture.get("sampled_out") else "capture_trimmed"] += 1
+        # Sampled-out sessions are still logged, without events, so the log says what was left out.
+        logged = bool(session.events or session.status == SKIPPED_UNREACHABLE or session.capture)
+        if logged:
+            self.stats["logged"] += 1
+        self._write_session(session, logged)
+
+    def _write_session(self, session: SessionLog, logged: bool) -> None:
+        """Hand a stored session to the logger (which may block while its queue is full) and report it."""
+        task = task_key(session.task, session.variant.get("index"))
+        if logged:
             path = self.logger.log_session(session)
-            if status == "success":
+            if session.status == "success":
                 print(f"[+] logged {path}")
+            elif session.status == ABORTED:
+                print(f"[-] aborted {session.mx_ip} for {session.target_domain} task={task}, logged {path} ({session.error})")
+            elif session.status == SKIPPED_UNREACHABLE:
+                print(
+                    f"[-] skipped unreachable {session.mx_ip} for {session.target_domain} task={task}, "
+                    f"logged {path} ({session.error})"
+                )
             else:
-                print(f"[!] failure logged {path} ({error})")
+                print(f"[!] failure logged {path} ({session.error})")
         else:
-            print(f"[-] skipped log (no send/recv events) for {record.domain} task={task.name}")
+            # Still passed through the writer so the journal and the results index see it.
+            self.logger.note_session(session)
+            print(f"[-] skipped log (no send/recv events) for {session.target_domain} task={task}")
+
+
+def format_summary(stats: Dict[str, int]) -> str:
+    details = ", ".join(
+        f"{key}={value}" for key, value in sorted(stats.items()) if key not in {"sessions", "logged"}
+    )
+    summary = f"{stats.get('sessions', 0)} session(s), {stats.get('logged', 0)} logged"
+    return f"{summary} ({details})" if details else summary
+
+
+def _reuse_commands(commands: List[CommandSpec], last: bool) -> List[CommandSpec]:
+    """Commands for one task of a shared session: all but the last task end with RSET instead of QUIT."""
+    if last:
+        return commands
+    while commands and commands[-1].data.strip().upper() == b"QUIT":
+        commands = commands[:-1]
+    return commands + [CommandSpec(data=b"RSET\r\n")]
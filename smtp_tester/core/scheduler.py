@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import math
+import time
+from collections import OrderedDict, deque
+from typing import TYPE_CHECKING, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .models import MXRecord, TaskDefinition
+
+if TYPE_CHECKING:
+    from .sources import SourcePool
+
+
+# One connection's worth of work: a record, the task(s) run over it (several when reused over RSET)
+# and the local source address to bind, if any.
+Session = Tuple[MXRecord, Tuple[TaskDefinition, ...], Optional[str]]
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = clock()
+
+    def delay(self, now: float) -> float:
+        """Seconds until one token is available (0 when it can be taken now)."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        if self.rate <= 0:
+            return
+        self._refill(now)
+        self.tokens -= 1
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+
+class HostScheduler:
+    """Hands out sessions from per-IP lanes, honouring per-IP, per-domain and global token buckets.
+
+    Sessions for one IP keep their order and never overlap; other lanes keep flowing while an IP or
+    domain cools down. At most ``window`` IP lanes are read ahead from the job iterator.
+    """
+
+    def __init__(
+        self,
+        jobs: Iterator[Tuple[MXRecord, Iterable[Tuple[TaskDefinition, ...]]]],
+        ip_rate: float = 0.0,
+        ip_burst: float = 1.0,
+        domain_rate: float = 0.0,
+        domain_burst: float = 1.0,
+        global_rate: float = 0.0,
+        global_burst: float = 1.0,
+        window: int = 1000,
+        clock: Callable[[], float] = time.monotonic,
+        sources: Optional["SourcePool"] = None,
+    ):
+        self.jobs = jobs
+        self.sources = sources
+        self.ip_rate = ip_rate
+        self.ip_burst = ip_burst
+        self.domain_rate = domain_rate
+        self.domain_burst = domain_burst
+        self.window = max(1, window)
+        self.clock = clock
+        self.global_bucket = TokenBucket(global_rate, global_burst, clock)
+        # Lane entries are [record, next unit, remaining units], so a record's units are drawn lazily.
+        self.lanes: "OrderedDict[str, Deque[List]]" = OrderedDict()
+        self.busy: Dict[str, int] = {}
+        # Whether the session out on an IP is the last unit of its record.
+        self._record_ends: Dict[str, bool] = {}
+        self.ip_buckets: Dict[str, TokenBucket] = {}
+        self.domain_buckets: Dict[str, TokenBucket] = {}
+        self._exhausted = False
+
+    @classmethod
+    def from_config(
+        cls,
+        jobs: Iterator[Tuple[MXRecord, Iterable[Tuple[TaskDefinition, ...]]]],
+        config: dict,
+        sources: Optional["SourcePool"] = None,
+    ) -> "HostScheduler":
+        return cls(
+            jobs,
+            ip_rate=float(config.get("ip_rate", 0) or 0),
+            ip_burst=float(config.get("ip_burst", 1)),
+            domain_rate=float(config.get("domain_rate", 0) or 0),
+            domain_burst=float(config.get("domain_burst", 1)),
+            global_rate=float(config.get("global_rate", 0) or 0),
+            global_burst=float(config.get("global_burst", 1)),
+            window=int(config.get("scheduler_window", 1000)),
+            sources=sources,
+        )
+
+    def acquire(self) -> Tuple[Optional[Session], Optional[float]]:
+        """Return ``(session, 0)`` when one may start, ``(None, wait)`` when the caller should wait
+        (``math.inf`` until a running session is released), or ``(None, None)`` when all work is done."""
+        self._fill()
+        if not self.lanes:
+            return None, (math.inf if self.busy else None)
+        now = self.clock()
+        global_wait = self.global_bucket.delay(now)
+        if self.sources is not None:
+            # Every source rate-limited or cooling down holds back all lanes alike.
+            global_wait = max(global_wait, self.sources.delay(now))
+        if global_wait > 0:
+            return None, global_wait
+        wait = math.inf
+        for ip in list(self.lanes):
+            if ip in self.busy:
+                continue
+            lane = self.lanes[ip]
+            entry = lane[0]
+            record = entry[0]
+            ip_bucket = self._bucket(self.ip_buckets, ip, self.ip_rate, self.ip_burst)
+            domain_bucket = self._bucket(self.domain_buckets, record.domain, self.domain_rate, self.domain_burst)
+            lane_wait = max(ip_bucket.delay(now), domain_bucket.delay(now))
+            if lane_wait > 0:
+                wait = min(wait, lane_wait)
+                continue
+            session = (record, entry[1], self.sources.take(now) if self.sources is not None else None)
+            following = next(entry[2], None)
+            if following is None:
+                lane.popleft()
+            else:
+                entry[1] = following
+            ip_bucket.take(now)
+            domain_bucket.take(now)
+            self.global_bucket.take(now)
+            self.busy[ip] = self.busy.get(ip, 0) + 1
+            self._record_ends[ip] = following is None
+            if following is None:
+                # Rotate once a record is handed out, so its units run back to back and the next record
+                # comes from a different lane.
+                self.lanes.move_to_end(ip)
+            if not lane:
+                del self.lanes[ip]
+            return session, 0.0
+        return None, wait
+
+    def finished(self) -> bool:
+        """True once every session has been handed out and released."""
+        self._fill()
+        return not self.lanes and not self.busy
+
+    def ends_record(self, session: Session) -> bool:
+        """True when ``session`` (handed out and not yet released) is the last unit of its record."""
+        return self._record_ends.get(session[0].ip, False)
+
+    def release(self, session: Session) -> None:
+        ip = session[0].ip
+        self._record_ends.pop(ip, None)
+        count = self.busy.get(ip, 0) - 1
+        if count > 0:
+            self.busy[ip] = count
+        else:
+            self.busy.pop(ip, None)
+
+    def _fill(self) -> None:
+        while not self._exhausted and len(self.lanes) < self.window:
+            try:
+                record, units = next(self.jobs)
+            except StopIteration:
+                self._exhausted = True
+                return
+            remaining = iter(units)
+            first = next(remaining, None)
+            if first is None:
+                continue
+            lane = self.lanes.get(record.ip)
+            if lane is None:
+                lane = self.lanes[record.ip] = deque()
+            lane.append([record, first, remaining])
+
+    def _bucket(self, buckets: Dict[str, TokenBucket], key: str, rate: float, burst: float) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) > 4 * self.window:
+                self._prune(buckets)
+            bucket = buckets[key] = TokenBucket(rate, burst, self.clock)
+        return bucket
+
+    def _prune(self, buckets: Dict[str, TokenBucket]) -> None:
+        # A refilled bucket behaves like a new one, so idle hosts need not be remembered.
+        now = self.clock()
+        for key in [key for key, bucket in buckets.items() if bucket.delay(now) == 0 and bucket.tokens >= bucket.burst]:
+            del buckets[key]
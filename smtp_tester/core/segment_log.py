@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+import dataclasses
+import gzip
+import json
+import lzma
+import struct
+from datetime import datetime
+from pathlib import Path
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+
+from .logger import SessionLogger
+from .models import BodyRef, SessionEvent, SessionLog, task_key
+
+
+SEGMENT_DIR = "segments"
+INDEX_FILE = "index.tsv"
+
+# Record layout: <I record length> <I meta length> <I event count> <meta JSON>
+# followed by <B direction> <I payload length> <payload> for every event.
+_RECORD_HEADER = struct.Struct("<III")
+_EVENT_HEADER = struct.Struct("<BI")
+_DIRECTIONS = {"send": 0, "recv": 1}
+_DIRECTION_NAMES = {code: name for name, code in _DIRECTIONS.items()}
+_SUFFIXES = {None: ".bin", "gzip": ".bin.gz", "lzma": ".bin.xz"}
+
+
+def _open_segment(path: Path, mode: str, compression: Optional[str]) -> IO[bytes]:
+    if compression == "gzip":
+        return gzip.open(path, mode)  # type: ignore[return-value]
+    if compression == "lzma":
+        return lzma.open(path, mode)  # type: ignore[return-value]
+    return path.open(mode)
+
+
+def _compression_for(path: Path) -> Optional[str]:
+    for compression, suffix in _SUFFIXES.items():
+        if compression and path.name.endswith(suffix):
+            return compression
+    return None
+
+
+def encode_session(session: SessionLog) -> bytes:
+    meta = {}
+    for item in dataclasses.fields(session):
+        value = getattr(session, item.name)
+        if item.name in ("events", "replies") or (item.name in ("variant", "source_address", "capture") and not value):
+            continue
+        meta[item.name] = value.isoformat() if isinstance(value, datetime) else value
+    refs = [[index, event.ref.size, event.ref.sha256, event.ref.lines] for index, event in enumerate(session.events) if event.ref]
+    if refs:
+        # [event index, size, sha256, lines] of bodies logged by reference.
+        meta["body_refs"] = refs
+    meta_bytes = json.dumps(meta, separators=(",", ":")).encode("utf-8")
+    parts = [b"", meta_bytes]
+    body_len = _RECORD_HEADER.size - 4 + len(meta_bytes)
+    for event in session.events:
+        payload = bytes(event.payload)
+        parts.append(_EVENT_HEADER.pack(_DIRECTIONS[event.direction], len(payload)))
+        parts.append(payload)
+        body_len += _EVENT_HEADER.size + len(payload)
+    parts[0] = _RECORD_HEADER.pack(body_len, len(meta_bytes), len(session.events))
+    return b"".join(parts)
+
+
+def decode_session(record: bytes) -> SessionLog:
+    _, meta_len, count = _RECORD_HEADER.unpack_from(record, 0)
+    offset = _RECORD_HEADER.size
+    meta = json.loads(record[offset:offset + meta_len].decode("utf-8"))
+    offset += meta_len
+    events: List[SessionEvent] = []
+    for _ in range(count):
+        direction, length = _EVENT_HEADER.unpack_from(record, offset)
+        offset += _EVENT_HEADER.size
+        events.append(SessionEvent(direction=_DIRECTION_NAMES[direction], payload=record[offset:offset + length]))
+        offset += length
+    for index, size, sha256, lines in meta.pop("body_refs", ()):
+        events[index].ref = BodyRef(size=size, sha256=sha256, lines=lines)
+    meta["start_time"] = datetime.fromisoformat(meta["start_time"])
+    meta["end_time"] = datetime.fromisoformat(meta["end_time"])
+    return SessionLog(events=events, **meta)
+
+
+class SegmentLogger(SessionLogger):
+    """Writes raw session bytes as length-prefixed records into a few rolling segment files."""
+
+    def __init__(
+        self,
+        base_dir: Path,
+        batch: str,
+        run_ts: str | None = None,
+        segment_size: int = 256 * 1024 * 1024,
+        compression: Optional[str] = None,
+        queue_size: int = 1024,
+        segment_prefix: str = "segment",
+        index_name: str = INDEX_FILE,
+    ):
+        if compression not in _SUFFIXES:
+            raise ValueError(f"Unsupported segment compression {compression!r}")
+        self.segment_size = max(1, segment_size)
+        self.compression = compression
+        self.segment_prefix = segment_prefix
+        self.index_name = index_name
+        self._segment: Optional[IO[bytes]] = None
+        self._segment_name = ""
+        self._segment_offset = 0
+        self._segment_index = 0
+        self._index: Optional[IO[str]] = None
+        super().__init__(base_dir, batch, run_ts=run_ts, queue_size=queue_size)
+        self.segment_dir = self.run_dir / SEGMENT_DIR
+        self.segment_dir.mkdir(parents=True, exist_ok=True)
+
+    def _target_path(self, safe_domain: str) -> Path:
+        return self.run_dir / SEGMENT_DIR
+
+    def _write_batch(self, batch: List[Tuple[Optional[str], SessionLog]]) -> None:
+        batch = [item for item in batch if item[0] is not None]
+        if not batch:
+            return
+        if self._index is None:
+            self._index = (self.segment_dir / self.index_name).open("a", encoding="utf-8")
+        for _, session in batch:
+            record = encode_session(session)
+            segment = self._current_segment()
+            segment.write(record)
+            self._index.write(
+                f"{session.target_domain}\t{task_key(session.task, session.variant.get('index'))}\t{session.mx_ip}\t"
+                f"{self._segment_name}\t{self._segment_offset}\t{len(record)}\n"
+            )
+            self._segment_offset += len(record)
+        if self._segment is not None:
+            self._segment.flush()
+        self._index.flush()
+
+    def _current_segment(self) -> IO[bytes]:
+        if self._segment is not None and self._segment_offset >= self.segment_size:
+            self._segment.close()
+            self._segment = None
+        if self._segment is None:
+            while True:
+                name = f"{self.segment_prefix}-{self._segment_index:05d}{_SUFFIXES[self.compression]}"
+                self._segment_index += 1
+                if not (self.segment_dir / name).exists():
+                    break
+            self._segment_name = name
+            self._segment_offset = 0
+            self._segment = _open_segment(self.segment_dir / name, "wb", self.compression)
+        return self._segment
+
+    def _close_files(self) -> None:
+        segment, self._segment = self._segment, None
+        index, self._index = self._index, None
+        if segment is not None:
+            segment.close()
+        if index is not None:
+            index.close()
+
+
+class SegmentReader:
+    def __init__(self, run_dir: Path):
+        self.run_dir = run_dir
+        self.segment_dir = run_dir / SEGMENT_DIR
+        if not self.segment_dir.is_dir():
+            raise ValueError(f"{run_dir} has no {SEGMENT_DIR}/ directory")
+
+    def iter_index(self) -> Iterator[Tuple[str, str, str, str, int, int]]:
+        index_path = self.segment_dir / INDEX_FILE
+        if not index_path.exists():
+            return
+        with index_path.open("r", encoding="utf-8") as handle:
+            for line in handle:
+                domain, task, ip, segment, offset, length = line.rstrip("\n").split("\t")
+                yield domain, task, ip, segment, int(offset), int(length)
+
+    def lookup(self, domain: str, task: str | None = None, ip: str | None = None) -> List[SessionLog]:
+        sessions = []
+        for entry_domain, entry_task, entry_ip, segment, offset, length in self.iter_index():
+            if entry_domain != domain or (task and entry_task != task) or (ip and entry_ip != ip):
+                continue
+            sessions.append(self._read_at(segment, offset, length))
+        return sessions
+
+    def iter_sessions(self, truncated: Optional[List[str]] = None) -> Iterator[SessionLog]:
+        """Every record of every segment in order.
+
+        A segment cut short (e.g. by a crash) raises ValueError, or with ``truncated`` given is noted there
+        by name and read up to the last complete record.
+        """
+        for path in sorted(self.segment_dir.glob("*.bin*")):
+            with _open_segment(path, "rb", _compression_for(path)) as handle:
+                while True:
+                    try:
+                        record = _read_record(handle)
+                    except EOFError:
+                        # A gzip or lzma stream that ends before its end-of-stream marker.
+                        record = None
+                    if record is None:
+                        if truncated is None:
+                            raise ValueError(f"Truncated record in {path}")
+                        truncated.append(path.name)
+                        break
+                    if not record:
+                        break
+                    yield decode_session(record)
+
+    def _read_at(self, segment: str, offset: int, length: int) -> SessionLog:
+        path = self.segment_dir / segment
+        with _open_segment(path, "rb", _compression_for(path)) as handle:
+            handle.seek(offset)
+            return decode_session(handle.read(length))
+
+
+def _read_record(handle: IO[bytes]) -> Optional[bytes]:
+    """The next length-prefixed record, b"" at the end of the segment or None when it is cut short."""
+    header = handle.read(4)
+    if not header:
+        return b""
+    if len(header) < 4:
+        return None
+    (body_len,) = struct.unpack("<I", header)
+    body = handle.read(body_len)
+    return header + body if len(body) == body_len else None
+
+
+def merge_indexes(run_dir: Path) -> int:
+    """Fold per-shard index files (index-<shard>.tsv) into the run's single index.tsv."""
+    segment_dir = run_dir / SEGMENT_DIR
+    if not segment_dir.is_dir():
+        return 0
+    merged = 0
+    with (segment_dir / INDEX_FILE).open("a", encoding="utf-8") as target:
+        for part in sorted(segment_dir.glob("index-*.tsv")):
+            with part.open("r", encoding="utf-8") as source:
+                for line in source:
+                    target.write(line)
+                    merged += 1
+            part.unlink()
+    return merged
+
+
+def convert_segments(run_dir: Path, truncated: Optional[List[str]] = None) -> Dict[str, int]:
+    """Rebuild the per-domain YAML layout next to the segments of a run directory.
+
+    With ``truncated`` given, segments cut short are converted up to their last complete record
+    and listed there instead of failing the conversion.
+    """
+    reader = SegmentReader(run_dir)
+    existing = sorted(run_dir.glob("*.yaml"))
+    if existing:
+        raise ValueError(f"{run_dir} already contains YAML logs (e.g. {existing[0].name})")
+    batch, _, run_ts = run_dir.name.rpartition("_")
+    writer = SessionLogger(run_dir.parent, batch, run_ts=run_ts)
+    counts: Dict[str, int] = {}
+    try:
+        for session in reader.iter_sessions(truncated):
+            writer.log_session(session)
+            counts[session.target_domain] = counts.get(session.target_domain, 0) + 1
+    finally:
+        writer.close()
+    return counts
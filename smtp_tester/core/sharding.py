@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import concurrent.futures
+import zlib
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from .segment_log import merge_indexes
+from .timing import write_run_timings
+
+
+def domain_shard(domain: str, shards: int) -> int:
+    """Stable shard number for a domain, so every worker can pick its domains while streaming."""
+    return zlib.crc32(domain.encode("utf-8")) % shards
+
+
+def _run_shard(
+    batch_path: Path,
+    config: dict,
+    selected_tasks: Optional[List[str]],
+    engine: str,
+    concurrency: Optional[int],
+    mx_path: Path,
+    shard_index: int,
+    shard_count: int,
+    run_ts: str,
+    plan_path: Optional[Path] = None,
+) -> Dict[str, int]:
+    # Imported here so worker processes build their own task objects from task.py.
+    from .async_runner import AsyncBatchRunner
+    from .mx_cache import iter_cached_mx_targets
+    from .mx_loader import iter_mx_targets
+    from .plan import read_plan
+    from .runner import BatchRunner
+    from .task_loader import TaskLoader
+
+    shard = f"w{shard_index:02d}"
+    plan = None
+    mx_records: Iterable = ()
+    if plan_path is not None:
+        plan = (planned for planned in read_plan(plan_path) if domain_shard(planned.domain, shard_count) == shard_index)
+    else:
+        # The parent has already compiled the MX cache, so workers only read it.
+        source = iter_cached_mx_targets(mx_path) if config.get("mx_cache", False) else iter_mx_targets(mx_path)
+        mx_records = (record for record in source if domain_shard(record.domain, shard_count) == shard_index)
+    tasks = TaskLoader(batch_path, render_cache_size=int(config.get("render_cache_size", 1024))).load()
+    if engine == "async":
+        runner: BatchRunner = AsyncBatchRunner(
+            batch_path, config, tasks, mx_records, concurrency=concurrency, run_ts=run_ts, shard=shard, plan=plan
+        )
+    else:
+        runner = BatchRunner(batch_path, config, tasks, mx_records, run_ts=run_ts, shard=shard, plan=plan)
+    return runner.run(selected_tasks)
+
+
+def run_sharded(
+    batch_path: Path,
+    config: dict,
+    mx_path: Path,
+    workers: int,
+    selected_tasks: Optional[List[str]] = None,
+    engine: str = "sync",
+    concurrency: Optional[int] = None,
+    run_ts: Optional[str] = None,
+    plan_path: Optional[Path] = None,
+) -> Dict[str, int]:
+    run_ts = run_ts or datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    source = plan_path.name if plan_path else mx_path.name
+    print(f"[*] running {source} in {workers} worker process(es) sharded by domain, run {run_ts}")
+    totals: Counter = Counter()
+    failures: List[str] = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(
+                _run_shard,
+                batch_path,
+                config,
+                selected_tasks,
+                engine,
+                concurrency,
+                mx_path,
+                index,
+                workers,
+                run_ts,
+                plan_path,
+            ): index
+            for index in range(workers)
+        }
+        for future in concurrent.futures.as_completed(futures):
+            index = futures[future]
+            try:
+                totals.update(future.result())
+            except Exception as exc:  # noqa: BLE001
+                failures.append(f"w{index:02d}: {exc}")
+    run_dir = Path(config.get("log_dir", "logs")) / f"{batch_path.name}_{run_ts}"
+    merge_indexes(run_dir)
+    write_run_timings(run_dir, batch_path.name)
+    if failures:
+        raise RuntimeError(f"{len(failures)} worker(s) failed: {'; '.join(failures)}")
+    return dict(totals)
@@ -1,11 +1,18 @@
 from __future__ import annotations
 
+import errno
+import os
 import select
+import selectors
 import socket
 import time
-from typing import List, Optional
+from typing import Dict, List, Optional, Sequence, Union
 
+from .body_stream import BODY_CHUNK, SENDFILE_CHUNK, BodyEncoder
 from .models import CommandSpec, SessionEvent
+from .reply_parser import ReplyTracker
+from .stop_rules import QUIT, StopHit, StopRule, StopWatch
+from .timing import PhaseTimer
 
 
 class SMTPClient:
@@ -19,6 +26,11 @@ class SMTPClient:
         read_chunk: int = 4096,
         delay_before_first_command: float = 0.0,
         delay_between_commands: float = 0.0,
+        reply_aware: bool = True,
+        body_inline_max: int = 65536,
+        body_log_head: int = 256,
+        source_address: Optional[str] = None,
+        lockstep: bool = False,
     ):
         self.host_ip = host_ip
         self.port = port
@@ -28,14 +40,125 @@ class SMTPClient:
         self.read_chunk = read_chunk
         self.delay_before_first_command = delay_before_first_command
         self.delay_between_commands = delay_between_commands
+        self.reply_aware = reply_aware
+        self.body_inline_max = body_inline_max
+        self.body_log_head = body_log_head
+        # Local address to bind before connecting; None lets the kernel choose.
+        self.source_address = source_address
+        # Wait for every reply owed before sending the next command instead of pipelining.
+        self.lockstep = lockstep
+        self.tracker: Optional[ReplyTracker] = None
+        # Set when a stop rule of the running sequence matched a reply.
+        self.stop: Optional[StopHit] = None
+        self._watch: Optional[StopWatch] = None
+        self.banner = b""
+        self.timer = PhaseTimer()
+        # Every recv lands in this one buffer; recorded events copy out of it.
+        self._buffer = bytearray(max(1, read_chunk))
+        self._view = memoryview(self._buffer)
+        # Set when race_connect already read the banner for the next run_sequence.
+        self._banner_ready = False
         self.sock: Optional[socket.socket] = None
 
     def connect(self) -> None:
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock = self._new_socket()
         self.sock.settimeout(self.connect_timeout)
+        self.timer.start()
         self.sock.connect((self.host_ip, self.port))
+        self.timer.connected()
         self.sock.settimeout(self.banner_timeout)
 
+    def race_connect(self, ips: List[str], stagger: float) -> int:
+        """Connect to the first of ``ips`` that sends a banner, starting one attempt every ``stagger``
+        seconds (or as soon as the previous one fails). Returns the winning index; the rest are closed."""
+        self.timer.start()
+        selector = selectors.DefaultSelector()
+        # socket -> [index, connected_at (None while connecting), deadline]
+        attempts: Dict[socket.socket, List] = {}
+        errors: List[str] = []
+        queue = list(enumerate(ips))
+        next_start = time.monotonic()
+
+        def fail(sock: socket.socket, reason: str) -> None:
+            index = attempts.pop(sock)[0]
+            selector.unregister(sock)
+            sock.close()
+            errors.append(f"{ips[index]}: {reason}")
+
+        try:
+            while queue or attempts:
+                now = time.monotonic()
+                if queue and (now >= next_start or not attempts):
+                    index, ip = queue.pop(0)
+                    sock = self._new_socket()
+                    # Tracked before connecting, so the finally below closes it whatever raises next.
+                    attempts[sock] = [index, None, now + self.connect_timeout]
+                    selector.register(sock, selectors.EVENT_WRITE)
+                    sock.setblocking(False)
+                    code = sock.connect_ex((ip, self.port))
+                    if code not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                        fail(sock, os.strerror(code))
+                        continue
+                    next_start = now + stagger
+                    continue
+                deadline = min(attempt[2] for attempt in attempts.values())
+                if queue:
+                    deadline = min(deadline, next_start)
+                for key, _ in selector.select(max(0.0, deadline - now)):
+                    sock = key.fileobj  # type: ignore[assignment]
+                    attempt = attempts[sock]
+                    if attempt[1] is None:
+                        code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                        if code:
+                            fail(sock, os.strerror(code))
+                            next_start = time.monotonic()
+                            continue
+                        attempt[1] = time.monotonic()
+                        attempt[2] = attempt[1] + self.banner_timeout
+                        selector.modify(sock, selectors.EVENT_READ)
+                        continue
+                    try:
+                        size = sock.recv_into(self._buffer)
+                    except OSError as exc:
+                        fail(sock, str(exc))
+                        next_start = time.monotonic()
+                        continue
+                    if not size:
+                        fail(sock, "connection closed before banner")
+                        next_start = time.monotonic()
+                        continue
+                    attempts.pop(sock)
+                    selector.unregister(sock)
+                    self.timer.connected(attempt[1])
+                    self.timer.banner()
+                    self.sock = sock
+                    self.sock.settimeout(self.banner_timeout)
+                    self.host_ip = ips[attempt[0]]
+                    self.banner = bytes(self._view[:size])
+                    self._banner_ready = True
+                    return attempt[0]
+                now = time.monotonic()
+                for sock, attempt in list(attempts.items()):
+                    if now >= attempt[2]:
+                        fail(sock, "timed out" if attempt[1] is None else f"no banner (timeout {self.banner_timeout}s)")
+                        next_start = now
+        finally:
+            # Whatever is still tracked lost the race or was cut short by an exception.
+            for sock in set(attempts) | {key.fileobj for key in selector.get_map().values()}:
+                sock.close()  # type: ignore[union-attr]
+            selector.close()
+        raise ConnectionError(f"no MX answered ({'; '.join(errors)})")
+
+    def _new_socket(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.source_address:
+            try:
+                sock.bind((self.source_address, 0))
+            except OSError:
+                sock.close()
+                raise
+        return sock
+
     def close(self) -> None:
         if self.sock:
             try:
@@ -43,21 +166,54 @@ class SMTPClient:
             finally:
                 self.sock = None
 
-    def run_sequence(self, commands: List[CommandSpec], events: Optional[List[SessionEvent]] = None) -> List[SessionEvent]:
+    def run_sequence(
+        self,
+        commands: List[CommandSpec],
+        events: Optional[List[SessionEvent]] = None,
+        read_banner: bool = True,
+        stop_on: Sequence[StopRule] = (),
+        lockstep: Optional[bool] = None,
+    ) -> List[SessionEvent]:
         events = events if events is not None else []
         if not self.sock:
             raise RuntimeError("Socket is not connected")
-        # Receive banner
-        banner = self._recv_data(self.banner_timeout, f"waiting for SMTP banner from {self.host_ip}:{self.port}")
-        if banner:
-            events.append(SessionEvent(direction="recv", payload=banner))
-        if self.delay_before_first_command > 0:
-            time.sleep(self.delay_before_first_command)
-        for cmd in commands:
+        lockstep = self.lockstep if lockstep is None else lockstep
+        self.stop = None
+        self._watch = StopWatch(stop_on) if stop_on else None
+        # Stop rules and lock-step act on parsed replies, so either one turns reply tracking on.
+        tracked = self.reply_aware or bool(stop_on) or lockstep
+        self.tracker = ReplyTracker(expect_banner=read_banner) if tracked else None
+        if read_banner:
+            if self._banner_ready:
+                self._banner_ready = False
+            else:
+                self.banner = self._recv_data(self.banner_timeout, f"waiting for SMTP banner from {self.host_ip}:{self.port}")
+                self.timer.banner()
+            if self.banner:
+                self._record_recv(events, self.banner)
+            if self.delay_before_first_command > 0:
+                time.sleep(self.delay_before_first_command)
+        else:
+            # Later tasks of a shared session are timed from their first command.
+            self.timer.start()
+        for index, cmd in enumerate(commands):
+            if self.stop is not None:
+                break
             self.sock.settimeout(self.command_timeout)
-            self.sock.sendall(cmd.data)
-            events.append(SessionEvent(direction="send", payload=cmd.data))
-            preview = self._preview_command(cmd.data)
+            self.timer.sent()
+            if cmd.body is not None:
+                self._send_body(cmd, events)
+                preview = cmd.body.label
+            else:
+                self.sock.sendall(cmd.data)
+                events.append(SessionEvent(direction="send", payload=cmd.data))
+                if self.tracker:
+                    self.tracker.sent(cmd.data)
+                preview = self._preview_command(cmd.data)
+            if self.tracker:
+                self.tracker.done_sending = index == len(commands) - 1
+            if lockstep:
+                self._await_replies(events, f"waiting for the reply to {preview} from {self.host_ip}:{self.port}")
             self._drain_available(
                 events,
                 f"streaming response after {preview} from {self.host_ip}:{self.port}",
@@ -70,6 +226,11 @@ class SMTPClient:
                     f"streaming response during pause after {preview} from {self.host_ip}:{self.port}",
                     deadline,
                 )
+        if self.stop is not None:
+            self._finish_stopped(events)
+            return events
+        if self.tracker:
+            self.tracker.done_sending = True
         self._recv_until_idle(
             events,
             f"waiting for remaining responses from {self.host_ip}:{self.port}",
@@ -77,17 +238,117 @@ class SMTPClient:
         )
         return events
 
+    def _send_body(self, cmd: CommandSpec, events: List[SessionEvent]) -> None:
+        """Stream a body in chunks (sendfile for files that need no dot-stuffing) and log it by reference if large."""
+        assert self.sock is not None and cmd.body is not None
+        body = cmd.body
+        encoder = BodyEncoder(body.dot_stuff, self.body_inline_max, self.body_log_head)
+        # Replies to a refused DATA can arrive mid-body; they are recorded after the body's send event.
+        early = bytearray()
+        scan = body.scan(encoder.keep) if body.path is not None else None
+        if scan is not None and scan.clean and scan.size > BODY_CHUNK:
+            with body.path.open("rb") as handle:  # type: ignore[union-attr]
+                offset = 0
+                while offset < scan.size:
+                    sent = self.sock.sendfile(handle, offset, min(SENDFILE_CHUNK, scan.size - offset))
+                    if not sent:
+                        raise ConnectionError(f"{body.label} shrank while streaming it to {self.host_ip}:{self.port}")
+                    offset += sent
+                    self._stash_available(early, body.label)
+            encoder.adopt(scan)
+            self.sock.sendall(encoder.terminator())
+        else:
+            # The last chunk goes out with the terminator so small bodies are a single write.
+            pending = b""
+            for chunk in body.chunks(cmd.values):
+                if pending:
+                    self.sock.sendall(pending)
+                    self._stash_available(early, body.label)
+                pending = encoder.encode(chunk)
+            self.sock.sendall(pending + encoder.terminator())
+        events.append(encoder.event())
+        if self.tracker:
+            self.tracker.sent_body(encoder.lines)
+        if early:
+            self._record_recv(events, early)
+
+    def _stash_available(self, stash: bytearray, label: str) -> None:
+        assert self.sock is not None
+        while select.select([self.sock], [], [], 0.0)[0]:
+            size = self.sock.recv_into(self._buffer)
+            if not size:
+                raise ConnectionError(f"Connection closed while streaming {label} to {self.host_ip}:{self.port}")
+            stash += self._view[:size]
+
+    def _record_recv(self, events: List[SessionEvent], data: Union[bytes, memoryview]) -> None:
+        last = events[-1] if events else None
+        if last is not None and last.direction == "recv" and isinstance(last.payload, bytearray):
+            # Chunks arriving back to back grow one event instead of adding one per recv.
+            last.payload += data
+        else:
+            events.append(SessionEvent(direction="recv", payload=bytearray(data)))
+        self.timer.received()
+        if self.tracker:
+            self.tracker.received(data)
+            if self._watch is not None:
+                self.stop = self._watch.check(self.tracker)
+
+    def _replies_complete(self) -> bool:
+        # Once nothing is owed a peer close is expected (e.g. after QUIT's 221) rather than an error,
+        # and so is one after a reply that stopped the sequence.
+        return self.stop is not None or (self.tracker is not None and self.tracker.satisfied)
+
+    def _await_replies(self, events: List[SessionEvent], stage: str) -> None:
+        """Lock-step: block until every reply owed so far has arrived or a stop rule matched."""
+        assert self.sock is not None and self.tracker is not None
+        deadline = time.monotonic() + self.command_timeout
+        while self.tracker.outstanding and self.stop is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self.sock], [], [], remaining)[0]:
+                raise socket.timeout(f"{stage} (timeout {self.command_timeout}s)")
+            data = self._view[:self.sock.recv_into(self._buffer)]
+            if not data:
+                raise ConnectionError(f"Connection closed while {stage}")
+            self._record_recv(events, data)
+
+    def _finish_stopped(self, events: List[SessionEvent]) -> None:
+        """End a sequence cut short by a stop rule, sending QUIT first when the rule asks for it."""
+        assert self.sock is not None and self.tracker is not None and self.stop is not None
+        if self.stop.rule.action != "quit":
+            return
+        try:
+            self.sock.settimeout(self.command_timeout)
+            self.sock.sendall(QUIT)
+        except OSError:
+            # The server may already have hung up after its reply.
+            return
+        events.append(SessionEvent(direction="send", payload=QUIT))
+        self.tracker.sent(QUIT)
+        self.stop.quit_sent = True
+        deadline = time.monotonic() + self.command_timeout
+        while self.tracker.outstanding:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self.sock], [], [], remaining)[0]:
+                return
+            try:
+                size = self.sock.recv_into(self._buffer)
+            except OSError:
+                return
+            if not size:
+                return
+            self._record_recv(events, self._view[:size])
+
     def _recv_data(self, timeout: float, stage: str) -> bytes:
         if not self.sock:
             raise RuntimeError("Socket is not connected")
         self.sock.settimeout(timeout)
         try:
-            data = self.sock.recv(self.read_chunk)
+            size = self.sock.recv_into(self._buffer)
         except socket.timeout as exc:
             raise socket.timeout(f"{stage} (timeout {timeout}s)") from exc
-        if data == b"":
+        if not size:
             raise ConnectionError(f"Connection closed while {stage}")
-        return data
+        return bytes(self._view[:size])
 
     def _drain_available(self, events: List[SessionEvent], stage: str) -> None:
         if not self.sock:
@@ -96,25 +357,30 @@ class SMTPClient:
             readable, _, _ = select.select([self.sock], [], [], 0.0)
             if not readable:
                 return
-            data = self.sock.recv(self.read_chunk)
-            if data == b"":
+            data = self._view[:self.sock.recv_into(self._buffer)]
+            if not data:
+                if self._replies_complete():
+                    return
                 raise ConnectionError(f"Connection closed while {stage}")
-            events.append(SessionEvent(direction="recv", payload=data))
+            self._record_recv(events, data)
 
     def _drain_until_deadline(self, events: List[SessionEvent], stage: str, deadline: float) -> None:
         if not self.sock:
             raise RuntimeError("Socket is not connected")
-        while True:
+        # A reply that stops the sequence also ends the pause.
+        while self.stop is None:
             remaining = deadline - time.monotonic()
             if remaining <= 0:
                 return
             readable, _, _ = select.select([self.sock], [], [], remaining)
             if not readable:
                 return
-            data = self.sock.recv(self.read_chunk)
-            if data == b"":
+            data = self._view[:self.sock.recv_into(self._buffer)]
+            if not data:
+                if self._replies_complete():
+                    return
                 raise ConnectionError(f"Connection closed while {stage}")
-            events.append(SessionEvent(direction="recv", payload=data))
+            self._record_recv(events, data)
 
     def _recv_until_idle(self, events: List[SessionEvent], stage: str, idle_timeout: float) -> None:
         if idle_timeout <= 0:
@@ -122,13 +388,18 @@ class SMTPClient:
         if not self.sock:
             raise RuntimeError("Socket is not connected")
         while True:
+            if self._replies_complete():
+                # Every expected reply is in; the idle wait only remains for unterminated probes.
+                return
             readable, _, _ = select.select([self.sock], [], [], idle_timeout)
             if not readable:
                 return
-            data = self.sock.recv(self.read_chunk)
-            if data == b"":
+            data = self._view[:self.sock.recv_into(self._buffer)]
+            if not data:
+                if self._replies_complete():
+                    return
                 raise ConnectionError(f"Connection closed while {stage}")
-            events.append(SessionEvent(direction="recv", payload=data))
+            self._record_recv(events, data)
 
     @staticmethod
     def _preview_command(payload: bytes, max_length: int = 40) -> str:
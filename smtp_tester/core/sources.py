@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import ipaddress
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+
+from .models import SessionEvent
+from .reply_parser import ReplyParser, parse_code
+from .scheduler import TokenBucket
+
+
+# "round_robin" cycles through the sources in order; "lru" picks the one idle the longest.
+SOURCE_STRATEGIES = ("round_robin", "lru")
+
+
+def reply_codes(events: Sequence[SessionEvent]) -> List[int]:
+    """Codes of every reply received in a session, banner included."""
+    parser = ReplyParser()
+    codes: List[int] = []
+    for event in events:
+        if event.direction == "recv":
+            codes.extend(reply.code for reply in parser.feed(bytes(event.payload)))
+    return codes
+
+
+@dataclass
+class _Source:
+    address: str
+    bucket: TokenBucket
+    last_used: float = -math.inf
+    cooling_until: float = 0.0
+
+
+class SourcePool:
+    """Local addresses sessions are bound to, each with its own rate limit and a cool-down after 4xx replies."""
+
+    def __init__(
+        self,
+        addresses: Iterable[str],
+        strategy: str = "round_robin",
+        rate: float = 0.0,
+        burst: float = 1.0,
+        cooldown: float = 60.0,
+        cooldown_codes: Iterable[str] = ("4xx",),
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if strategy not in SOURCE_STRATEGIES:
+            raise ValueError(f"source_strategy must be one of {', '.join(SOURCE_STRATEGIES)}")
+        self.sources: List[_Source] = []
+        for address in addresses:
+            try:
+                ipaddress.IPv4Address(address)
+            except ValueError as exc:
+                raise ValueError(f"source address {address!r} is not an IPv4 address") from exc
+            self.sources.append(_Source(address=address, bucket=TokenBucket(rate, burst, clock)))
+        if not self.sources:
+            raise ValueError("source_addresses is empty")
+        self.strategy = strategy
+        self.cooldown = cooldown
+        self.cooldown_codes: List[Tuple[int, int]] = [parse_code(str(code)) for code in cooldown_codes]
+        self.clock = clock
+        self._next = 0
+        # Worker connections share one pool from several threads.
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: dict) -> Optional["SourcePool"]:
+        addresses = config.get("source_addresses") or []
+        if not addresses:
+            return None
+        return cls(
+            addresses,
+            strategy=config.get("source_strategy", "round_robin"),
+            rate=float(config.get("source_rate", 0) or 0),
+            burst=float(config.get("source_burst", 1)),
+            cooldown=float(config.get("source_cooldown", 60.0)),
+            cooldown_codes=config.get("source_cooldown_codes") or (),
+        )
+
+    def delay(self, now: float) -> float:
+        """Seconds until some source may start a session (0 when one can be taken now)."""
+        with self._lock:
+            return min(self._delay(source, now) for source in self.sources)
+
+    def take(self, now: float) -> str:
+        """Claim the next source by strategy; call only after ``delay`` returned 0."""
+        with self._lock:
+            ready = [index for index, source in enumerate(self.sources) if self._delay(source, now) <= 0]
+            if not ready:
+                ready = [min(range(len(self.sources)), key=lambda index: self._delay(self.sources[index], now))]
+            if self.strategy == "lru":
+                index = min(ready, key=lambda index: self.sources[index].last_used)
+            else:
+                index = min(ready, key=lambda index: (index - self._next) % len(self.sources))
+                self._next = (index + 1) % len(self.sources)
+            source = self.sources[index]
+            source.bucket.take(now)
+            source.last_used = now
+            return source.address
+
+    def wait_take(self) -> str:
+        """Block until a source is free and claim it, for callers without a scheduler."""
+        while True:
+            wait = self.delay(self.clock())
+            if wait <= 0:
+                return self.take(self.clock())
+            time.sleep(min(wait, 1.0))
+
+    def report(self, address: str, codes: Iterable[int]) -> Optional[int]:
+        """Start a cool-down for ``address`` when a reply matches ``cooldown_codes``; returns that code."""
+        if self.cooldown <= 0:
+            return None
+        code = next((code for code in codes if any(low <= code <= high for low, high in self.cooldown_codes)), None)
+        if code is None:
+            return None
+        with self._lock:
+            for source in self.sources:
+                if source.address == address:
+                    source.cooling_until = max(source.cooling_until, self.clock() + self.cooldown)
+        return code
+
+    @staticmethod
+    def _delay(source: _Source, now: float) -> float:
+        return max(source.bucket.delay(now), source.cooling_until - now)
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, FrozenSet, List, Optional, Sequence, Tuple
+
+from .reply_parser import ReplyTracker, SMTPReply, parse_code, verb_key
+
+
+# Session status of a task stopped by one of its stop rules.
+ABORTED = "aborted"
+# "abort" drops the connection at once; "quit" sends QUIT and waits for its reply first.
+STOP_ACTIONS = ("abort", "quit")
+QUIT = b"QUIT\r\n"
+
+
+@dataclass(frozen=True)
+class StopRule:
+    """Stop a session when a reply to one of ``verbs`` (any verb when empty) falls in one of ``codes``."""
+
+    codes: Tuple[Tuple[int, int], ...]
+    verbs: FrozenSet[bytes] = frozenset()
+    action: str = "abort"
+    label: str = ""
+
+    def matches(self, verb: bytes, code: int) -> bool:
+        if self.verbs and verb not in self.verbs:
+            return False
+        return any(low <= code <= high for low, high in self.codes)
+
+
+@dataclass
+class StopHit:
+    rule: StopRule
+    verb: bytes
+    reply: SMTPReply
+    quit_sent: bool = False
+
+    def describe(self) -> str:
+        verb = self.verb.decode("latin1") or "unsolicited reply"
+        text = self.reply.lines[0].decode("latin1") if self.reply.lines else str(self.reply.code)
+        done = "sent QUIT" if self.quit_sent else "dropped the connection"
+        return f"stopped after {verb}: {text!r} matched stop rule {self.rule.label}, {done}"
+
+
+def parse_stop_rules(task: str, entries: Any) -> List[StopRule]:
+    """Build a task's ``stop_on`` rules from dicts like ``{"codes": "5xx", "after": ["MAIL", "RCPT"], "action": "quit"}``."""
+    if entries is None:
+        return []
+    if not isinstance(entries, list):
+        raise ValueError(f"Task {task} stop_on must be a list of rule dicts")
+    rules = []
+    for entry in entries:
+        if not isinstance(entry, dict) or "codes" not in entry:
+            raise ValueError(f"Task {task} stop_on rules must be dicts with codes")
+        unknown = set(entry) - {"codes", "after", "action"}
+        if unknown:
+            raise ValueError(f"Task {task} stop_on rule has unknown key(s) {', '.join(sorted(unknown))}")
+        codes = _names(task, "codes", entry["codes"])
+        after = _names(task, "after", entry.get("after"))
+        action = entry.get("action", "abort")
+        if action not in STOP_ACTIONS:
+            raise ValueError(f"Task {task} stop_on action must be one of {', '.join(STOP_ACTIONS)}")
+        try:
+            ranges = tuple(parse_code(code) for code in codes)
+        except ValueError as exc:
+            raise ValueError(f"Task {task} stop_on: {exc}") from exc
+        if not ranges:
+            raise ValueError(f"Task {task} stop_on rule needs at least one code")
+        verbs = frozenset(verb_key(verb) for verb in after)
+        label = "/".join(codes) + (f" after {'/'.join(verb.upper() for verb in after)}" if after else "")
+        rules.append(StopRule(codes=ranges, verbs=verbs, action=action, label=label))
+    return rules
+
+
+def _names(task: str, key: str, value: Any) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, (str, int)):
+        return [str(value)]
+    if isinstance(value, (list, tuple)) and all(isinstance(item, (str, int)) for item in value):
+        return [str(item) for item in value]
+    raise ValueError(f"Task {task} stop_on {key} must be a string or a list of strings")
+
+
+class StopWatch:
+    """Checks the replies a tracker has matched to their commands against stop rules, each reply once."""
+
+    def __init__(self, rules: Sequence[StopRule]):
+        self.rules = rules
+        self.hit: Optional[StopHit] = None
+        self._checked = 0
+
+    def check(self, tracker: ReplyTracker) -> Optional[StopHit]:
+        if self.hit is None and self.rules:
+            exchanges = tracker.exchanges
+            while self._checked < len(exchanges):
+                verb, reply = exchanges[self._checked]
+                self._checked += 1
+                rule = next((rule for rule in self.rules if rule.matches(verb, reply.code)), None)
+                if rule is not None:
+                    self.hit = StopHit(rule=rule, verb=verb, reply=reply)
+                    break
+        return self.hit
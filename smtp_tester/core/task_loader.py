@@ -3,13 +3,22 @@ from __future__ import annotations
 from pathlib import Path
 from typing import Any, Dict, List
 
-from .models import CommandTemplate, TaskDefinition
+from .body_stream import BodySource
+from .models import EXPAND_MODES, CommandTemplate, CompiledTemplate, TaskDefinition
+from .stop_rules import parse_stop_rules
 from .utils import load_python_module
 
 
+# "all" runs a task against every MX IP; "first_reachable" races a domain's IPs and runs it once.
+MX_STRATEGIES = ("all", "first_reachable")
+# Separators of plan files (``,`` between units, ``+`` within one) and of tab-separated journal lines.
+RESERVED_NAME_CHARS = ",+\t\r\n"
+
+
 class TaskLoader:
-    def __init__(self, batch_path: Path):
+    def __init__(self, batch_path: Path, render_cache_size: int = 1024):
         self.batch_path = batch_path
+        self.render_cache_size = render_cache_size
         self.templates: Dict[str, List[Any]] = {}
         self.tasks: List[TaskDefinition] = []
 
@@ -29,6 +38,8 @@ class TaskLoader:
         if "name" not in data:
             raise ValueError("Task missing name")
         name = data["name"]
+        if not isinstance(name, str) or not name or any(char in RESERVED_NAME_CHARS for char in name):
+            raise ValueError(f"Task name {name!r} must be a non-empty string without ',', '+', tabs or newlines")
         description = data.get("description")
         values = data.get("values", {})
         if not isinstance(values, dict):
@@ -46,21 +57,62 @@ class TaskLoader:
                 raise ValueError(f"Task {name} references missing template {template_name}")
             commands_source = self.templates[template_name]
         commands = [self._normalize_command(cmd) for cmd in commands_source]
+        mx_strategy = data.get("mx_strategy", "all")
+        if mx_strategy not in MX_STRATEGIES:
+            raise ValueError(f"Task {name} mx_strategy must be one of {', '.join(MX_STRATEGIES)}")
+        axes = data.get("axes") or {}
+        if not isinstance(axes, dict):
+            raise ValueError(f"Task {name} axes must be a dict of value lists, ranges or callables")
+        for axis, axis_values in axes.items():
+            if axis == "index" or not isinstance(axis, str) or not axis.isidentifier():
+                raise ValueError(f"Task {name} has an invalid axis name {axis!r}")
+            if callable(axis_values):
+                continue
+            # One-shot iterators would run dry after the first pass of an outer axis.
+            if isinstance(axis_values, (str, bytes)) or not hasattr(axis_values, "__iter__") or iter(axis_values) is axis_values:
+                raise ValueError(f"Task {name} axis {axis} must be a list, range or callable returning an iterable")
+        expand = data.get("expand", "product")
+        if expand not in EXPAND_MODES:
+            raise ValueError(f"Task {name} expand must be one of {', '.join(EXPAND_MODES)}")
+        lockstep = data.get("lockstep")
+        if lockstep is not None and not isinstance(lockstep, bool):
+            raise ValueError(f"Task {name} lockstep must be True or False")
         return TaskDefinition(
             name=name,
             commands=commands,
             description=description,
             values=values,
             target_values=target_values or None,
+            session_reuse=bool(data.get("session_reuse", False)),
+            mx_strategy=mx_strategy,
+            render_cache_size=self.render_cache_size,
+            axes=axes or None,
+            expand=expand,
+            stop_on=parse_stop_rules(name, data.get("stop_on")),
+            lockstep=lockstep,
         )
 
-    @staticmethod
-    def _normalize_command(entry: Any) -> CommandTemplate:
+    def _normalize_command(self, entry: Any) -> CommandTemplate:
         pause_after = 0.0
         raw = entry
         if isinstance(entry, dict):
+            pause_after = float(entry.get("pause_after", 0.0))
+            if "body_file" in entry or "body" in entry:
+                return CommandTemplate(raw=None, pause_after=pause_after, body=self._body_source(entry))
             if "data" not in entry:
-                raise ValueError("Command dict must include data")
+                raise ValueError("Command dict must include data, body_file or body")
             raw = entry.get("data")
-            pause_after = float(entry.get("pause_after", 0.0))
-        return CommandTemplate(raw=raw, pause_after=pause_after)
+        return CommandTemplate(raw=raw, pause_after=pause_after, compiled=CompiledTemplate.compile(raw))
+
+    def _body_source(self, entry: dict) -> BodySource:
+        dot_stuff = bool(entry.get("dot_stuff", True))
+        if "body_file" in entry:
+            path = Path(entry["body_file"]).expanduser()
+            if not path.is_absolute():
+                path = self.batch_path / path
+            if not path.is_file():
+                raise ValueError(f"Body file {path} not found")
+            return BodySource(path=path, dot_stuff=dot_stuff)
+        if not callable(entry["body"]):
+            raise ValueError("Command body must be a callable returning an iterable of bytes chunks")
+        return BodySource(factory=entry["body"], dot_stuff=dot_stuff)
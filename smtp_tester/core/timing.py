@@ -0,0 +1,255 @@
+from __future__ import annotations
+
+import bisect
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+PHASES = ("connect", "banner", "first_reply", "last_reply", "idle_tail", "total")
+TIMINGS_FILE = "timings.json"
+METRICS_FILE = "metrics.prom"
+
+# Upper bounds in seconds: ten steps per decade from 0.1ms to 1000s, plus an overflow bucket.
+_STEPS = (1, 1.25, 1.5, 2, 2.5, 3, 4, 5, 6, 8)
+BUCKETS: Tuple[float, ...] = tuple(round(step * 10.0 ** exp, 6) for exp in range(-4, 3) for step in _STEPS) + (1000.0,)
+# Prometheus buckets are a 1-2.5-5 subset so the exported series stay small.
+_PROM_BUCKETS = tuple(index for index in range(len(BUCKETS)) if _STEPS[index % len(_STEPS)] in (1, 2.5, 5))
+_QUANTILES = (0.5, 0.9, 0.99)
+
+
+class PhaseTimer:
+    """Monotonic phase durations of one session (or one task slice of a shared session)."""
+
+    def __init__(self) -> None:
+        self.start()
+
+    def start(self) -> None:
+        self.timings: Dict[str, float] = {}
+        self._started = time.monotonic()
+        self._connected: Optional[float] = None
+        self._first_send: Optional[float] = None
+        self._last_recv: Optional[float] = None
+
+    def connected(self, at: Optional[float] = None) -> None:
+        self._connected = time.monotonic() if at is None else at
+        self.timings["connect"] = self._connected - self._started
+
+    def banner(self, at: Optional[float] = None) -> None:
+        if self._connected is not None:
+            self.timings["banner"] = (time.monotonic() if at is None else at) - self._connected
+
+    def sent(self) -> None:
+        if self._first_send is None:
+            self._first_send = time.monotonic()
+
+    def received(self) -> None:
+        if self._first_send is None:
+            return
+        self._last_recv = time.monotonic()
+        self.timings.setdefault("first_reply", self._last_recv - self._first_send)
+
+    def finish(self) -> Dict[str, float]:
+        end = time.monotonic()
+        if self._last_recv is not None and self._first_send is not None:
+            self.timings["last_reply"] = self._last_recv - self._first_send
+            self.timings["idle_tail"] = end - self._last_recv
+        self.timings["total"] = end - self._started
+        return {phase: round(value, 6) for phase, value in self.timings.items()}
+
+
+class LatencyHistogram:
+    __slots__ = ("count", "sum", "max", "buckets")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        # Sparse: most domains only ever fill a handful of buckets.
+        self.buckets: Dict[int, int] = {}
+
+    def add(self, value: float) -> None:
+        index = bisect.bisect_left(BUCKETS, value)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th value (capped at the observed maximum)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(BUCKETS[index], self.max) if index < len(BUCKETS) else self.max
+        return self.max
+
+    def cumulative(self, indexes: Iterable[int]) -> List[int]:
+        counts = []
+        for limit in indexes:
+            counts.append(sum(count for index, count in self.buckets.items() if index <= limit))
+        return counts
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "max": self.max,
+            "buckets": {str(index): count for index, count in sorted(self.buckets.items())},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LatencyHistogram":
+        histogram = cls()
+        histogram.count = int(data["count"])
+        histogram.sum = float(data["sum"])
+        histogram.max = float(data["max"])
+        histogram.buckets = {int(index): int(count) for index, count in data["buckets"].items()}
+        return histogram
+
+
+class RunTimings:
+    """Phase histograms for a run, overall and per task and per domain; mergeable across workers."""
+
+    SCOPES = ("all", "task", "domain")
+    OTHER_DOMAINS = "(other)"
+
+    def __init__(self, max_domains: int = 10000) -> None:
+        self.max_domains = max_domains
+        self.histograms: Dict[str, Dict[str, Dict[str, LatencyHistogram]]] = {scope: {} for scope in self.SCOPES}
+
+    def add(self, task: str, domain: str, timings: Dict[str, float]) -> None:
+        domains = self.histograms["domain"]
+        if domain not in domains and len(domains) >= self.max_domains:
+            # Bounded memory on huge target lists: late domains share one bucket set.
+            domain = self.OTHER_DOMAINS
+        for scope, key in (("all", ""), ("task", task), ("domain", domain)):
+            phases = self.histograms[scope].setdefault(key, {})
+            for phase, value in timings.items():
+                histogram = phases.get(phase)
+                if histogram is None:
+                    histogram = phases[phase] = LatencyHistogram()
+                histogram.add(value)
+
+    def merge(self, other: "RunTimings") -> None:
+        for scope, keys in other.histograms.items():
+            for key, phases in keys.items():
+                target = self.histograms[scope].setdefault(key, {})
+                for phase, histogram in phases.items():
+                    if phase in target:
+                        target[phase].merge(histogram)
+                    else:
+                        target[phase] = histogram
+
+    def save(self, path: Path) -> None:
+        data = {
+            "buckets": list(BUCKETS),
+            "histograms": {
+                scope: {
+                    key: {phase: histogram.to_dict() for phase, histogram in phases.items()}
+                    for key, phases in keys.items()
+                }
+                for scope, keys in self.histograms.items()
+            },
+        }
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(data, separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "RunTimings":
+        data = json.loads(path.read_text(encoding="utf-8"))
+        if list(data.get("buckets", [])) != list(BUCKETS):
+            raise ValueError(f"{path} uses different histogram buckets")
+        timings = cls()
+        for scope, keys in data["histograms"].items():
+            timings.histograms[scope] = {
+                key: {phase: LatencyHistogram.from_dict(histogram) for phase, histogram in phases.items()}
+                for key, phases in keys.items()
+            }
+        return timings
+
+    def format_lines(self) -> List[str]:
+        lines = []
+        overall = self.histograms["all"].get("", {})
+        for phase in PHASES:
+            histogram = overall.get(phase)
+            if histogram is None or not histogram.count:
+                continue
+            quantiles = " ".join(f"p{int(q * 100)}={_ms(histogram.quantile(q))}" for q in _QUANTILES)
+            lines.append(f"{phase}: n={histogram.count} {quantiles} max={_ms(histogram.max)}")
+        return lines
+
+    def to_prometheus(self, batch: str) -> str:
+        lines = [
+            "# HELP smtp_tester_phase_seconds SMTP session phase durations per task.",
+            "# TYPE smtp_tester_phase_seconds histogram",
+        ]
+        for task, phases in sorted(self.histograms["task"].items()):
+            for phase in PHASES:
+                histogram = phases.get(phase)
+                if histogram is None:
+                    continue
+                labels = f'batch="{_label(batch)}",task="{_label(task)}",phase="{phase}"'
+                for index, count in zip(_PROM_BUCKETS, histogram.cumulative(_PROM_BUCKETS)):
+                    lines.append(f'smtp_tester_phase_seconds_bucket{{{labels},le="{BUCKETS[index]:g}"}} {count}')
+                lines.append(f'smtp_tester_phase_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f"smtp_tester_phase_seconds_sum{{{labels}}} {histogram.sum:.6f}")
+                lines.append(f"smtp_tester_phase_seconds_count{{{labels}}} {histogram.count}")
+        lines.append("# HELP smtp_tester_domain_phase_seconds SMTP session phase durations per target domain.")
+        lines.append("# TYPE smtp_tester_domain_phase_seconds summary")
+        for domain, phases in sorted(self.histograms["domain"].items()):
+            for phase in PHASES:
+                histogram = phases.get(phase)
+                if histogram is None:
+                    continue
+                labels = f'batch="{_label(batch)}",domain="{_label(domain)}",phase="{phase}"'
+                for q in _QUANTILES:
+                    lines.append(f'smtp_tester_domain_phase_seconds{{{labels},quantile="{q:g}"}} {histogram.quantile(q):.6f}')
+                lines.append(f"smtp_tester_domain_phase_seconds_sum{{{labels}}} {histogram.sum:.6f}")
+                lines.append(f"smtp_tester_domain_phase_seconds_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def timings_name(shard: Optional[str]) -> str:
+    # Every runner writes its own part; write_run_timings folds the parts into timings.json.
+    return f"timings-{shard or os.getpid()}.json"
+
+
+def write_run_timings(run_dir: Path, batch: str) -> Optional[RunTimings]:
+    """Fold per-shard timing files into the run's timings.json and rewrite metrics.prom from it."""
+    parts = sorted(run_dir.glob("timings-*.json"))
+    target = run_dir / TIMINGS_FILE
+    if not parts and not target.exists():
+        return None
+    timings = RunTimings.load(target) if target.exists() else RunTimings()
+    for part in parts:
+        timings.merge(RunTimings.load(part))
+    timings.save(target)
+    for part in parts:
+        part.unlink()
+    tmp_path = run_dir / f"{METRICS_FILE}.{os.getpid()}.tmp"
+    tmp_path.write_text(timings.to_prometheus(batch), encoding="utf-8")
+    # Renamed into place so a node_exporter textfile collector never reads a partial file.
+    os.replace(tmp_path, run_dir / METRICS_FILE)
+    return timings
+
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:.1f}ms"
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -1,9 +1,12 @@
 from __future__ import annotations
 
+import fcntl
 import importlib.util
+import json
+import os
 import sys
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Dict
 
 
 def load_python_module(path: Path, name: str) -> Any:
@@ -16,6 +19,29 @@ def load_python_module(path: Path, name: str) -> Any:
     return module
 
 
+def read_json_store(path: Path) -> Dict[str, Any]:
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as exc:
+        print(f"[!] ignoring unreadable store {path}: {exc}")
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def update_json_store(path: Path, update: Callable[[Dict[str, Any]], None]) -> None:
+    """Read-modify-write a JSON object file under an exclusive lock, so concurrent workers keep each other's entries."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.with_name(f"{path.name}.lock").open("w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        data = read_json_store(path)
+        update(data)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(data, separators=(",", ":"), sort_keys=True), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+
 def simple_yaml_dump(data: Any) -> str:
     """Minimal YAML serializer for simple dict/list/str content with multiline support."""
 
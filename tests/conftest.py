@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import List, Tuple
+
+import pytest
+
+from smtp_tester.core.models import SessionEvent, SessionLog
+
+
+def events(*exchanges: Tuple[str, bytes]) -> List[SessionEvent]:
+    return [SessionEvent(direction=direction, payload=payload) for direction, payload in exchanges]
+
+
+@pytest.fixture
+def make_session():
+    """Build a SessionLog with sensible defaults; keyword arguments override any field."""
+
+    def build(session_events=(), **fields) -> SessionLog:
+        values = dict(
+            batch="b0_test",
+            task="probe",
+            target_domain="example.test",
+            mx_hostname="mx.example.test",
+            mx_preference=10,
+            mx_ip="192.0.2.1",
+            start_time=datetime(2024, 1, 1, 12, 0, 0),
+            end_time=datetime(2024, 1, 1, 12, 0, 1),
+            status="success",
+        )
+        values.update(fields)
+        return SessionLog(events=list(session_events), **values)
+
+    return build
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+
+import pytest
+
+from smtp_tester.bench.fake_server import FakeSMTPServer, ServerBehavior
+from smtp_tester.core.async_client import AsyncSMTPClient
+from smtp_tester.core.body_stream import BODY_CHUNK, BodyEncoder, BodySource
+from smtp_tester.core.models import CommandSpec
+from smtp_tester.core.smtp_client import SMTPClient
+
+
+def _wire(encoder: BodyEncoder, *chunks: bytes) -> bytes:
+    return b"".join(encoder.encode(chunk) for chunk in chunks) + encoder.terminator()
+
+
+def test_dot_at_a_chunk_boundary_is_stuffed():
+    encoder = BodyEncoder()
+    assert _wire(encoder, b"one\r\n", b".two\r\n.three\r\n") == b"one\r\n..two\r\n..three\r\n.\r\n"
+    # A dot after a chunk that ended mid-line is not at a line start.
+    assert _wire(BodyEncoder(), b"one", b".two\r\n") == b"one.two\r\n.\r\n"
+    assert _wire(BodyEncoder(dot_stuff=False), b"one\r\n", b".two\r\n") == b"one\r\n.two\r\n.\r\n"
+
+
+@pytest.mark.parametrize(
+    ("body", "wire"),
+    [
+        (b"text", b"text\r\n.\r\n"),
+        (b"text\r\n", b"text\r\n.\r\n"),
+        # A bare LF already ends the line, so only the dot line is added.
+        (b"text\n", b"text\n.\r\n"),
+        (b"", b".\r\n"),
+    ],
+)
+def test_terminator_closes_the_last_line(body, wire):
+    encoder = BodyEncoder()
+    assert _wire(encoder, body) == wire
+    assert encoder.size == len(wire) and encoder.lines == wire.count(b"\n")
+
+
+def test_bodies_over_inline_max_are_logged_by_reference():
+    small = BodyEncoder(inline_max=10, head=4)
+    wire = _wire(small, b"12345")
+    assert len(wire) == 10
+    assert small.event().payload == wire and small.event().ref is None
+
+    large = BodyEncoder(inline_max=10, head=4)
+    wire = _wire(large, b"123456")
+    event = large.event()
+    assert event.payload == wire[:4]
+    assert event.ref is not None
+    assert (event.ref.size, event.ref.lines) == (11, 2)
+    assert event.ref.sha256 == hashlib.sha256(wire).hexdigest()
+
+
+def test_scan_finds_a_dot_line_across_chunks(tmp_path):
+    path = tmp_path / "body.eml"
+    path.write_bytes(b"x" * (BODY_CHUNK - 2) + b"\r\n" + b".hidden\r\n")
+    scan = BodySource(path=path).scan(16)
+    assert not scan.clean and scan.ends_with_newline
+    assert BodySource(path=path, dot_stuff=False).scan(16).clean
+
+
+def test_adopt_logs_a_scanned_file_like_encode_would(tmp_path):
+    path = tmp_path / "body.eml"
+    path.write_bytes(b"line\r\n" * 1000 + b"last")
+    source = BodySource(path=path)
+    streamed = BodyEncoder(inline_max=100, head=8)
+    _wire(streamed, *source.chunks(None))
+    adopted = BodyEncoder(inline_max=100, head=8)
+    adopted.adopt(source.scan(adopted.keep))
+    adopted.terminator()
+    assert adopted.event() == streamed.event()
+    assert adopted.event().ref is not None and adopted.event().ref.size == 6004 + 5
+
+
+def _body_commands(path) -> list:
+    return [
+        CommandSpec(b"EHLO client.test\r\n"),
+        CommandSpec(b"DATA\r\n"),
+        CommandSpec(b"", body=BodySource(path=path)),
+        CommandSpec(b"QUIT\r\n"),
+    ]
+
+
+@pytest.mark.parametrize("engine", ["sync", "async"])
+def test_large_clean_file_goes_out_by_sendfile_and_is_logged_by_reference(tmp_path, engine):
+    path = tmp_path / "body.eml"
+    data = b"Subject: big\r\n\r\n" + b"y" * 70 + b"\r\n"
+    data *= BODY_CHUNK // len(data) + 10
+    path.write_bytes(data)
+    options = dict(connect_timeout=2, command_timeout=2, banner_timeout=2, body_inline_max=1024, body_log_head=16)
+    with FakeSMTPServer(ServerBehavior()) as server:
+        if engine == "sync":
+            client = SMTPClient("127.0.0.1", port=server.port, **options)
+            try:
+                client.connect()
+                events = client.run_sequence(_body_commands(path))
+            finally:
+                client.close()
+        else:
+            client = AsyncSMTPClient("127.0.0.1", port=server.port, **options)
+
+            async def run() -> list:
+                try:
+                    await client.connect()
+                    return await client.run_sequence(_body_commands(path))
+                finally:
+                    client.close()
+
+            events = asyncio.run(run())
+    (body,) = [event for event in events if event.ref is not None]
+    assert body.payload == data[:16]
+    assert body.ref.size == len(data) + 3
+    assert body.ref.sha256 == hashlib.sha256(data + b".\r\n").hexdigest()
+    assert b"250 2.0.0 queued" in b"".join(bytes(event.payload) for event in events if event.direction == "recv")
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import pytest
+
+from smtp_tester.core.capture import CapturePolicy
+from smtp_tester.core.reply_parser import session_replies
+
+from conftest import events
+
+
+def _ok_session(make_session, body: bytes = b"x" * 300):
+    return make_session(
+        events(
+            ("recv", b"220 hi\r\n"),
+            ("send", b"EHLO client.test\r\nDATA\r\n"),
+            ("recv", b"250 hello\r\n354 go\r\n"),
+            ("send", body + b"\r\n.\r\n"),
+            ("recv", b"250 queued\r\n"),
+        )
+    )
+
+
+def test_from_config_is_none_without_settings():
+    assert CapturePolicy.from_config({}) is None
+    assert CapturePolicy.from_config({"capture_max_bytes": 100}) is not None
+
+
+def test_sample_share_is_validated():
+    with pytest.raises(ValueError):
+        CapturePolicy(success_sample=1.5)
+
+
+def test_failed_and_rejected_sessions_are_kept_in_full(make_session):
+    policy = CapturePolicy(max_bytes=10, success_sample=0.0)
+    failed = _ok_session(make_session)
+    failed.status = "error"
+    rejected = make_session(events(("recv", b"220 hi\r\n"), ("send", b"RCPT TO:<a@b>\r\n"), ("recv", b"550 no\r\n")))
+    for session in (failed, rejected):
+        before = list(session.events)
+        assert policy.apply(session) == {}
+        assert session.events == before and session.capture == {}
+
+
+def test_cap_keeps_head_and_tail(make_session):
+    session = _ok_session(make_session)
+    total = sum(len(event.payload) for event in session.events)
+    capture = CapturePolicy(max_bytes=64, tail_bytes=16).apply(session)
+    assert sum(len(event.payload) for event in session.events) == 64
+    assert capture["omitted_bytes"] == total - 64
+    assert session.events[0].payload == b"220 hi\r\n"
+    assert session.events[-1].payload.endswith(b"250 queued\r\n")
+    assert session.capture == capture
+
+
+def test_hash_replaces_large_sends_with_a_reference(make_session):
+    session = _ok_session(make_session)
+    capture = CapturePolicy(hash_over=100).apply(session)
+    assert capture == {"hashed": 1}
+    body = session.events[3]
+    assert body.payload == b"" and body.ref is not None
+    assert body.ref.size == 305 and body.ref.lines == 2
+
+
+def test_sampling_is_stable_per_session(make_session):
+    policy = CapturePolicy(success_sample=0.5)
+    outcomes = set()
+    for index in range(40):
+        first, second = _ok_session(make_session), _ok_session(make_session)
+        first.target_domain = second.target_domain = f"d{index}.test"
+        outcomes.add(bool(policy.apply(first).get("sampled_out")))
+        assert policy.apply(second) == first.capture
+    assert outcomes == {True, False}
+
+
+def test_sampled_out_session_keeps_only_counts(make_session):
+    session = _ok_session(make_session)
+    capture = CapturePolicy(success_sample=0.0).apply(session)
+    assert capture["sampled_out"] is True
+    assert capture["omitted_events"] == 5
+    assert session.events == []
+
+
+def test_replies_are_taken_before_trimming(make_session):
+    full = session_replies(_ok_session(make_session).events)
+    session = _ok_session(make_session)
+    CapturePolicy(success_sample=0.0).apply(session, keep_replies=True)
+    assert session.events == []
+    assert session.replies == full
+    untouched = _ok_session(make_session)
+    CapturePolicy(success_sample=0.0).apply(untouched)
+    assert untouched.replies is None
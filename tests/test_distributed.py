@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import base64
+import json
+import socket
+import threading
+import time
+from datetime import datetime
+
+from smtp_tester.core.distributed import PROTOCOL_VERSION, Coordinator
+from smtp_tester.core.logger import read_session_file
+from smtp_tester.core.models import CommandTemplate, MXRecord, SessionLog, TaskDefinition
+from smtp_tester.core.segment_log import encode_session
+
+from conftest import events
+
+
+RUN_TS = "20240101T120000"
+
+
+class FakeWorker:
+    """Speaks the coordinator protocol directly, so a test decides what each result carries."""
+
+    def __init__(self, path: str):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        for _ in range(100):
+            try:
+                self.sock.connect(path)
+                break
+            except OSError:
+                time.sleep(0.05)
+        self.stream = self.sock.makefile("rwb")
+        self.send({"op": "hello", "version": PROTOCOL_VERSION, "worker": "fake", "batch": "b0_test", "tasks": ["noop"]})
+        assert self.receive()["op"] == "welcome"
+
+    def send(self, message: dict) -> None:
+        self.stream.write(json.dumps(message).encode("utf-8") + b"\n")
+        self.stream.flush()
+
+    def receive(self) -> dict:
+        return json.loads(self.stream.readline())
+
+    def next(self) -> dict:
+        self.send({"op": "next"})
+        return self.receive()
+
+    def result(self, unit: dict, sessions=None) -> None:
+        if sessions is None:
+            sessions = [base64.b64encode(encode_session(_session(unit))).decode("ascii")]
+        self.send(
+            {"op": "result", "lease": unit["lease"], "stats": {"race_won": 1}, "reachability": [], "sessions": sessions}
+        )
+
+    def close(self) -> None:
+        self.stream.close()
+        self.sock.close()
+
+
+def _session(unit: dict) -> SessionLog:
+    hostname, preference, ip, domain = unit["record"]
+    return SessionLog(
+        batch="b0_test",
+        task="noop",
+        target_domain=domain,
+        mx_hostname=hostname,
+        mx_preference=preference,
+        mx_ip=ip,
+        start_time=datetime(2024, 1, 1, 12, 0, 0),
+        end_time=datetime(2024, 1, 1, 12, 0, 1),
+        status="success",
+        events=events(("recv", b"220 hi\r\n"), ("send", b"QUIT\r\n"), ("recv", b"221 bye\r\n")),
+    )
+
+
+def test_coordinator_survives_malformed_results_and_expired_leases(tmp_path):
+    domains = ("a.test", "b.test", "c.test")
+    records = [MXRecord(f"mx.{domain}", 10, f"192.0.2.{index}", domain) for index, domain in enumerate(domains, 1)]
+    config = {"log_dir": str(tmp_path / "log"), "delay_between_hosts": 0, "lease_timeout": 0.5, "lease_attempts": 3}
+    tasks = [TaskDefinition(name="noop", commands=[CommandTemplate(raw=b"QUIT\r\n")])]
+    path = str(tmp_path / "coordinator.sock")
+    coordinator = Coordinator(tmp_path / "b0_test", config, tasks, iter(records), ("unix", path), run_ts=RUN_TS)
+    outcome: dict = {}
+    thread = threading.Thread(target=lambda: outcome.update(stats=coordinator.run()), daemon=True)
+    thread.start()
+    worker = FakeWorker(path)
+    try:
+        first = worker.next()
+        worker.result(first)
+
+        # A result that does not decode re-queues its unit, which comes back under a new lease.
+        second = worker.next()
+        worker.result(second, sessions=["not base64!"])
+        again = worker.next()
+        assert again["record"] == second["record"] and again["lease"] != second["lease"]
+        worker.result(again)
+
+        # Without renewals the lease expires and the unit is handed out again; the stale result is dropped.
+        third = worker.next()
+        time.sleep(2.0)
+        retried = worker.next()
+        assert retried["record"] == third["record"] and retried["lease"] != third["lease"]
+        worker.result(third)
+        worker.result(retried)
+        assert worker.next()["op"] == "done"
+    finally:
+        worker.close()
+        thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert outcome["stats"]["race_won"] == 3
+    run_dir = tmp_path / "log" / f"b0_test_{RUN_TS}"
+    logged = {path.stem: len(list(read_session_file(path))) for path in run_dir.glob("*.yaml")}
+    assert logged == {"a.test": 1, "b.test": 1, "c.test": 1}
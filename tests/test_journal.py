@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import pytest
+
+from smtp_tester.bench.fake_server import FakeSMTPServer, ServerBehavior
+from smtp_tester.core.async_runner import AsyncBatchRunner
+from smtp_tester.core.journal import JOURNAL_FILE, CompletionJournal
+from smtp_tester.core.logger import read_session_file
+from smtp_tester.core.models import CommandTemplate, MXRecord, TaskDefinition
+from smtp_tester.core.runner import BatchRunner
+
+
+RUN_TS = "20240101T120000"
+
+
+def test_journal_keeps_marks_across_reopens(tmp_path):
+    journal = CompletionJournal(tmp_path)
+    journal.mark("a.test", "192.0.2.1", "noop")
+    journal.mark_many([CompletionJournal.key("a.test", "192.0.2.2", "probe[1]")])
+    journal.close()
+    reopened = CompletionJournal(tmp_path)
+    assert reopened.is_done("a.test", "192.0.2.1", "noop")
+    assert reopened.is_done("a.test", "192.0.2.2", "probe[1]")
+    assert not reopened.is_done("a.test", "192.0.2.2", "noop")
+    reopened.close()
+
+
+def test_line_cut_short_by_a_crash_does_not_count(tmp_path):
+    (tmp_path / JOURNAL_FILE).write_text("a.test\t192.0.2.1\tnoop\nb.test\t192.0.2.2\tno", encoding="utf-8")
+    journal = CompletionJournal(tmp_path)
+    assert journal.completed == {"a.test\t192.0.2.1\tnoop"}
+    journal.mark("c.test", "192.0.2.3", "noop")
+    journal.close()
+    assert CompletionJournal(tmp_path).completed == {"a.test\t192.0.2.1\tnoop", "c.test\t192.0.2.3\tnoop"}
+
+
+def _tasks():
+    commands = [CommandTemplate(raw=b"EHLO client.test\r\n"), CommandTemplate(raw=b"QUIT\r\n")]
+    return [
+        TaskDefinition(name="noop", commands=list(commands)),
+        TaskDefinition(name="probe", commands=list(commands), axes={"size": [1, 2]}),
+    ]
+
+
+def _records():
+    return [MXRecord(f"mx.{domain}", 10, "127.0.0.1", domain) for domain in ("a.test", "b.test")]
+
+
+def _run(engine: str, tmp_path, port: int) -> BatchRunner:
+    config = {
+        "log_dir": str(tmp_path / "log"),
+        "port": port,
+        "delay_between_hosts": 0,
+        "connect_timeout": 2.0,
+        "command_timeout": 2.0,
+        "banner_timeout": 2.0,
+    }
+    batch = tmp_path / "b0_test"
+    if engine == "async":
+        runner: BatchRunner = AsyncBatchRunner(batch, config, _tasks(), iter(_records()), concurrency=3, run_ts=RUN_TS)
+    else:
+        runner = BatchRunner(batch, config, _tasks(), iter(_records()), run_ts=RUN_TS)
+    runner.run()
+    return runner
+
+
+@pytest.mark.parametrize("engine", ["sync", "async"])
+def test_resume_runs_only_what_the_journal_lacks(tmp_path, engine):
+    run_dir = tmp_path / "log" / f"b0_test_{RUN_TS}"
+    run_dir.mkdir(parents=True)
+    # A previous attempt finished a.test's noop session and its first probe variant.
+    (run_dir / JOURNAL_FILE).write_text("a.test\t127.0.0.1\tnoop\na.test\t127.0.0.1\tprobe[0]\n", encoding="utf-8")
+    with FakeSMTPServer(ServerBehavior()) as server:
+        first = _run(engine, tmp_path, server.port)
+        assert first.stats["resumed"] == 2
+        ran = sorted(
+            (session.target_domain, session.task, session.variant.get("index"))
+            for path in run_dir.glob("*.yaml")
+            for session in read_session_file(path)
+        )
+        assert ran == [("a.test", "probe", 1), ("b.test", "noop", None), ("b.test", "probe", 0), ("b.test", "probe", 1)]
+        assert len(CompletionJournal(run_dir).completed) == 6
+        # Everything is journaled now, so resuming again starts no session.
+        second = _run(engine, tmp_path, server.port)
+    assert second.stats["resumed"] == 6
+    assert sum(1 for path in run_dir.glob("*.yaml") for _ in read_session_file(path)) == 4
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import pytest
+
+from smtp_tester.core.models import CommandTemplate, MXRecord, TaskDefinition
+from smtp_tester.core.plan import PlanSummary, compile_plan, plan_meta, read_plan, read_plan_meta, write_plan
+from smtp_tester.core.task_loader import TaskLoader
+
+
+def _task(name: str, **fields) -> TaskDefinition:
+    return TaskDefinition(name=name, commands=[CommandTemplate(raw=b"NOOP\r\n")], **fields)
+
+
+TASKS = [
+    _task("noop", session_reuse=True),
+    _task("rset", session_reuse=True),
+    _task("race", mx_strategy="first_reachable"),
+    _task("only_b", target_values={"b.test": {}}),
+]
+RECORDS = [
+    MXRecord("mx1.a.test", 10, "192.0.2.1", "a.test"),
+    MXRecord("mx2.a.test", 20, "192.0.2.2", "a.test"),
+    MXRecord("mx.b.test", 10, "192.0.2.3", "b.test"),
+]
+
+
+def test_compile_plan_groups_units_per_domain():
+    plan = list(compile_plan(RECORDS, TASKS, reuse=True))
+    assert [planned.domain for planned in plan] == ["a.test", "b.test"]
+    a, b = plan
+    assert a.records == RECORDS[:2] and a.raced == ["race"] and a.units == [("noop", "rset")]
+    assert b.units == [("noop", "rset"), ("only_b",)]
+    assert list(compile_plan(RECORDS, TASKS, names={"noop"}))[0].units == [("noop",)]
+
+
+def test_plan_file_round_trip(tmp_path):
+    path = tmp_path / "run.plan"
+    plan = list(compile_plan(RECORDS, TASKS, reuse=True))
+    with path.open("w", encoding="utf-8") as handle:
+        assert list(write_plan(handle, plan_meta("b0_test", None, TASKS), plan)) == plan
+    assert read_plan_meta(path)["tasks"] == ["noop", "only_b", "race", "rset"]
+    assert list(read_plan(path)) == plan
+
+
+def test_read_plan_rejects_other_files(tmp_path):
+    path = tmp_path / "run.plan"
+    path.write_text("D\ta.test\t\tnoop\n", encoding="utf-8")
+    with pytest.raises(ValueError, match="not a plan file"):
+        list(read_plan(path))
+
+
+def _saved(tmp_path, body: str):
+    path = tmp_path / "run.plan"
+    with path.open("w", encoding="utf-8") as handle:
+        list(write_plan(handle, plan_meta("b0_test", None, TASKS), []))
+        handle.write(body)
+    return path
+
+
+def test_read_plan_rejects_malformed_lines(tmp_path):
+    path = _saved(tmp_path, "D\ta.test\t\tnoop\nR\tmx.a.test\t10\n")
+    with pytest.raises(ValueError, match=r"run.plan:3: malformed plan line"):
+        list(read_plan(path))
+
+
+def test_read_plan_rejects_domains_without_records(tmp_path):
+    path = _saved(tmp_path, "D\ta.test\trace\t\nD\tb.test\t\tnoop\nR\tmx.b.test\t10\t192.0.2.3\n")
+    with pytest.raises(ValueError, match=r"run.plan:2: malformed plan: domain a.test has no R lines"):
+        list(read_plan(path))
+
+
+@pytest.mark.parametrize("name", ["a,b", "a+b", "a\tb"])
+def test_task_names_with_plan_separators_are_rejected(tmp_path, name):
+    (tmp_path / "task.py").write_text(
+        f'TEMPLATES = {{"t": [b"NOOP\\r\\n"]}}\nTASKS = [{{"name": {name!r}, "template": "t"}}]\n', encoding="utf-8"
+    )
+    with pytest.raises(ValueError, match="must be a non-empty string"):
+        TaskLoader(tmp_path).load()
+
+
+def test_summary_counts_and_eta():
+    summary = PlanSummary(expected={name: 1.0 for name in ("noop", "rset", "race", "only_b")}, worst={})
+    summary.worst = dict(summary.expected)
+    for planned in compile_plan(RECORDS, TASKS):
+        summary.add(planned)
+    # a.test: race once + noop, rset per record; b.test: race + noop, rset, only_b.
+    assert summary.sessions == 1 + 4 + 1 + 3
+    assert summary.connections == 9
+    assert summary.per_task["race"] == 2
+    config = {"delay_between_hosts": 0}
+    # b.test's only lane carries its race plus three units: the slowest lane bounds a wide run.
+    assert summary.eta(config, parallel=100) == 4.0
+    assert summary.eta(config, parallel=1) == 9.0
+    # One pause per record, spread over the parallel workers.
+    assert summary.eta({"delay_between_hosts": 1.0}, parallel=1) == 12.0
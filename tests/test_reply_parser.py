@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import pytest
+
+from smtp_tester.core.models import BodyRef, SessionEvent
+from smtp_tester.core.reply_parser import BANNER, BODY, ReplyParser, ReplyTracker, parse_code, session_replies, verb_key
+
+from conftest import events
+
+
+def test_parser_joins_continuation_lines_and_keeps_partial_input():
+    parser = ReplyParser()
+    assert parser.feed(b"250-mx.example.test\r\n250-SIZE 1000\r\n250 HE") == []
+    (reply,) = parser.feed(b"LP\r\n")
+    assert reply.code == 250
+    assert reply.lines == [b"250-mx.example.test", b"250-SIZE 1000", b"250 HELP"]
+
+
+def test_parser_counts_non_smtp_lines_as_replies():
+    (reply,) = ReplyParser().feed(b"HTTP/1.1 400 Bad Request\r\n")
+    assert reply.code == 0
+
+
+def test_session_replies_match_pipelined_commands():
+    replies = session_replies(
+        events(
+            ("recv", b"220 mx.example.test ESMTP\r\n"),
+            ("send", b"EHLO client.test\r\nMAIL FROM:<a@client.test>\r\nRCPT TO:<b@example.test>\r\n"),
+            ("recv", b"250-mx.example.test\r\n250 SIZE\r\n250 2.1.0 ok\r\n550 5.1.1 no such user\r\n"),
+            ("send", b"QUIT\r\n"),
+            ("recv", b"221 bye\r\n"),
+        )
+    )
+    assert [(verb, code) for verb, code, _ in replies] == [
+        ("<banner>", 220),
+        ("EHLO", 250),
+        ("MAIL", 250),
+        ("RCPT", 550),
+        ("QUIT", 221),
+    ]
+    assert replies[1][2] == "250-mx.example.test\n250 SIZE"
+
+
+def test_session_replies_match_a_body_sent_in_pieces():
+    replies = session_replies(
+        events(
+            ("recv", b"220 hi\r\n"),
+            ("send", b"DATA\r\n"),
+            ("recv", b"354 go ahead\r\n"),
+            ("send", b"Subject: x\r\n\r\nhel"),
+            ("send", b"lo\r\n.\r\n"),
+            ("recv", b"250 queued\r\n"),
+        )
+    )
+    assert [(verb, code) for verb, code, _ in replies] == [("<banner>", 220), ("DATA", 354), ("<body>", 250)]
+
+
+def test_refused_data_makes_every_body_line_owe_a_reply():
+    replies = session_replies(
+        events(
+            ("recv", b"220 hi\r\n"),
+            ("send", b"DATA\r\nSubject: x\r\n\r\nbody\r\n.\r\nQUIT\r\n"),
+            ("recv", b"503 need RCPT\r\n500 unknown\r\n500 unknown\r\n500 unknown\r\n500 unknown\r\n221 bye\r\n"),
+        )
+    )
+    assert [(verb, code) for verb, code, _ in replies] == [
+        ("<banner>", 220),
+        ("DATA", 503),
+        ("<body>", 500),
+        ("<body>", 500),
+        ("<body>", 500),
+        ("<body>", 500),
+        ("QUIT", 221),
+    ]
+
+
+def test_refused_data_before_a_body_logged_by_reference():
+    body = SessionEvent(direction="send", payload=b"", ref=BodyRef(size=20, sha256="0" * 64, lines=3))
+    replies = session_replies(
+        [
+            SessionEvent(direction="recv", payload=b"220 hi\r\n"),
+            SessionEvent(direction="send", payload=b"DATA\r\n"),
+            SessionEvent(direction="recv", payload=b"554 no\r\n"),
+            body,
+            SessionEvent(direction="recv", payload=b"500 a\r\n500 b\r\n500 c\r\n"),
+        ]
+    )
+    assert [(verb, code) for verb, code, _ in replies] == [
+        ("<banner>", 220),
+        ("DATA", 554),
+        ("<body>", 500),
+        ("<body>", 500),
+        ("<body>", 500),
+    ]
+
+
+def test_tracker_is_satisfied_once_every_reply_arrived():
+    tracker = ReplyTracker()
+    tracker.sent(b"EHLO client.test\r\n")
+    tracker.done_sending = True
+    tracker.received(b"220 hi\r\n")
+    assert tracker.outstanding == 1 and not tracker.satisfied
+    tracker.received(b"250 ok\r\n")
+    assert tracker.satisfied
+
+
+def test_unterminated_command_keeps_the_tracker_waiting():
+    tracker = ReplyTracker(expect_banner=False)
+    tracker.sent(b"EHLO client.test")
+    tracker.done_sending = True
+    assert not tracker.terminated
+    assert tracker.outstanding == 0
+    assert not tracker.satisfied
+
+
+def test_reply_without_command_is_unsolicited():
+    tracker = ReplyTracker(expect_banner=False)
+    tracker.received(b"421 closing\r\n")
+    assert tracker.exchanges[0][0] == b""
+
+
+@pytest.mark.parametrize(
+    "name, key",
+    [("rcpt", b"RCPT"), (" Mail ", b"MAIL"), ("BANNER", BANNER), ("<banner>", BANNER), ("body", BODY), ("<BODY>", BODY)],
+)
+def test_verb_key(name, key):
+    assert verb_key(name) == key
+
+
+@pytest.mark.parametrize("pattern, expected", [("550", (550, 550)), ("55x", (550, 559)), ("5XX", (500, 599))])
+def test_parse_code(pattern, expected):
+    assert parse_code(pattern) == expected
+
+
+@pytest.mark.parametrize("pattern", ["5", "x50", "5500", "abc"])
+def test_parse_code_rejects_bad_patterns(pattern):
+    with pytest.raises(ValueError):
+        parse_code(pattern)
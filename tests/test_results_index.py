@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import pytest
+
+from smtp_tester.core.logger import SessionLogger, read_session_file
+from smtp_tester.core.models import BodyRef, SessionEvent
+from smtp_tester.core.results_index import ResultsIndex, run_name
+
+from conftest import events
+
+
+def _exchange(make_session, domain: str, rcpt_reply: bytes, **fields):
+    return make_session(
+        events(
+            ("recv", b"220 mx ESMTP\r\n"),
+            ("send", b"EHLO client.test\r\nRCPT TO:<a@b>\r\nDATA\r\n"),
+            ("recv", b"250 hello\r\n" + rcpt_reply + b"354 go\r\n"),
+            ("send", b"Subject: x\r\n\r\nhi\r\n.\r\n"),
+            ("recv", b"250 queued\r\n"),
+        ),
+        target_domain=domain,
+        **fields,
+    )
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = ResultsIndex(tmp_path / "results.sqlite")
+    yield index
+    index.close()
+
+
+def test_read_session_file_round_trip(tmp_path, make_session):
+    logger = SessionLogger(tmp_path, "b0_test", run_ts="20240101T120000")
+    first = _exchange(make_session, "example.test", b"250 ok\r\n", timings={"connect": 0.002, "total": 0.5})
+    first.events.append(SessionEvent(direction="recv", payload=b"\x00\xff binary: 'quoted' \"too\"\r\n"))
+    second = make_session(
+        [
+            SessionEvent(direction="send", payload=b"DATA\r\n"),
+            SessionEvent(direction="send", payload=b"Subject: big", ref=BodyRef(size=5000, sha256="cd" * 32, lines=80)),
+        ],
+        status="error",
+        error="timed out: waiting for reply",
+        source_address="192.0.2.7",
+        variant={"index": 2, "ehlo": "a.test", "size": 10, "flag": True, "nothing": None},
+        capture={"omitted_bytes": 12, "omitted_events": 1, "gap_at": 1},
+    )
+    for session in (first, second):
+        logger.log_session(session)
+    logger.close()
+    assert list(read_session_file(logger.run_dir / "example.test.yaml")) == [first, second]
+
+
+def test_summary_and_find(index, make_session):
+    run_id = index.run_id("b0_test", "20240101T120000")
+    sessions = [
+        _exchange(make_session, "a.test", b"250 ok\r\n"),
+        _exchange(make_session, "b.test", b"550 5.1.1 unknown\r\n", task="matrix", variant={"index": 4, "ehlo": "x"}),
+        _exchange(make_session, "c.test", b"451 try later\r\n", status="error", error="boom"),
+    ]
+    assert index.add(run_id, sessions) == 3
+    assert index.session_count(run_id) == 3
+    summary = index.summary(run_id)
+    assert summary["status success"] == 2 and summary["status error"] == 1
+    assert summary["<banner> 220"] == 3
+    assert summary["RCPT 250"] == 1 and summary["RCPT 550"] == 1 and summary["RCPT 451"] == 1
+    assert summary["<body> 250"] == 3
+
+    assert index.find(run_id, verb="rcpt", code="5xx") == [("b.test", "192.0.2.1", "matrix[4]", "RCPT", 550, "550 5.1.1 unknown")]
+    assert [row[0] for row in index.find(run_id, code="45x")] == ["c.test"]
+    assert [row[3] for row in index.find(run_id, verb="BANNER")] == ["<banner>"] * 3
+    assert [row[3] for row in index.find(run_id, verb="<body>")] == ["<body>"] * 3
+    assert len(index.find(run_id, verb="body", limit=2)) == 2
+    with pytest.raises(ValueError):
+        index.find(run_id, code="5")
+
+
+def test_add_prefers_replies_kept_before_trimming(index, make_session):
+    run_id = index.run_id("b0_test", "20240101T120000")
+    session = _exchange(make_session, "a.test", b"250 ok\r\n")
+    session.replies = [("RCPT", 550, "550 counted")]
+    session.events = []
+    index.add(run_id, [session])
+    assert index.summary(run_id) == {"status success": 1, "RCPT 550": 1}
+
+
+def test_rebuild_replaces_a_runs_rows(tmp_path, index, make_session):
+    logger = SessionLogger(tmp_path, "b0_test", run_ts="20240101T120000")
+    logger.log_session(_exchange(make_session, "a.test", b"550 no\r\n"))
+    logger.close()
+    assert run_name(logger.run_dir) == ("b0_test", "20240101T120000")
+    assert index.rebuild(logger.run_dir) == 1
+    assert index.rebuild(logger.run_dir) == 1
+    run_id = index.run_id("b0_test", "20240101T120000", create=False)
+    assert index.session_count(run_id) == 1
+    assert index.summary(run_id)["RCPT 550"] == 1
+
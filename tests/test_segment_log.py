@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import random
+
+import pytest
+
+from smtp_tester.core.models import BodyRef, SessionEvent
+from smtp_tester.core.segment_log import (
+    SEGMENT_DIR,
+    SegmentLogger,
+    SegmentReader,
+    convert_segments,
+    decode_session,
+    encode_session,
+)
+
+from conftest import events
+
+
+def _full_session(make_session, **fields):
+    session = make_session(
+        events(("recv", b"220 hi\r\n"), ("send", b"EHLO client.test\r\n"), ("recv", b"250 \xff ok\r\n")),
+        error=None,
+        source_address="192.0.2.100",
+        timings={"connect": 0.01, "total": 0.25},
+        variant={"index": 3, "ehlo": "a.test"},
+        capture={"hashed": 1},
+        **fields,
+    )
+    session.events.append(SessionEvent(direction="send", payload=b"Subj", ref=BodyRef(size=900, sha256="ab" * 32, lines=12)))
+    return session
+
+
+def test_encode_decode_round_trip(make_session):
+    session = _full_session(make_session)
+    assert decode_session(encode_session(session)) == session
+
+
+def test_replies_are_not_encoded(make_session):
+    session = _full_session(make_session)
+    session.replies = [("EHLO", 250, "250 ok")]
+    assert decode_session(encode_session(session)).replies is None
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "lzma"])
+def test_logger_and_reader_round_trip(tmp_path, make_session, compression):
+    logger = SegmentLogger(tmp_path, "b0_test", run_ts="20240101T120000", segment_size=200, compression=compression)
+    sessions = [_full_session(make_session, target_domain=f"d{index}.test") for index in range(5)]
+    sessions[4].variant = {}
+    for session in sessions:
+        logger.log_session(session)
+    logger.close()
+    reader = SegmentReader(logger.run_dir)
+    assert list(reader.iter_sessions()) == sessions
+    assert len(list((logger.run_dir / SEGMENT_DIR).glob("segment-*"))) > 1
+    # The index names parametric variants as name[i].
+    assert [entry[1] for entry in reader.iter_index()] == ["probe[3]"] * 4 + ["probe"]
+    assert reader.lookup("d2.test", task="probe[3]") == [sessions[2]]
+    assert reader.lookup("d2.test", task="probe") == []
+
+
+def test_truncated_segment_is_read_up_to_the_cut(tmp_path, make_session):
+    logger = SegmentLogger(tmp_path, "b0_test", run_ts="20240101T120000", compression="gzip")
+    sessions = [_full_session(make_session, target_domain=f"d{index}.test") for index in range(20)]
+    for index, session in enumerate(sessions):
+        # Incompressible payloads, so half the segment holds several complete records.
+        session.events.append(SessionEvent(direction="recv", payload=random.Random(index).randbytes(400)))
+        logger.log_session(session)
+    logger.close()
+    (segment,) = (logger.run_dir / SEGMENT_DIR).glob("segment-*")
+    data = segment.read_bytes()
+    segment.write_bytes(data[: len(data) // 2])
+    with pytest.raises(ValueError, match="Truncated"):
+        list(SegmentReader(logger.run_dir).iter_sessions())
+    truncated: list = []
+    counts = convert_segments(logger.run_dir, truncated)
+    assert truncated == [segment.name]
+    converted = sum(counts.values())
+    assert 0 < converted < len(sessions)
+    assert sorted(path.name for path in logger.run_dir.glob("*.yaml")) == sorted(f"{domain}.yaml" for domain in counts)
+
+
+def test_convert_refuses_a_run_with_yaml_logs(tmp_path, make_session):
+    logger = SegmentLogger(tmp_path, "b0_test", run_ts="20240101T120000")
+    logger.log_session(_full_session(make_session))
+    logger.close()
+    convert_segments(logger.run_dir)
+    with pytest.raises(ValueError, match="already contains YAML logs"):
+        convert_segments(logger.run_dir)
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import pytest
+
+from smtp_tester.bench.fake_server import FakeSMTPServer, ServerBehavior
+from smtp_tester.core.models import CommandSpec
+from smtp_tester.core.reply_parser import BANNER, BODY, ReplyTracker
+from smtp_tester.core.smtp_client import SMTPClient
+from smtp_tester.core.stop_rules import StopWatch, parse_stop_rules
+
+
+def test_parse_rules_with_verbs_and_pseudo_verbs():
+    (rule,) = parse_stop_rules("probe", [{"codes": ["5xx", "421"], "after": ["rcpt", "BANNER", "<body>"], "action": "quit"}])
+    assert rule.codes == ((500, 599), (421, 421))
+    assert rule.verbs == frozenset({b"RCPT", BANNER, BODY})
+    assert rule.action == "quit"
+    assert rule.matches(b"RCPT", 550)
+    assert rule.matches(BANNER, 421)
+    assert not rule.matches(b"MAIL", 550)
+    assert not rule.matches(b"RCPT", 450)
+
+
+def test_rule_without_verbs_matches_any_reply():
+    (rule,) = parse_stop_rules("probe", [{"codes": 554}])
+    assert rule.action == "abort"
+    assert rule.matches(b"", 554) and rule.matches(b"EHLO", 554)
+
+
+@pytest.mark.parametrize(
+    "entries, message",
+    [
+        ({"codes": "5xx"}, "must be a list"),
+        (["5xx"], "must be dicts with codes"),
+        ([{"codes": "5xx", "when": "now"}], "unknown key"),
+        ([{"codes": "5xx", "action": "retry"}], "action must be one of"),
+        ([{"codes": "5x"}], "invalid reply code"),
+        ([{"codes": []}], "at least one code"),
+        ([{"codes": "5xx", "after": {"verb": "RCPT"}}], "must be a string or a list"),
+    ],
+)
+def test_parse_rules_rejects_bad_entries(entries, message):
+    with pytest.raises(ValueError, match=message):
+        parse_stop_rules("probe", entries)
+
+
+def test_watch_checks_each_reply_once_and_keeps_the_first_hit():
+    watch = StopWatch(parse_stop_rules("probe", [{"codes": "5xx", "after": "RCPT"}]))
+    tracker = ReplyTracker()
+    tracker.sent(b"EHLO client.test\r\nMAIL FROM:<>\r\nRCPT TO:<a@example.test>\r\nRCPT TO:<b@example.test>\r\n")
+    tracker.received(b"220 hi\r\n250 hello\r\n550 no sender\r\n")
+    # MAIL got the 550, and the rule only looks at RCPT.
+    assert watch.check(tracker) is None
+    tracker.received(b"550 5.1.1 unknown user\r\n550 5.1.1 also unknown\r\n")
+    hit = watch.check(tracker)
+    assert hit is not None and hit.verb == b"RCPT"
+    assert hit.reply.lines == [b"550 5.1.1 unknown user"]
+    assert watch.check(tracker) is hit
+    assert "stopped after RCPT: '550 5.1.1 unknown user'" in hit.describe()
+
+
+def test_watch_sees_the_reply_to_a_body():
+    watch = StopWatch(parse_stop_rules("probe", [{"codes": "554", "after": "body"}]))
+    tracker = ReplyTracker(expect_banner=False)
+    tracker.sent(b"DATA\r\nSubject: x\r\n\r\nhello\r\n.\r\n")
+    tracker.received(b"354 go\r\n554 rejected as spam\r\n")
+    hit = watch.check(tracker)
+    assert hit is not None and hit.verb == BODY
+
+
+def test_lockstep_client_stops_before_the_next_command():
+    rules = parse_stop_rules("probe", [{"codes": "250", "after": "MAIL", "action": "quit"}])
+    commands = [
+        CommandSpec(b"EHLO client.test\r\n"),
+        CommandSpec(b"MAIL FROM:<a@client.test>\r\n"),
+        CommandSpec(b"RCPT TO:<b@example.test>\r\n"),
+    ]
+    with FakeSMTPServer(ServerBehavior()) as server:
+        client = SMTPClient("127.0.0.1", port=server.port, connect_timeout=2, command_timeout=2, banner_timeout=2)
+        client.connect()
+        try:
+            events = client.run_sequence(commands, stop_on=rules, lockstep=True)
+        finally:
+            client.close()
+    sent = b"".join(bytes(event.payload) for event in events if event.direction == "send")
+    assert b"RCPT" not in sent
+    assert sent.endswith(b"QUIT\r\n")
+    assert client.stop is not None and client.stop.verb == b"MAIL" and client.stop.quit_sent